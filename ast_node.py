@@ -1,84 +1,206 @@
+import sys
+from weakref import KeyedRef
+
+
+# Nodes are hash-consed: building a node structurally equal to a live one returns the existing
+# object, so repeated subtrees like `n - 1` are stored once. Since children are themselves
+# interned, a node is identified by its class and its fields, and identity doubles as O(1)
+# structural equality and hashing. Nodes are immutable; params and args are stored as tuples.
+# The table holds nodes through weak references, like a WeakValueDictionary but without its
+# per-lookup Python overhead, so nodes that are no longer used anywhere drop out of it.
+# Source positions are the one exception to sharing, see copy_node.
+class InternTable:
+    def __init__(self):
+        self.refs = {}          # (class, *fields) -> weak reference to the live node with those fields
+        self.requested = 0      # Nodes constructed, including the ones shared
+        self.shared = {}        # Class -> constructions answered with an existing node
+
+        refs = self.refs
+
+        def remove(ref):
+            if refs.get(ref.key) is ref:
+                del refs[ref.key]
+
+        self.remove = remove
+
+    def intern(self, cls, key):
+        # The key is the class followed by the field values in slot order
+        self.requested += 1
+        ref = self.refs.get(key)
+        if ref is not None:
+            node = ref()
+            if node is not None:
+                self.shared[cls] = self.shared.get(cls, 0) + 1
+                return node
+        node = object.__new__(cls)
+        for slot, value in zip(cls.__slots__, key[1:]):
+            object.__setattr__(node, slot, value)
+        self.refs[key] = KeyedRef(node, self.remove, key)
+        return node
+
+    def __len__(self):
+        return len(self.refs)
+
+    def saved_bytes(self):
+        # Only the node objects themselves are counted, not the tuples of params and args
+        return sum(count * sys.getsizeof(object.__new__(cls)) for cls, count in self.shared.items())
+
+    def report(self):
+        return f"AST nodes: {self.requested} constructed, {len(self.refs)} unique alive, " \
+               f"{sum(self.shared.values())} shared, about {self.saved_bytes()} bytes saved"
+
+
+INTERN_TABLE = InternTable()
+
 
 class ASTNode:
-    pass
+    __slots__ = ('__weakref__',)
+
+    def __setattr__(self, name, value):
+        raise AttributeError(f"{type(self).__name__} nodes are immutable")
+
+    def __delattr__(self, name):
+        raise AttributeError(f"{type(self).__name__} nodes are immutable")
+
+    def __reduce__(self):
+        # Unpickling calls the constructor, so the node is interned again in the receiving process,
+        # and a private copy is copied again from the interned node
+        fields = tuple(getattr(self, slot) for slot in self.__slots__)
+        shared = self.__class__(*fields)
+        if shared is self:
+            return self.__class__, fields
+        return copy_node, (shared,)
 
 
 class FunctionDefinition(ASTNode):
-    def __init__(self, name, params, body):
-        self.name = name
-        self.params = params
-        self.body = body
+    __slots__ = ('name', 'params', 'body')
+
+    def __new__(cls, name, params, body):
+        params = tuple(params)
+        return INTERN_TABLE.intern(cls, (cls, name, params, body))
 
     def __repr__(self):
-        return f"FunctionDefinition(name={self.name}, params={self.params}, body={self.body})"
+        return f"FunctionDefinition(name={self.name}, params={list(self.params)}, body={self.body})"
 
 
 class LambdaExpression(ASTNode):
-    def __init__(self, params, body):
-        self.params = params  # List of parameters
-        self.body = body
+    __slots__ = ('params', 'body')
+
+    def __new__(cls, params, body):
+        # A lambda has a single parameter name
+        return INTERN_TABLE.intern(cls, (cls, params, body))
 
     def __repr__(self):
         return f"LambdaExpression(params={self.params}, body={self.body})"
 
 
 class FunctionApplication(ASTNode):
-    def __init__(self, func, args):
-        self.func = func
-        self.args = args
+    __slots__ = ('func', 'args')
+
+    def __new__(cls, func, args):
+        args = tuple(args)
+        return INTERN_TABLE.intern(cls, (cls, func, args))
+
+    def __repr__(self):
+        return f"FunctionApplication(func={self.func}, args={list(self.args)})"
+
+
+class PrimitiveApplication(ASTNode):
+    __slots__ = ('name', 'args')
+
+    def __new__(cls, name, args):
+        # A call of a builtin from primitives.PRIMITIVES, bound by the parser
+        args = tuple(args)
+        return INTERN_TABLE.intern(cls, (cls, name, args))
 
     def __repr__(self):
-        return f"FunctionApplication(func={self.func}, args={self.args})"
+        return f"PrimitiveApplication(name={self.name}, args={list(self.args)})"
 
 
 class IfStatement(ASTNode):
-    def __init__(self, condition, consequence, alternative=None):
-        self.condition = condition      # The condition to evaluate
-        self.consequence = consequence  # The block to execute if the condition is true
-        self.alternative = alternative  # The block to execute if the condition is false
+    __slots__ = ('condition', 'consequence', 'alternative')
+
+    def __new__(cls, condition, consequence, alternative=None):
+        # The condition to evaluate, the block to execute if it is true and the block to execute
+        # if it is false
+        return INTERN_TABLE.intern(cls, (cls, condition, consequence, alternative))
 
     def __repr__(self):
         return f"IfStatement(condition={self.condition}, consequence={self.consequence}, alternative={self.alternative})"
 
 
 class BinaryOperation(ASTNode):
-    def __init__(self, left, operator, right):
-        self.left = left
-        self.operator = operator
-        self.right = right
+    __slots__ = ('left', 'operator', 'right')
+
+    def __new__(cls, left, operator, right):
+        return INTERN_TABLE.intern(cls, (cls, left, operator, right))
 
     def __repr__(self):
         return f"BinaryOperation(left={self.left}, operator={self.operator}, right={self.right})"
 
 
 class UnaryOperation(ASTNode):
-    def __init__(self, operator, operand):
-        self.operator = operator
-        self.operand = operand
+    __slots__ = ('operator', 'operand')
+
+    def __new__(cls, operator, operand):
+        return INTERN_TABLE.intern(cls, (cls, operator, operand))
 
     def __repr__(self):
         return f"UnaryOperation(operator={self.operator}, operand={self.operand})"
 
 
 class IntegerLiteral(ASTNode):
-    def __init__(self, value):
-        self.value = value
+    __slots__ = ('value',)
+
+    def __new__(cls, value):
+        # The type is part of the key because True == 1
+        return INTERN_TABLE.intern(cls, (cls, value, type(value)))
 
     def __repr__(self):
         return f"IntegerLiteral(value={self.value})"
 
 
 class BooleanLiteral(ASTNode):
-    def __init__(self, value):
-        self.value = value
+    __slots__ = ('value',)
+
+    def __new__(cls, value):
+        return INTERN_TABLE.intern(cls, (cls, value, type(value)))
 
     def __repr__(self):
         return f"BooleanLiteral(value={self.value})"
 
 
 class Identifier(ASTNode):
-    def __init__(self, name):
-        self.name = name
+    __slots__ = ('name',)
+
+    def __new__(cls, name):
+        return INTERN_TABLE.intern(cls, (cls, name))
 
     def __repr__(self):
         return f"Identifier(name={self.name})"
+
+
+# A private copy of node, outside the intern table. errors.locate gives one to each further
+# place a subtree is written at, so each place keeps its own source position.
+def copy_node(node):
+    copy = object.__new__(type(node))
+    for slot in type(node).__slots__:
+        object.__setattr__(copy, slot, getattr(node, slot))
+    return copy
+
+
+# The interned node structurally equal to node, which may be or hold private copies; memo maps
+# the nodes already seen to theirs
+def canonical(node, memo):
+    result = memo.get(node)
+    if result is None:
+        fields = []
+        for slot in type(node).__slots__:
+            value = getattr(node, slot)
+            if isinstance(value, ASTNode):
+                value = canonical(value, memo)
+            elif isinstance(value, tuple):
+                value = tuple(canonical(item, memo) if isinstance(item, ASTNode) else item for item in value)
+            fields.append(value)
+        result = memo[node] = type(node)(*fields)
+    return result
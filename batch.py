@@ -0,0 +1,210 @@
+import re
+
+from ast_node import FunctionDefinition, LambdaExpression, FunctionApplication, PrimitiveApplication, \
+    Identifier, IntegerLiteral, BooleanLiteral, UnaryOperation, BinaryOperation, IfStatement
+from compiler import call_function, lambda_chain
+
+try:
+    import numpy as np
+except ImportError:  # NumPy is optional, without it every batch runs through the interpreter
+    np = None
+
+
+# Integers beyond this magnitude are left to Python, which never overflows
+INT_LIMIT = 2 ** 62
+
+
+class NotVectorizable(Exception):
+    pass
+
+
+def parse_value(text):
+    if text == 'True':
+        return True
+    if text == 'False':
+        return False
+    return int(text)
+
+
+def read_rows(file):
+    # One argument tuple per line, with values separated by commas or whitespace
+    rows = []
+    for line in file:
+        line = line.strip()
+        if line and not line.startswith('#'):
+            rows.append(tuple(parse_value(text) for text in re.split(r'[\s,]+', line) if text))
+    return rows
+
+
+# Evaluates one Defun over many argument tuples. Bodies made of literals, parameters, operators and
+# if/else are lifted to element-wise NumPy operations, with masks standing in for the branches.
+# Each lifted value is a pair of an int64 array and an array flagging which lanes hold booleans,
+# so results keep exactly the type the scalar interpreter would return. Lanes that would raise,
+# overflow int64 or return None are recomputed one by one by the interpreter, as are whole
+# batches whose function is recursive or otherwise not vectorizable.
+class BatchEvaluator:
+    def __init__(self, interpreter):
+        self.interpreter = interpreter  # A CompiledInterpreter in which the Defun has been defined
+        self.name = None
+        self.path = None
+        self.reason = None
+        self.rows = 0
+        self.scalar_rows = 0
+        self.failed = None
+
+    def map(self, definition, rows):
+        self.name = definition.name
+        self.rows = len(rows)
+        global_scope = self.interpreter.compiler.resolver.global_scope
+        func = global_scope.values[global_scope.lookup(definition.name)]
+
+        try:
+            if np is None:
+                raise NotVectorizable("NumPy is not installed")
+            results = self.map_vectorized(definition, rows, func)
+            self.path = 'vectorized'
+            return results
+        except NotVectorizable as e:
+            self.path = 'scalar'
+            self.reason = str(e)
+            self.scalar_rows = len(rows)
+            return [self.call_scalar(func, row) for row in rows]
+
+    def call_scalar(self, func, row):
+        try:
+            return call_function(func, list(row))
+        except Exception as e:
+            return e
+
+    def map_vectorized(self, definition, rows, func):
+        count = len(rows)
+        params = definition.params
+        if any(len(row) != len(params) for row in rows):
+            raise NotVectorizable(f"some inputs do not have {len(params)} values")
+
+        columns = {}
+        for index, name in enumerate(params):
+            values = [row[index] for row in rows]
+            if any(abs(value) > INT_LIMIT for value in values):
+                raise NotVectorizable(f"inputs of '{name}' do not fit in 64 bits")
+            columns[name] = (np.array(values, dtype=np.int64),
+                             np.array([isinstance(value, bool) for value in values], dtype=bool))
+
+        self.failed = np.zeros(count, dtype=bool)
+        with np.errstate(all='ignore'):
+            data, is_bool = self.lift(definition.body, definition.name, columns, np.ones(count, dtype=bool))
+
+        results = []
+        data = np.broadcast_to(data, (count,)).tolist()
+        is_bool = np.broadcast_to(is_bool, (count,)).tolist()
+        for row, value, boolean, failed in zip(rows, data, is_bool, self.failed.tolist()):
+            if failed:
+                self.scalar_rows += 1
+                results.append(self.call_scalar(func, row))
+            else:
+                results.append(bool(value) if boolean else value)
+        return results
+
+    def lift(self, node, name, columns, mask):
+        if isinstance(node, IntegerLiteral):
+            if abs(node.value) > INT_LIMIT:
+                raise NotVectorizable("an integer literal does not fit in 64 bits")
+            return np.int64(node.value), False
+
+        elif isinstance(node, BooleanLiteral):
+            return np.int64(node.value), True
+
+        elif isinstance(node, Identifier):
+            if node.name not in columns:
+                raise NotVectorizable(f"'{node.name}' is not a parameter")
+            return columns[node.name]
+
+        elif isinstance(node, UnaryOperation):
+            data, _ = self.lift(node.operand, name, columns, mask)
+            return (data == 0).astype(np.int64), True
+
+        elif isinstance(node, BinaryOperation):
+            return self.lift_binary_operation(node, name, columns, mask)
+
+        elif isinstance(node, IfStatement):
+            condition, _ = self.lift(node.condition, name, columns, mask)
+            truthy = condition != 0
+            consequence, consequence_bool = self.lift(node.consequence, name, columns, mask & truthy)
+            if node.alternative is None:
+                # The scalar result is None there, which only the interpreter produces
+                self.failed |= mask & ~truthy
+                alternative, alternative_bool = np.int64(0), False
+            else:
+                alternative, alternative_bool = self.lift(node.alternative, name, columns, mask & ~truthy)
+            return np.where(truthy, consequence, alternative), np.where(truthy, consequence_bool, alternative_bool)
+
+        elif isinstance(node, FunctionApplication) and isinstance(node.func, LambdaExpression) \
+                and len(lambda_chain(node.func)[0]) == len(node.args):
+            # A lambda applied to all its arguments, like the bindings of the inliner, only names
+            # lifted values
+            params, body = lambda_chain(node.func)
+            values = [self.lift(arg, name, columns, mask) for arg in node.args]
+            return self.lift(body, name, {**columns, **dict(zip(params, values))}, mask)
+
+        elif isinstance(node, FunctionApplication):
+            if node.func == name:
+                raise NotVectorizable(f"'{name}' is recursive")
+            raise NotVectorizable(f"'{name}' calls another function")
+
+        elif isinstance(node, PrimitiveApplication):
+            raise NotVectorizable(f"'{name}' calls the builtin '{node.name}'")
+
+        elif isinstance(node, LambdaExpression):
+            raise NotVectorizable(f"'{name}' creates a lambda expression")
+
+        else:
+            raise NotVectorizable(f"unsupported node {type(node).__name__}")
+
+    def lift_binary_operation(self, node, name, columns, mask):
+        left, _ = self.lift(node.left, name, columns, mask)
+        truthy = left != 0
+
+        # The right side only runs in the lanes the short-circuit lets through
+        if node.operator == '||':
+            right, right_bool = self.lift(node.right, name, columns, mask & ~truthy)
+            return np.where(truthy, 1, right), np.where(truthy, True, right_bool)
+        if node.operator == '&&':
+            right, right_bool = self.lift(node.right, name, columns, mask & truthy)
+            return np.where(truthy, right, 0), np.where(truthy, right_bool, True)
+
+        right, _ = self.lift(node.right, name, columns, mask)
+        op = node.operator
+
+        if op in ('+', '-', '*'):
+            approximate = {'+': np.add, '-': np.subtract, '*': np.multiply}[op](
+                np.asarray(left, dtype=np.float64), np.asarray(right, dtype=np.float64))
+            self.failed |= mask & (np.abs(approximate) > INT_LIMIT)
+            exact = {'+': np.add, '-': np.subtract, '*': np.multiply}[op](left, right)
+            return exact, False
+        if op in ('/', '%'):
+            # Lanes dividing by zero raise in the interpreter
+            zero = right == 0
+            self.failed |= mask & zero
+            divisor = np.where(zero, 1, right)
+            # floor_divide and remainder round towards negative infinity, like Python's // and %
+            return (np.floor_divide(left, divisor) if op == '/' else np.remainder(left, divisor)), False
+
+        comparisons = {'==': np.equal, '!=': np.not_equal, '>': np.greater, '<': np.less,
+                       '>=': np.greater_equal, '<=': np.less_equal}
+        if op in comparisons:
+            return comparisons[op](left, right).astype(np.int64), True
+        raise NotVectorizable(f"unknown operator {op}")
+
+    def report(self):
+        if self.path == 'vectorized':
+            return f"{self.name}: vectorized over {self.rows} input(s), " \
+                   f"{self.scalar_rows} recomputed by the interpreter"
+        return f"{self.name}: interpreted {self.rows} input(s) one by one ({self.reason})"
+
+
+def find_definition(statements, name):
+    definition = None
+    for node in statements:
+        if isinstance(node, FunctionDefinition) and node.name == name:
+            definition = node
+    return definition
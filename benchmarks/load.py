@@ -0,0 +1,102 @@
+import argparse
+import asyncio
+import json
+import os
+import sys
+import time
+
+BENCHMARK_DIR = os.path.dirname(os.path.abspath(__file__))
+# The interpreter modules live at the top of the repository
+sys.path.insert(0, os.path.dirname(BENCHMARK_DIR))
+
+from batch import parse_value
+
+
+# Load generator for `main.py --serve`: registers a program, then keeps `concurrency` calls in
+# flight, each connection waiting for its response before sending the next call, and reports
+# throughput and latency percentiles as seen by the client
+async def request(reader, writer, message):
+    writer.write(json.dumps(message).encode() + b'\n')
+    await writer.drain()
+    return json.loads(await reader.readline())
+
+
+async def client(options, call, count, latencies, failures):
+    reader, writer = await asyncio.open_connection(options.host, options.port, limit=2 ** 24)
+    try:
+        for _ in range(count):
+            started = time.perf_counter()
+            response = await request(reader, writer, call)
+            latencies.append(time.perf_counter() - started)
+            if not response['ok']:
+                failures.append(response['error'])
+    finally:
+        writer.close()
+
+
+def percentile(values, fraction):
+    return values[min(len(values) - 1, int(fraction * len(values)))]
+
+
+async def run(options):
+    with open(options.program, 'r') as file:
+        source = file.read()
+    program = os.path.basename(options.program)
+    call = {'op': 'call', 'program': program, 'function': options.function,
+            'args': [parse_value(arg) for arg in options.args]}
+
+    reader, writer = await asyncio.open_connection(options.host, options.port, limit=2 ** 24)
+    response = await request(reader, writer, {'op': 'register', 'program': program, 'source': source})
+    if not response['ok']:
+        raise SystemExit(response['error'])
+    # One call per worker process or so, so every worker has compiled the program before timing
+    for _ in range(options.warmup):
+        await request(reader, writer, call)
+
+    latencies = []
+    failures = []
+    concurrency = max(1, min(options.concurrency, options.requests))
+    counts = [options.requests // concurrency + (index < options.requests % concurrency)
+              for index in range(concurrency)]
+    started = time.perf_counter()
+    await asyncio.gather(*(client(options, call, count, latencies, failures) for count in counts))
+    elapsed = time.perf_counter() - started
+
+    metrics = await request(reader, writer, {'op': 'metrics'})
+    writer.close()
+
+    latencies.sort()
+    print(f"{len(latencies)} calls of {options.function}({', '.join(options.args)}) with "
+          f"{concurrency} concurrent connection(s) in {elapsed:.3f}s")
+    print(f"throughput: {len(latencies) / elapsed:.1f} calls/s")
+    print(f"latency: p50 {percentile(latencies, 0.50) * 1000:.3f} ms, "
+          f"p99 {percentile(latencies, 0.99) * 1000:.3f} ms, max {latencies[-1] * 1000:.3f} ms")
+    if failures:
+        print(f"{len(failures)} failed, first error: {failures[0]}")
+    print(f"server: {metrics['metrics']}")
+
+
+def parse_load_arguments(argv=None):
+    arg_parser = argparse.ArgumentParser(description="Load generator for the Lambda Interpreter server")
+    arg_parser.add_argument('program', help=".lambda file to register")
+    arg_parser.add_argument('function', help="Defun of the program to call")
+    arg_parser.add_argument('args', nargs='*', help="arguments of each call")
+    arg_parser.add_argument('--host', default='127.0.0.1', help="server address (default: 127.0.0.1)")
+    arg_parser.add_argument('--port', type=int, default=7777, help="server port (default: 7777)")
+    arg_parser.add_argument('--requests', type=int, default=1000, help="calls to send (default: 1000)")
+    arg_parser.add_argument('--concurrency', type=int, default=8,
+                            help="connections sending calls at the same time (default: 8)")
+    arg_parser.add_argument('--warmup', type=int, default=16,
+                            help="untimed calls sent first, so the workers compile the program (default: 16)")
+    return arg_parser.parse_args(argv)
+
+
+def main(argv=None):
+    try:
+        asyncio.run(run(parse_load_arguments(argv)))
+    except ConnectionError as e:
+        raise SystemExit(f"Could not reach the server: {e}")
+
+
+if __name__ == "__main__":
+    main()
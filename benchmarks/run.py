@@ -0,0 +1,245 @@
+import argparse
+import io
+import json
+import os
+import platform
+import sys
+import time
+import tracemalloc
+from contextlib import redirect_stdout
+
+BENCHMARK_DIR = os.path.dirname(os.path.abspath(__file__))
+PROGRAM_DIR = os.path.join(BENCHMARK_DIR, 'programs')
+# The interpreter modules live at the top of the repository
+sys.path.insert(0, os.path.dirname(BENCHMARK_DIR))
+
+from ast_node import FunctionDefinition, LambdaExpression, FunctionApplication, PrimitiveApplication, \
+    BinaryOperation, UnaryOperation, IfStatement
+from lexer import Lexer
+from main import ENGINES, create_interpreter, parse_arguments
+from inliner import rewrite_program
+from optimizer import Optimizer
+from parser import Parser
+
+
+STAGES = ('lex', 'parse', 'eval')
+# Peaks below this are dominated by one-off allocations and are not checked for growth
+MIN_PEAK_BYTES = 64 * 1024
+# A program starting with a line `# Engines: cek, vm` only runs on those engines
+ENGINES_MARKER = '# Engines:'
+
+
+def generate_program(functions):
+    # A large flat program of small Defuns and calls to them, to stress the lexer and parser
+    lines = []
+    for index in range(functions):
+        lines.append(f"Defun {{name: f{index}, arguments: (x, y,)}}")
+        lines.append(f"    if (x > {index}) {{(x * y + {index}) % 97}} else {{!(y == x) && (x - y)}}")
+        lines.append(f"f{index}({index + 1}, (Lambd z.(z + {index}))(2))")
+    return '\n'.join(lines) + '\n'
+
+
+def program_engines(code):
+    for line in code.splitlines():
+        if not line.startswith('#'):
+            break
+        if line.startswith(ENGINES_MARKER):
+            return {engine.strip() for engine in line[len(ENGINES_MARKER):].split(',')}
+    return None
+
+
+def load_programs(names, generated_size, engine):
+    programs = {}
+    for entry in sorted(os.listdir(PROGRAM_DIR)):
+        if entry.endswith('.lambda'):
+            with open(os.path.join(PROGRAM_DIR, entry), 'r') as file:
+                programs[entry[:-len('.lambda')]] = file.read()
+    if generated_size > 0:
+        programs['generated'] = generate_program(generated_size)
+    if names:
+        unknown = set(names) - set(programs)
+        if unknown:
+            raise SystemExit(f"Unknown benchmark(s): {', '.join(sorted(unknown))}")
+        programs = {name: programs[name] for name in names}
+    supported = {}
+    for name, code in programs.items():
+        engines = program_engines(code)
+        if engines is None or engine in engines:
+            supported[name] = code
+        elif names:
+            raise SystemExit(f"Benchmark '{name}' only runs on the {', '.join(sorted(engines))} engine(s)")
+    return supported
+
+
+def count_nodes(node):
+    if isinstance(node, (list, tuple)):
+        return sum(count_nodes(child) for child in node)
+    if isinstance(node, (FunctionDefinition, LambdaExpression)):
+        return 1 + count_nodes(node.body)
+    if isinstance(node, FunctionApplication):
+        func = 0 if isinstance(node.func, str) else count_nodes(node.func)
+        return 1 + func + count_nodes(node.args)
+    if isinstance(node, PrimitiveApplication):
+        return 1 + count_nodes(node.args)
+    if isinstance(node, BinaryOperation):
+        return 1 + count_nodes(node.left) + count_nodes(node.right)
+    if isinstance(node, UnaryOperation):
+        return 1 + count_nodes(node.operand)
+    if isinstance(node, IfStatement):
+        alternative = count_nodes(node.alternative) if node.alternative is not None else 0
+        return 1 + count_nodes(node.condition) + count_nodes(node.consequence) + alternative
+    return 1
+
+
+def best_time(function, repeat):
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def peak_memory(function):
+    # Run separately from the timing, since tracing allocations slows everything down
+    tracemalloc.start()
+    try:
+        function()
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+def measure(function, ops, repeat):
+    seconds = best_time(function, repeat)
+    return {
+        'seconds': seconds,
+        'ops': ops,
+        'ops_per_second': ops / seconds if seconds > 0 else 0.0,
+        'peak_bytes': peak_memory(function),
+    }
+
+
+def benchmark(code, options, repeat):
+    tokens = Lexer(code).tokenize()
+
+    def parse():
+        # Parsing includes the optimizer and the inliner when they are enabled, as in main.load_file
+        ast = Parser(tokens).parse()
+        if not options.optimize:
+            return ast
+        return rewrite_program(Optimizer().optimize(ast), options.inline, options.cse)
+
+    def evaluate():
+        with redirect_stdout(io.StringIO()):
+            create_interpreter(ast, options).interpret()
+
+    results = {
+        'lex': measure(lambda: Lexer(code).tokenize(), len(tokens), repeat),
+        # No tree is kept alive while parsing is measured, otherwise every node would already be
+        # interned and parsing would allocate next to nothing
+        'parse': measure(parse, count_nodes(parse()), repeat),
+    }
+    ast = parse()
+    results['eval'] = measure(evaluate, len(ast), repeat)
+    return results
+
+
+def compare(results, baseline, threshold, min_seconds):
+    # A stage regresses when its time or its peak memory grew by more than the threshold. Stages
+    # faster than min_seconds are too noisy to judge by time.
+    regressions = []
+    for name, stages in results.items():
+        for stage, current in stages.items():
+            previous = baseline.get('results', {}).get(name, {}).get(stage)
+            if previous is None:
+                continue
+            for metric in ('seconds', 'peak_bytes'):
+                if current[metric] < (min_seconds if metric == 'seconds' else MIN_PEAK_BYTES):
+                    continue
+                if previous[metric] > 0 and current[metric] > previous[metric] * (1 + threshold):
+                    change = current[metric] / previous[metric] - 1
+                    regressions.append(f"{name} {stage}: {metric} {previous[metric]:.6g} -> "
+                                       f"{current[metric]:.6g} (+{change:.0%})")
+    return regressions
+
+
+def report(results):
+    lines = [f"{'benchmark':<16}{'stage':<7}{'time (s)':>11}{'ops':>10}{'ops/sec':>14}{'peak (KiB)':>12}"]
+    for name, stages in results.items():
+        for stage, result in stages.items():
+            lines.append(f"{name:<16}{stage:<7}{result['seconds']:>11.4f}{result['ops']:>10}"
+                         f"{result['ops_per_second']:>14,.0f}{result['peak_bytes'] / 1024:>12,.0f}")
+    return '\n'.join(lines)
+
+
+def parse_benchmark_arguments(argv=None):
+    arg_parser = argparse.ArgumentParser(description="Lambda Interpreter benchmarks")
+    arg_parser.add_argument('names', nargs='*', help="benchmarks to run (default: all)")
+    arg_parser.add_argument('--engine', choices=sorted(ENGINES), default='compiled',
+                            help="evaluation engine (default: compiled)")
+    arg_parser.add_argument('--memo-size', type=int, default=10000,
+                            help="entries kept per memoized Defun, 0 disables memoization (default: 10000)")
+    arg_parser.add_argument('--no-optimize', dest='optimize', action='store_false',
+                            help="skip constant folding between parsing and evaluation")
+    arg_parser.add_argument('--no-inline', dest='inline', action='store_false',
+                            help="do not copy small non-recursive Defuns into their callers")
+    arg_parser.add_argument('--no-cse', dest='cse', action='store_false',
+                            help="do not share repeated subexpressions containing calls")
+    arg_parser.add_argument('--repeat', type=int, default=5,
+                            help="runs per stage, the fastest is reported (default: 5)")
+    arg_parser.add_argument('--generated-size', type=int, default=5000,
+                            help="Defuns in the generated lexer and parser benchmark, 0 skips it (default: 5000)")
+    arg_parser.add_argument('--save', metavar='FILE', help="write the results as a JSON baseline")
+    arg_parser.add_argument('--compare', metavar='FILE', help="fail if a stage regressed against this baseline")
+    arg_parser.add_argument('--threshold', type=float, default=0.20,
+                            help="allowed slowdown or memory growth before failing (default: 0.20)")
+    arg_parser.add_argument('--min-time', type=float, default=0.005,
+                            help="stages faster than this many seconds are not checked for slowdowns (default: 0.005)")
+    return arg_parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_benchmark_arguments(argv)
+    options = parse_arguments(['--engine', args.engine, '--memo-size', str(args.memo_size)]
+                              + ([] if args.optimize else ['--no-optimize'])
+                              + ([] if args.inline else ['--no-inline'])
+                              + ([] if args.cse else ['--no-cse']))
+
+    results = {}
+    for name, code in load_programs(args.names, args.generated_size, args.engine).items():
+        results[name] = benchmark(code, options, args.repeat)
+    print(report(results))
+
+    if args.save:
+        baseline = {
+            'engine': args.engine,
+            'memo_size': args.memo_size,
+            'optimize': args.optimize,
+            'inline': args.inline,
+            'cse': args.cse,
+            'python': platform.python_version(),
+            'results': results,
+        }
+        with open(args.save, 'w') as file:
+            json.dump(baseline, file, indent=2)
+        print(f"Baseline written to '{args.save}'")
+
+    if args.compare:
+        with open(args.compare, 'r') as file:
+            baseline = json.load(file)
+        if baseline.get('engine') != args.engine:
+            print(f"Warning: the baseline was recorded with the '{baseline.get('engine')}' engine")
+        regressions = compare(results, baseline, args.threshold, args.min_time)
+        if regressions:
+            print(f"Regressions beyond {args.threshold:.0%}:")
+            for regression in regressions:
+                print(f"  {regression}")
+            return 1
+        print(f"No regressions beyond {args.threshold:.0%} against '{args.compare}'")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,249 @@
+from array import array
+from functools import partial
+
+from ast_node import FunctionDefinition, LambdaExpression, FunctionApplication, PrimitiveApplication, \
+    Identifier, IntegerLiteral, BooleanLiteral, UnaryOperation, BinaryOperation, IfStatement
+from compiler import lambda_chain
+from primitives import PRIMITIVES
+from resolver import Resolver, Scope, captured_names, holds_only
+
+
+# Every instruction is an (opcode, argument) pair of integers
+LOAD_CONST = 0      # Push consts[arg]
+LOAD_LOCAL = 1      # Push argument slot arg of the current frame
+LOAD_DEREF = 2      # Push the argument at addresses[arg] = (depth, slot) of an enclosing frame
+LOAD_GLOBAL = 3     # Push global slot arg
+STORE_GLOBAL = 4    # Pop into global slot arg
+BINOP = 5           # Pop right and left, push BINARY_OPERATORS[arg](left, right)
+NOT = 6             # Replace the top of the stack with its logical negation
+JUMP = 7            # Continue at instruction offset arg
+JUMP_IF_FALSE = 8   # Pop, continue at offset arg if the value is falsy
+CALL = 9            # Pop arg arguments and the function below them, push the result
+TAIL_CALL = 10      # Like CALL, but the callee replaces the current activation
+MAKE_CLOSURE = 11   # Push a closure of functions[arg] over the values it captures
+RETURN = 12         # Pop the result and return it to the caller
+PRIMITIVE = 13      # Pop the arguments of builtin PRIMITIVE_NAMES[arg], push its result
+LET = 14            # Pop arg values into a new frame enclosed by the current one, which it replaces
+END_LET = 15        # Return to the frame enclosing the current one
+
+OPCODE_NAMES = ['LOAD_CONST', 'LOAD_LOCAL', 'LOAD_DEREF', 'LOAD_GLOBAL', 'STORE_GLOBAL', 'BINOP', 'NOT',
+                'JUMP', 'JUMP_IF_FALSE', 'CALL', 'TAIL_CALL', 'MAKE_CLOSURE', 'RETURN', 'PRIMITIVE', 'LET',
+                'END_LET']
+
+BINARY_OPERATOR_SYMBOLS = ['+', '-', '*', '/', '%', '==', '!=', '>', '<', '>=', '<=']
+PRIMITIVE_NAMES = sorted(PRIMITIVES)
+
+
+class CodeObject:
+    def __init__(self, name, params):
+        self.name = name                  # Function name, None for a lambda or a top-level statement
+        self.params = params              # Tuple of parameters for Defun, a single parameter for Lambd
+        self.instructions = array('i')    # Flat (opcode, argument) pairs
+        self.consts = []                  # Literal values
+        self.addresses = []               # (depth, slot) pairs for LOAD_DEREF
+        self.functions = []               # Nested CodeObjects for MAKE_CLOSURE
+        self.captures = ()                # (depth, slot) of the values MAKE_CLOSURE copies into the
+                                          # closure's frame, None to share the current frame
+        self.sites = {}                   # Offset of each CALL and TAIL_CALL -> its FunctionApplication
+        self.lets = []                    # (LET offset, END_LET offset, FunctionApplication), inner first
+
+    def emit(self, opcode, arg=0):
+        self.instructions.append(opcode)
+        self.instructions.append(arg)
+        return len(self.instructions) - 2
+
+    def patch(self, offset, target):
+        self.instructions[offset + 1] = target
+
+    def here(self):
+        return len(self.instructions)
+
+    def add_const(self, value):
+        # Identity keeps True and 1 apart, which compare equal
+        for index, const in enumerate(self.consts):
+            if const is value:
+                return index
+        self.consts.append(value)
+        return len(self.consts) - 1
+
+    def __repr__(self):
+        return f"CodeObject(name={self.name}, params={self.params}, size={len(self.instructions) // 2})"
+
+
+# Compiles the AST into CodeObjects, resolving identifiers to lexical addresses on the way
+class BytecodeCompiler:
+    def __init__(self, resolver=None):
+        self.resolver = resolver if resolver is not None else Resolver()
+
+    def compile_statement(self, node):
+        code = CodeObject(None, None)
+        if isinstance(node, FunctionDefinition):
+            slot = self.resolver.global_scope.declare(node.name)
+            # Defun only appears at top level, so its body sees its parameters and the globals
+            code.functions.append(self.compile_function(node.name, node.params, node.body, Scope(node.params)))
+            code.emit(MAKE_CLOSURE, 0)
+            code.emit(STORE_GLOBAL, slot)
+            code.emit(LOAD_CONST, code.add_const(None))
+        else:
+            self.compile_node(node, code, None, True)
+        code.emit(RETURN)
+        return code
+
+    def compile_function(self, name, params, body, scope):
+        code = CodeObject(name, params)
+        self.compile_node(body, code, scope, True)
+        code.emit(RETURN)
+        return code
+
+    def compile_node(self, node, code, scope, tail):
+        # Works through an explicit stack instead of recursing, so that deeply nested expressions,
+        # like a long chain of operators, need no Python stack. An entry is a subtree to compile,
+        # as (node, scope, tail), or a step to take once the entries above it are done; each node
+        # lists its parts in order and pushes them reversed, so they pop in that order.
+        work = [(node, scope, tail)]
+        while work:
+            item = work.pop()
+            if not isinstance(item, tuple):
+                item()
+                continue
+            node, scope, tail = item
+            marks = []  # Offsets of the jumps and LET a step emitted, for the steps after it
+
+            if isinstance(node, (IntegerLiteral, BooleanLiteral)):
+                self.load_const(code, node.value)
+                continue
+
+            elif isinstance(node, Identifier):
+                self.compile_lookup(node.name, code, scope)
+                continue
+
+            elif isinstance(node, BinaryOperation):
+                steps = self.binary_operation_steps(node, code, scope, tail, marks)
+
+            elif isinstance(node, UnaryOperation):
+                if node.operator != '!':
+                    raise TypeError(f"Unknown unary operator: {node.operator}")
+                steps = [(node.operand, scope, False), partial(code.emit, NOT)]
+
+            elif isinstance(node, FunctionDefinition):
+                raise SyntaxError("Defun is only allowed at the top level")
+
+            elif isinstance(node, LambdaExpression):
+                # The closure's frame holds only the variables the lambda uses, see Compiler.compile_lambda
+                captured = captured_names(node, scope)
+                if holds_only(scope, captured):
+                    function = self.compile_function(None, node.params, node.body, Scope([node.params], scope))
+                    function.captures = None
+                else:
+                    function = self.compile_function(None, node.params, node.body,
+                                                     Scope([node.params], Scope(captured) if captured else None))
+                    function.captures = tuple(scope.lookup(name) for name in captured)
+                code.functions.append(function)
+                code.emit(MAKE_CLOSURE, len(code.functions) - 1)
+                continue
+
+            elif isinstance(node, FunctionApplication) and isinstance(node.func, LambdaExpression) \
+                    and len(lambda_chain(node.func)[0]) == len(node.args):
+                # A lambda applied to all its arguments, like the bindings of the inliner, runs in
+                # the current activation, with a frame of its own for its parameters
+                params, body = lambda_chain(node.func)
+                steps = [(arg, scope, False) for arg in node.args] + [
+                    partial(self.mark, code, marks, LET, len(params)),
+                    (body, Scope(params, scope), tail and scope is not None),
+                    partial(self.end_let, code, marks, node)]
+
+            elif isinstance(node, FunctionApplication):
+                if isinstance(node.func, str):
+                    steps = [partial(self.compile_lookup, node.func, code, scope)]
+                else:
+                    steps = [(node.func, scope, False)]
+                steps += [(arg, scope, False) for arg in node.args]
+                # Top-level statements have no activation to replace
+                steps.append(partial(self.call, code, node, TAIL_CALL if tail and scope is not None else CALL))
+
+            elif isinstance(node, PrimitiveApplication):
+                steps = [(arg, scope, False) for arg in node.args]
+                steps.append(partial(code.emit, PRIMITIVE, PRIMITIVE_NAMES.index(node.name)))
+
+            elif isinstance(node, IfStatement):
+                if node.alternative is not None:
+                    alternative = (node.alternative, scope, tail)
+                else:
+                    alternative = partial(self.load_const, code, None)
+                steps = [(node.condition, scope, False), partial(self.mark, code, marks, JUMP_IF_FALSE),
+                         (node.consequence, scope, tail), partial(self.mark, code, marks, JUMP),
+                         partial(self.land, code, marks, 0), alternative, partial(self.land, code, marks, 1)]
+
+            else:
+                raise TypeError(f"Unknown node type: {type(node)}")
+            work.extend(reversed(steps))
+
+    def load_const(self, code, value):
+        code.emit(LOAD_CONST, code.add_const(value))
+
+    def mark(self, code, marks, opcode, arg=0):
+        marks.append(code.emit(opcode, arg))
+
+    def land(self, code, marks, index):
+        # Points the jump emitted at marks[index] to the next instruction
+        code.patch(marks[index], code.here())
+
+    def end_let(self, code, marks, node):
+        code.lets.append((marks[0], code.emit(END_LET), node))
+
+    def call(self, code, node, opcode):
+        code.sites[code.emit(opcode, len(node.args))] = node
+
+    def compile_lookup(self, name, code, scope):
+        depth, slot = self.resolver.resolve(name, scope)
+        if depth is None:
+            code.emit(LOAD_GLOBAL, slot)
+        elif depth == 0:
+            code.emit(LOAD_LOCAL, slot)
+        else:
+            code.addresses.append((depth, slot))
+            code.emit(LOAD_DEREF, len(code.addresses) - 1)
+
+    def binary_operation_steps(self, node, code, scope, tail, marks):
+        left = (node.left, scope, False)
+        # Short-circuit logical operators: || yields True for a truthy left side, && yields False
+        # for a falsy one, and otherwise both yield the right side
+        if node.operator == '||':
+            return [left, partial(self.mark, code, marks, JUMP_IF_FALSE),
+                    partial(self.load_const, code, True), partial(self.mark, code, marks, JUMP),
+                    partial(self.land, code, marks, 0), (node.right, scope, tail), partial(self.land, code, marks, 1)]
+        if node.operator == '&&':
+            return [left, partial(self.mark, code, marks, JUMP_IF_FALSE), (node.right, scope, tail),
+                    partial(self.mark, code, marks, JUMP), partial(self.land, code, marks, 0),
+                    partial(self.load_const, code, False), partial(self.land, code, marks, 1)]
+
+        if node.operator not in BINARY_OPERATOR_SYMBOLS:
+            raise TypeError(f"Unknown operator: {node.operator}")
+        return [left, (node.right, scope, False),
+                partial(code.emit, BINOP, BINARY_OPERATOR_SYMBOLS.index(node.operator))]
+
+def disassemble(code, indent=''):
+    title = code.name if code.name is not None else ('<lambda>' if code.params is not None else '<statement>')
+    lines = [f"{indent}code {title} params={code.params}:"]
+    instructions = code.instructions
+    for offset in range(0, len(instructions), 2):
+        opcode, arg = instructions[offset], instructions[offset + 1]
+        if opcode == LOAD_CONST:
+            detail = f"({code.consts[arg]!r})"
+        elif opcode == LOAD_DEREF:
+            detail = "(depth {}, slot {})".format(*code.addresses[arg])
+        elif opcode == BINOP:
+            detail = f"({BINARY_OPERATOR_SYMBOLS[arg]})"
+        elif opcode == PRIMITIVE:
+            detail = f"({PRIMITIVE_NAMES[arg]})"
+        elif opcode == MAKE_CLOSURE:
+            function = code.functions[arg]
+            detail = f"({function.name or '<lambda>'})"
+        elif opcode in (NOT, RETURN, END_LET):
+            arg, detail = '', ''
+        else:
+            detail = ''
+        lines.append(f"{indent}  {offset:>5} {OPCODE_NAMES[opcode]:<14} {arg} {detail}".rstrip())
+    for function in code.functions:
+        lines.append(disassemble(function, indent + '    '))
+    return '\n'.join(lines)
@@ -0,0 +1,151 @@
+import hashlib
+import marshal
+import os
+
+from ast_node import FunctionDefinition, LambdaExpression, FunctionApplication, PrimitiveApplication, \
+    Identifier, IntegerLiteral, BooleanLiteral, UnaryOperation, BinaryOperation, IfStatement
+from errors import SPANS, locate
+
+
+MAGIC = b'LMBC'
+# Bump whenever the AST or its encoding changes, so stale cache files are rebuilt
+FORMAT_VERSION = 7
+CACHE_DIR_NAME = '__lambdacache__'
+
+# Node tags of the encoding
+INTEGER, BOOLEAN, IDENTIFIER, BINARY, UNARY, DEFUN, LAMBDA, APPLICATION, IF, PRIMITIVE = range(10)
+
+
+# Encodes the AST as nested tuples of plain values, which marshal stores compactly
+def encode(node):
+    if isinstance(node, IntegerLiteral):
+        return INTEGER, node.value
+    elif isinstance(node, BooleanLiteral):
+        return BOOLEAN, node.value
+    elif isinstance(node, Identifier):
+        return IDENTIFIER, node.name
+    elif isinstance(node, BinaryOperation):
+        return BINARY, node.operator, encode(node.left), encode(node.right)
+    elif isinstance(node, UnaryOperation):
+        return UNARY, node.operator, encode(node.operand)
+    elif isinstance(node, FunctionDefinition):
+        return DEFUN, node.name, tuple(node.params), encode(node.body)
+    elif isinstance(node, LambdaExpression):
+        return LAMBDA, node.params, encode(node.body)
+    elif isinstance(node, FunctionApplication):
+        func = node.func if isinstance(node.func, str) else encode(node.func)
+        return APPLICATION, func, tuple(encode(arg) for arg in node.args), SPANS.get(node)
+    elif isinstance(node, PrimitiveApplication):
+        return PRIMITIVE, node.name, tuple(encode(arg) for arg in node.args)
+    elif isinstance(node, IfStatement):
+        alternative = encode(node.alternative) if node.alternative is not None else None
+        return IF, encode(node.condition), encode(node.consequence), alternative
+    else:
+        raise TypeError(f"Unknown node type: {type(node)}")
+
+
+def decode(data):
+    tag = data[0]
+    if tag == INTEGER:
+        return IntegerLiteral(data[1])
+    elif tag == BOOLEAN:
+        return BooleanLiteral(data[1])
+    elif tag == IDENTIFIER:
+        return Identifier(data[1])
+    elif tag == BINARY:
+        return BinaryOperation(decode(data[2]), data[1], decode(data[3]))
+    elif tag == UNARY:
+        return UnaryOperation(data[1], decode(data[2]))
+    elif tag == DEFUN:
+        return FunctionDefinition(data[1], list(data[2]), decode(data[3]))
+    elif tag == LAMBDA:
+        return LambdaExpression(data[1], decode(data[2]))
+    elif tag == APPLICATION:
+        func = data[1] if isinstance(data[1], str) else decode(data[1])
+        node = FunctionApplication(func, [decode(arg) for arg in data[2]])
+        return locate(node, data[3]) if data[3] is not None else node
+    elif tag == PRIMITIVE:
+        return PrimitiveApplication(data[1], [decode(arg) for arg in data[2]])
+    elif tag == IF:
+        alternative = decode(data[3]) if data[3] is not None else None
+        return IfStatement(decode(data[1]), decode(data[2]), alternative)
+    else:
+        raise ValueError(f"Unknown node tag in cache file: {tag}")
+
+
+# A .pyc-style cache of parsed programs. Each entry starts with a header holding the magic
+# number, the format version and the SHA-256 of the source it was built from, along with the
+# --max-int-bits limit an optimized entry was folded under; an entry whose header does not match
+# the current source and limit is a miss and gets rebuilt.
+class ProgramCache:
+    def __init__(self, cache_dir=None):
+        self.cache_dir = cache_dir  # None keeps entries in __lambdacache__ next to each source file
+        self.hits = 0
+        self.misses = 0
+
+    def path_for(self, filename, optimized):
+        directory = self.cache_dir
+        if directory is None:
+            directory = os.path.join(os.path.dirname(os.path.abspath(filename)), CACHE_DIR_NAME)
+        suffix = '.opt.lmc' if optimized else '.lmc'
+        return os.path.join(directory, os.path.basename(filename) + suffix)
+
+    def header(self, source, int_bits):
+        digest = hashlib.sha256(source.encode('utf-8'))
+        if int_bits is not None:
+            digest.update(f"\0{int_bits}".encode('ascii'))
+        return MAGIC + FORMAT_VERSION.to_bytes(2, 'little') + digest.digest()
+
+    def load(self, filename, source, optimized, int_bits=None):
+        header = self.header(source, int_bits if optimized else None)
+        try:
+            with open(self.path_for(filename, optimized), 'rb') as file:
+                if file.read(len(header)) != header:
+                    self.misses += 1
+                    return None
+                statements, spans = marshal.load(file)
+                ast = [locate(node, span) if span is not None else node
+                       for node, span in zip(map(decode, statements), spans)]
+        except (OSError, EOFError, ValueError, TypeError, IndexError):
+            self.misses += 1
+            return None
+        self.hits += 1
+        return ast
+
+    def store(self, filename, source, optimized, ast, int_bits=None):
+        path = self.path_for(filename, optimized)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # Write to a temporary file first so concurrent runs never see a half-written entry
+        temporary = f"{path}.{os.getpid()}.tmp"
+        with open(temporary, 'wb') as file:
+            file.write(self.header(source, int_bits if optimized else None))
+            # Statement positions are stored beside the statements, call positions inside them
+            marshal.dump((tuple(encode(node) for node in ast), tuple(SPANS.get(node) for node in ast)), file)
+        os.replace(temporary, path)
+
+    def clear(self, paths):
+        removed = 0
+        for path in paths:
+            if os.path.isdir(path):
+                if self.cache_dir is not None:
+                    directory = self.cache_dir
+                elif os.path.basename(os.path.normpath(path)) == CACHE_DIR_NAME:
+                    directory = path
+                else:
+                    directory = os.path.join(path, CACHE_DIR_NAME)
+                if not os.path.isdir(directory):
+                    continue
+                for entry in os.listdir(directory):
+                    if entry.endswith('.lmc'):
+                        os.remove(os.path.join(directory, entry))
+                        removed += 1
+            else:
+                for optimized in (False, True):
+                    entry = self.path_for(path, optimized)
+                    if os.path.exists(entry):
+                        os.remove(entry)
+                        removed += 1
+        return removed
+
+    def report(self):
+        return f"Program cache: {self.hits} hit(s), {self.misses} miss(es)"
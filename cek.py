@@ -0,0 +1,193 @@
+from ast_node import FunctionDefinition, LambdaExpression, FunctionApplication, PrimitiveApplication, \
+    Identifier, IntegerLiteral, BooleanLiteral, UnaryOperation, BinaryOperation, IfStatement
+from errors import trace_call
+from interpreter import Interpreter
+
+
+# Continuation frames pushed on the explicit stack, tagged by their first element
+BINARY_LEFT = 0   # (tag, node, env): the left operand is being evaluated
+BINARY_RIGHT = 1  # (tag, node, left value): the right operand is being evaluated
+UNARY = 2         # (tag, node): the operand is being evaluated
+CALLEE = 3        # (tag, node, env): the function of a lambda call is being evaluated
+ARGUMENTS = 4     # (tag, node, env, func, values): the next argument is being evaluated
+BRANCH = 5        # (tag, node, env): the condition of an if-statement is being evaluated
+CURRY = 6         # (tag, args): remaining arguments for the lambda being returned
+PRIMITIVE = 7     # (tag, node, env, values): the next argument of a builtin is being evaluated
+RETURN = 8        # (tag, node): the body of the call at node is running, see CEKInterpreter.apply
+
+
+# Evaluates with an explicit continuation stack (control, environment, continuation) instead of
+# Python recursion. A function body replaces the current control without pushing a return frame,
+# so calls in tail position run in constant stack and deep recursion only costs heap memory.
+class CEKInterpreter(Interpreter):
+    def eval(self, node, env):
+        stack = []
+        depth = self.limits.depth if self.limits is not None else 0
+        try:
+            return self.run(node, env, stack)
+        except Exception as e:
+            # The calls still running are the RETURN frames, innermost on top
+            for frame in reversed(stack):
+                if frame[0] == RETURN:
+                    trace_call(e, frame[1])
+            if self.limits is not None:
+                self.limits.depth = depth
+            raise
+
+    def run(self, node, env, stack):
+        value = None
+
+        while True:
+            if node is not None:
+                # Evaluate the control node, either producing a value or descending into a child
+                if isinstance(node, IntegerLiteral) or isinstance(node, BooleanLiteral):
+                    value = node.value
+                    node = None
+
+                elif isinstance(node, Identifier):
+                    value = env.get(node.name)
+                    node = None
+
+                elif isinstance(node, BinaryOperation):
+                    stack.append((BINARY_LEFT, node, env))
+                    node = node.left
+
+                elif isinstance(node, UnaryOperation):
+                    stack.append((UNARY, node))
+                    node = node.operand
+
+                elif isinstance(node, FunctionDefinition):
+                    env.set(node.name, (node.params, node.body, env))
+                    value = None
+                    node = None
+
+                elif isinstance(node, LambdaExpression):
+                    value = self.closure(node, env)
+                    node = None
+
+                elif isinstance(node, FunctionApplication):
+                    if isinstance(node.func, (str, LambdaExpression)):
+                        if isinstance(node.func, str):
+                            func = env.get(node.func)
+                        else:  # Applied on the spot, not worth flattening, see Interpreter.closure
+                            func = node.func.params, node.func.body, env
+                        if node.args:
+                            stack.append((ARGUMENTS, node, env, func, []))
+                            node = node.args[0]
+                        else:
+                            node, env, value = self.apply(func, [], stack, node)
+                    else:
+                        stack.append((CALLEE, node, env))
+                        node = node.func
+
+                elif isinstance(node, PrimitiveApplication):
+                    # Every builtin takes at least one argument
+                    stack.append((PRIMITIVE, node, env, []))
+                    node = node.args[0]
+
+                elif isinstance(node, IfStatement):
+                    stack.append((BRANCH, node, env))
+                    node = node.condition
+
+                else:
+                    raise TypeError(f"Unknown node type: {type(node)}")
+                continue
+
+            # Return the value to the innermost continuation
+            if not stack:
+                return value
+            frame = stack.pop()
+            tag = frame[0]
+
+            if tag == BINARY_LEFT:
+                _, node, env = frame
+                # Short-circuit logical operators exactly like the tree-walker
+                if node.operator == '||' and value:
+                    value = True
+                    node = None
+                elif node.operator == '&&' and not value:
+                    value = False
+                    node = None
+                else:
+                    stack.append((BINARY_RIGHT, node, value))
+                    node = node.right
+
+            elif tag == BINARY_RIGHT:
+                _, operation, left = frame
+                value = self.apply_operator(operation.operator, left, value)
+
+            elif tag == UNARY:
+                value = self.apply_unary_operator(frame[1].operator, value)
+
+            elif tag == CALLEE:
+                _, call, env = frame
+                if call.args:
+                    stack.append((ARGUMENTS, call, env, value, []))
+                    node = call.args[0]
+                else:
+                    node, env, value = self.apply(value, [], stack, call)
+
+            elif tag == ARGUMENTS:
+                _, call, env, func, values = frame
+                values.append(value)
+                if len(values) < len(call.args):
+                    stack.append(frame)
+                    node = call.args[len(values)]
+                else:
+                    node, env, value = self.apply(func, values, stack, call)
+
+            elif tag == BRANCH:
+                _, branch, env = frame
+                if value:
+                    node = branch.consequence
+                elif branch.alternative is not None:
+                    node = branch.alternative
+                else:
+                    value = None
+
+            elif tag == CURRY:
+                node, env, value = self.apply(value, frame[1], stack)
+
+            elif tag == PRIMITIVE:
+                _, call, env, values = frame
+                values.append(value)
+                if len(values) < len(call.args):
+                    stack.append(frame)
+                    node = call.args[len(values)]
+                else:
+                    value = self.primitives[call.name][1](*values)
+
+            elif tag == RETURN:
+                if self.limits is not None:
+                    self.limits.depth -= 1
+
+    # Returns the next (control, environment, value) of the machine after a call.
+    # The callee body becomes the new control in place of the caller, which makes tail calls free.
+    # A call made at site is marked by a RETURN frame while it runs; in tail position it replaces
+    # the caller's, so only the calls whose callers wait for them are live frames and in traces.
+    def apply(self, func, args, stack, site=None):
+        limits = self.limits
+        if site is not None:
+            if stack and stack[-1][0] == RETURN:
+                stack[-1] = (RETURN, site)
+            else:
+                stack.append((RETURN, site))
+                if limits is not None:
+                    limits.enter()
+        if limits is not None:
+            limits.step()
+        if not (isinstance(func, tuple) and len(func) == 3):
+            raise TypeError(f"Expected a function or lambda expression, but got: {func}")
+        params, body, closure_env = func
+
+        if isinstance(params, tuple):  # Regular function call
+            if len(params) != len(args):
+                raise TypeError(f"Function expected {len(params)} arguments but got {len(args)}")
+            return body, closure_env.extend(params, args), None
+
+        # Lambda expression, curried one argument at a time
+        if not args:
+            return None, closure_env, func
+        if len(args) > 1:
+            stack.append((CURRY, args[1:]))
+        return body, closure_env.extend([params], args[:1]), None
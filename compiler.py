@@ -0,0 +1,578 @@
+import operator
+
+from ast_node import FunctionDefinition, LambdaExpression, FunctionApplication, PrimitiveApplication, \
+    Identifier, IntegerLiteral, BooleanLiteral, UnaryOperation, BinaryOperation, IfStatement
+from errors import trace_call
+from interpreter import Interpreter
+from lazy import Thunk, contains_call, strict_parameters
+from primitives import PRIMITIVES
+from resolver import Resolver, Scope, UNDEFINED, captured_names, holds_only
+
+
+def divide(left, right):
+    if right == 0:
+        raise ZeroDivisionError("Division by zero is not allowed")
+    return left // right
+
+
+# Operators are resolved once at compile time instead of on every evaluation
+OPERATORS = {
+    '+': operator.add,
+    '-': operator.sub,
+    '*': operator.mul,
+    '/': divide,
+    '%': operator.mod,
+    '==': operator.eq,
+    '!=': operator.ne,
+    '>': operator.gt,
+    '<': operator.lt,
+    '>=': operator.ge,
+    '<=': operator.le,
+}
+
+# The same operators as Python source, for subtrees fused into a single expression
+FUSED_OPERATORS = {'+', '-', '*', '%', '==', '!=', '>', '<', '>=', '<='}
+ARITHMETIC_OPERATORS = {'+', '-', '*', '/', '%'}
+
+
+class Frame:
+    __slots__ = ('values', 'parent')
+
+    def __init__(self, values, parent):
+        self.values = values  # Argument values, indexed by the slots the resolver assigned
+        self.parent = parent  # Frame of the lexically enclosing function, None at top level
+
+
+class Function:
+    __slots__ = ('name', 'params', 'body', 'frame')
+
+    def __init__(self, name, params, body, frame):
+        self.name = name
+        self.params = params  # Tuple of parameters for Defun, a single parameter for Lambd
+        self.body = body      # Compiled closure of the function body
+        self.frame = frame
+
+    def __repr__(self):
+        if self.name is not None:
+            return f"<function {self.name}>"
+        return f"<lambda {self.params}>"
+
+
+# A chain of nested lambdas like Lambd x.(Lambd y. body). It is applied one argument at a time
+# like any lambda, but also carries its innermost body compiled to take all of the chain's
+# parameters in a single frame, used when a call supplies them all at once.
+class LambdaChain(Function):
+    __slots__ = ('arity', 'flat')
+
+    def __init__(self, params, body, frame, arity, flat):
+        super().__init__(None, params, body, frame)
+        self.arity = arity  # Parameters in the chain
+        self.flat = flat    # Compiled innermost body, taking a frame of all the parameters
+
+
+def lambda_chain(node):
+    # Parameters and innermost body of the lambdas nested directly in node. The chain stops
+    # before a parameter that shadows an earlier one, since a frame has one slot per name.
+    params = [node.params]
+    body = node.body
+    while isinstance(body, LambdaExpression) and body.params not in params:
+        params.append(body.params)
+        body = body.body
+    return params, body
+
+
+def call_function(func, args):
+    if not isinstance(func, Function):
+        raise TypeError(f"Expected a function or lambda expression, but got: {func}")
+
+    if isinstance(func.params, tuple):  # Regular function call
+        if len(func.params) != len(args):
+            raise TypeError(f"Function expected {len(func.params)} arguments but got {len(args)}")
+        return func.body(Frame(args, func.frame))
+
+    # Lambda expression, curried one argument at a time
+    if func.__class__ is LambdaChain and len(args) >= func.arity:
+        # The whole chain is applied at once, without its intermediate lambdas
+        func, args = func.flat(Frame(args[:func.arity], func.frame)), args[func.arity:]
+    for arg in args:
+        if not isinstance(func, Function):
+            raise TypeError(f"Expected a function or lambda expression, but got: {func}")
+        func = func.body(Frame([arg], func.frame))
+    return func
+
+
+# Turns AST nodes into trees of specialized Python closures taking the current frame
+class Compiler:
+    def __init__(self, resolver=None, memoizer=None, profiler=None, laziness=None, fusible=None, jit=None,
+                 limits=None):
+        self.resolver = resolver if resolver is not None else Resolver()
+        self.globals = self.resolver.global_scope.values
+        self.memoizer = memoizer
+        self.profiler = profiler    # Instruments the generated closures when set
+        self.laziness = laziness    # Passes arguments by need when set
+        self.speculative = False    # Compiling an argument to be tried before it is delayed
+        # Operator subtrees the type checker proved scalar, compiled to one Python expression each
+        self.fusible = fusible if fusible is not None and laziness is None else set()
+        self.fused = {}             # Generated source -> compiled expression, shared by equal subtrees
+        self.jit = jit              # Translates hot Defuns to Python when set
+        self.limits = limits        # Meters calls and checks integer sizes when set
+        self.operators = limits.operators(OPERATORS) if limits is not None else OPERATORS
+        self.primitives = limits.primitives(PRIMITIVES) if limits is not None else PRIMITIVES
+
+    def compile(self, node, scope=None):
+        if self.profiler is not None:
+            return self.profiler.count(type(node).__name__, self.compile_node(node, scope))
+        return self.compile_node(node, scope)
+
+    def compile_node(self, node, scope):
+        if node in self.fusible:
+            fused = self.compile_fused(node, scope)
+            if fused is not None:
+                return fused
+
+        if isinstance(node, (IntegerLiteral, BooleanLiteral)):
+            value = node.value
+            return lambda frame: value
+
+        elif isinstance(node, Identifier):
+            lookup = self.compile_lookup(node.name, scope)
+            if self.laziness is None:
+                return lookup
+            if self.speculative:
+                return self.laziness.speculating(lookup)
+            return self.laziness.forcing(lookup)
+
+        elif isinstance(node, BinaryOperation):
+            return self.compile_binary_operation(node, scope)
+
+        elif isinstance(node, UnaryOperation):
+            if node.operator != '!':
+                raise TypeError(f"Unknown unary operator: {node.operator}")
+            operand = self.compile(node.operand, scope)
+            return lambda frame: not operand(frame)
+
+        elif isinstance(node, FunctionDefinition):
+            return self.compile_function_definition(node)
+
+        elif isinstance(node, LambdaExpression):
+            return self.compile_lambda(node, scope)
+
+        elif isinstance(node, FunctionApplication):
+            return self.compile_function_application(node, scope)
+
+        elif isinstance(node, PrimitiveApplication):
+            return self.compile_primitive_application(node, scope)
+
+        elif isinstance(node, IfStatement):
+            return self.compile_if_statement(node, scope)
+
+        else:
+            raise TypeError(f"Unknown node type: {type(node)}")
+
+    def compile_lookup(self, name, scope):
+        depth, slot = self.resolver.resolve(name, scope)
+
+        if depth is None:
+            values = self.globals
+
+            def load_global(frame):
+                value = values[slot]
+                if value is UNDEFINED:
+                    raise NameError(f"Undefined variable: {name}")
+                return value
+
+            return load_global
+        if depth == 0:
+            return lambda frame: frame.values[slot]
+        if depth == 1:
+            return lambda frame: frame.parent.values[slot]
+
+        def load_outer(frame):
+            for _ in range(depth):
+                frame = frame.parent
+            return frame.values[slot]
+
+        return load_outer
+
+    def compile_binary_operation(self, node, scope):
+        # A chain like a + b + ... + z nests down its left side. Its operations are compiled in a
+        # loop from the innermost out, so that a long chain does not run out of Python stack;
+        # compile() only counts the outermost one for the profiler, the loop counts the others.
+        chain = [node]
+        while isinstance(chain[-1].left, BinaryOperation) and chain[-1].left not in self.fusible:
+            chain.append(chain[-1].left)
+        left = self.compile(chain[-1].left, scope)
+        for operation in reversed(chain):
+            left = self.compile_operator(operation, left, self.compile(operation.right, scope))
+            if operation is not node and self.profiler is not None:
+                left = self.profiler.count('BinaryOperation', left)
+        return left
+
+    def compile_operator(self, node, left, right):
+        # For logical OR (||), short-circuit to True if left side is truthy
+        if node.operator == '||':
+            return lambda frame: True if left(frame) else right(frame)
+        # For logical AND (&&), short-circuit to False if left side is falsy
+        if node.operator == '&&':
+            return lambda frame: right(frame) if left(frame) else False
+
+        op = self.operators.get(node.operator)
+        if op is None:
+            raise TypeError(f"Unknown operator: {node.operator}")
+        return lambda frame: op(left(frame), right(frame))
+
+    def compile_fused(self, node, scope):
+        # One call evaluates the whole subtree, instead of one closure call per node. Operators
+        # behave exactly as in OPERATORS, so results and errors are the same.
+        source = self.fused_source(node, scope)
+        if source is None:
+            return None
+        if source not in self.fused:
+            try:
+                namespace = {'divide': divide, 'operators': self.operators}
+                namespace.update((f"primitive_{name}", function) for name, (_, function) in self.primitives.items())
+                self.fused[source] = eval(f"lambda frame: {source}", namespace)
+            except (SyntaxError, RecursionError, MemoryError):  # Nested too deeply for Python
+                self.fused[source] = None
+        return self.fused[source]
+
+    def fused_source(self, node, scope):
+        if isinstance(node, (IntegerLiteral, BooleanLiteral)):
+            return repr(node.value)
+
+        elif isinstance(node, Identifier):
+            # Only parameters of the current and enclosing function, globals are functions
+            depth, slot = self.resolver.resolve(node.name, scope)
+            if depth == 0:
+                return f"frame.values[{slot}]"
+            if depth == 1:
+                return f"frame.parent.values[{slot}]"
+            return None
+
+        elif isinstance(node, UnaryOperation) and node.operator == '!':
+            operand = self.fused_source(node.operand, scope)
+            return f"(not {operand})" if operand is not None else None
+
+        elif isinstance(node, BinaryOperation):
+            left = self.fused_source(node.left, scope)
+            right = self.fused_source(node.right, scope)
+            if left is None or right is None:
+                return None
+            if node.operator == '||':
+                return f"(True if {left} else {right})"
+            if node.operator == '&&':
+                return f"({right} if {left} else False)"
+            if self.limits is not None and node.operator in ARITHMETIC_OPERATORS:
+                # Measured by the limits, see Limits.operators
+                return f"operators[{node.operator!r}]({left}, {right})"
+            if node.operator == '/':
+                return f"divide({left}, {right})"
+            if node.operator in FUSED_OPERATORS:
+                return f"({left} {node.operator} {right})"
+
+        elif isinstance(node, PrimitiveApplication):
+            args = [self.fused_source(arg, scope) for arg in node.args]
+            if any(arg is None for arg in args):
+                return None
+            return f"primitive_{node.name}({', '.join(args)})"
+        return None
+
+    def compile_function_definition(self, node):
+        name = node.name
+        params = node.params
+        slot = self.resolver.global_scope.declare(name)
+        # Defun only appears at top level, so its body sees its parameters and the globals
+        body = self.compile(node.body, Scope(params))
+        values = self.globals
+        memoizer = self.memoizer
+        profiler = self.profiler
+        # In lazy mode, the arguments the body always uses are forced by the caller
+        strict = tuple(strict_parameters(node)) if self.laziness is not None else ()
+        memoizable = memoizer.analyze(node) if memoizer is not None else False
+
+        if self.jit is not None and not memoizable:
+            # Memoized Defuns stay closures, their memo tables save more than native code would
+            define = self.jit.define(node, body, slot, self.resolver)
+            if memoizer is None:
+                return define
+
+            def redefine(frame):
+                memoizer.define(name, body, False)  # Clears the memo tables of functions using it
+                return define(frame)
+
+            return redefine
+
+        if memoizer is None:
+            if profiler is not None:
+                body = profiler.instrument(name, body)
+            if strict:
+                body.strict = strict
+
+            def define(frame):
+                values[slot] = Function(name, params, body, None)
+                return None
+        else:
+            def define(frame):
+                # Profiling wraps the memoized body, so memo hits count as calls
+                installed = memoizer.define(name, body, memoizable)
+                if profiler is not None:
+                    installed = profiler.instrument(name, installed)
+                if strict:
+                    installed.strict = strict
+                values[slot] = Function(name, params, installed, None)
+                return None
+
+        return define
+
+    def compile_lambda(self, node, scope, chain=True):
+        # Closures are flat: their frame holds only the variables the lambda uses, copied out of
+        # the enclosing frames, so a closure outliving its caller does not keep the caller alive.
+        # Enclosing frames holding nothing else, like the parameters of enclosing lambdas, are
+        # shared instead.
+        params = node.params
+        captured = captured_names(node, scope)
+        if holds_only(scope, captured):
+            outer, capture = scope, None
+        else:
+            outer = Scope(captured) if captured else None
+            capture = self.compile_capture(captured, scope)
+        inner = Scope([params], outer)
+        if isinstance(node.body, LambdaExpression):
+            # Only the outermost lambda of a chain needs the flat body, the inner ones are only
+            # reached by applying the chain one argument at a time
+            body = self.compile_lambda(node.body, inner, False)
+            if self.profiler is not None:
+                body = self.profiler.count(type(node.body).__name__, body)
+        else:
+            body = self.compile(node.body, inner)
+        if self.profiler is not None:
+            body = self.profiler.instrument(f"<lambda {params}>", body)
+
+        chain_params, chain_body = lambda_chain(node)
+        if not chain or len(chain_params) < 2:
+            if capture is None:
+                return lambda frame: Function(None, params, body, frame)
+            return lambda frame: Function(None, params, body, capture(frame))
+        arity = len(chain_params)
+        flat = self.compile_flat_lambda(chain_params, chain_body, outer)
+        if capture is None:
+            return lambda frame: LambdaChain(params, body, frame, arity, flat)
+        return lambda frame: LambdaChain(params, body, capture(frame), arity, flat)
+
+    def compile_capture(self, names, scope):
+        # Copies the captured values out of the enclosing frames into a frame of the closure's own
+        if not names:
+            return lambda frame: None
+        loads = [self.compile_lookup(name, scope) for name in names]
+        if len(loads) == 1:
+            load, = loads
+            return lambda frame: Frame([load(frame)], None)
+        return lambda frame: Frame([load(frame) for load in loads], None)
+
+    def compile_flat_lambda(self, params, body, scope):
+        flat = self.compile(body, Scope(params, scope))
+        if self.profiler is not None:
+            flat = self.profiler.instrument(f"<lambda {' '.join(params)}>", flat)
+        return flat
+
+    def compile_function_application(self, node, scope):
+        if isinstance(node.func, LambdaExpression) and len(node.args) >= len(lambda_chain(node.func)[0]):
+            return self.compile_saturated_lambda(node, scope)
+
+        # A string is an identifier for a named function, otherwise it is a lambda expression
+        if isinstance(node.func, str):
+            func = self.compile_lookup(node.func, scope)
+            if self.laziness is not None:
+                func = self.laziness.forcing(func)
+        else:
+            func = self.compile(node.func, scope)
+        if self.laziness is not None:
+            args = [self.compile_argument(arg, scope) for arg in node.args]
+        else:
+            args = [self.compile(arg, scope) for arg in node.args]
+
+        if self.limits is not None:
+            return self.compile_metered_application(node, func, args)
+        if self.laziness is not None:
+            return self.compile_lazy_application(node, func, args)
+
+        # Errors raised once the call is entered are traced to it as they propagate out of it,
+        # see errors.trace_call
+        def apply(frame):
+            function = func(frame)
+            values = [arg(frame) for arg in args]
+            try:
+                # Saturated Defun calls go straight to the body, saving a Python frame per call
+                if function.__class__ is Function and function.params.__class__ is tuple \
+                        and len(function.params) == len(values):
+                    return function.body(Frame(values, function.frame))
+                return call_function(function, values)
+            except Exception as e:
+                trace_call(e, node)
+                raise
+
+        return apply
+
+    def compile_primitive_application(self, node, scope):
+        # The parser bound the name to the builtin, so the call needs no lookup and no frame
+        function = self.primitives[node.name][1]
+        args = [self.compile(arg, scope) for arg in node.args]
+        if len(args) == 1:
+            arg, = args
+            return lambda frame: function(arg(frame))
+        if len(args) == 2:
+            left, right = args
+            return lambda frame: function(left(frame), right(frame))
+        return lambda frame: function(*[arg(frame) for arg in args])
+
+    def compile_saturated_lambda(self, node, scope):
+        # (Lambd x.(Lambd y. body))(a, b, ...) binds all the chain's parameters in one frame,
+        # without creating the lambdas; remaining arguments are applied to the result
+        params, body = lambda_chain(node.func)
+        arity = len(params)
+        flat = self.compile_flat_lambda(params, body, scope)
+        if self.laziness is not None:
+            args = [self.compile_argument(arg, scope) for arg in node.args]
+        else:
+            args = [self.compile(arg, scope) for arg in node.args]
+        limits = self.limits
+
+        def apply(frame):
+            values = [arg(frame) for arg in args]
+            try:
+                if len(values) == arity:
+                    return flat(Frame(values, frame))
+                return call_function(flat(Frame(values[:arity], frame)), values[arity:])
+            except Exception as e:
+                trace_call(e, node)
+                raise
+
+        def metered_apply(frame):
+            values = [arg(frame) for arg in args]
+            try:
+                limits.fuel -= 1
+                if limits.fuel < 0:
+                    limits.refuel()
+                if limits.depth >= limits.max_depth:
+                    raise limits.too_deep()
+                limits.depth += 1
+                try:
+                    if len(values) == arity:
+                        return flat(Frame(values, frame))
+                    return call_function(flat(Frame(values[:arity], frame)), values[arity:])
+                finally:
+                    limits.depth -= 1
+            except Exception as e:
+                trace_call(e, node)
+                raise
+
+        return apply if limits is None else metered_apply
+
+    def compile_lazy_application(self, node, func, args):
+        def apply(frame):
+            function = func(frame)
+            values = [arg(frame) for arg in args]
+            try:
+                if function.__class__ is Function and function.params.__class__ is tuple \
+                        and len(function.params) == len(values):
+                    for slot in getattr(function.body, 'strict', ()):
+                        value = values[slot]
+                        if value.__class__ is Thunk:
+                            values[slot] = value.force()
+                    return function.body(Frame(values, function.frame))
+                return call_function(function, values)
+            except Exception as e:
+                trace_call(e, node)
+                raise
+
+        return apply
+
+    def compile_metered_application(self, node, func, args):
+        # A call under limits: one step of fuel, checked only when it runs out, and one more live
+        # frame while the call runs. Unlimited runs never reach this code.
+        limits = self.limits
+        lazy = self.laziness is not None
+
+        def apply(frame):
+            function = func(frame)
+            values = [arg(frame) for arg in args]
+            try:
+                limits.fuel -= 1
+                if limits.fuel < 0:
+                    limits.refuel()
+                if limits.depth >= limits.max_depth:
+                    raise limits.too_deep()
+                limits.depth += 1
+                try:
+                    if function.__class__ is Function and function.params.__class__ is tuple \
+                            and len(function.params) == len(values):
+                        if lazy:
+                            for slot in getattr(function.body, 'strict', ()):
+                                value = values[slot]
+                                if value.__class__ is Thunk:
+                                    values[slot] = value.force()
+                        return function.body(Frame(values, function.frame))
+                    return call_function(function, values)
+                finally:
+                    limits.depth -= 1
+            except Exception as e:
+                trace_call(e, node)
+                raise
+
+        return apply
+
+    def compile_argument(self, node, scope):
+        # In lazy mode a parameter is passed on as it is, thunk or not, and literals and lambdas
+        # cost nothing to evaluate; anything else may be delayed
+        if isinstance(node, Identifier):
+            lookup = self.compile_lookup(node.name, scope)
+            if self.resolver.resolve(node.name, scope)[0] is not None:
+                return lookup
+            # An undefined global only raises if the argument is used
+            return self.laziness.delay(lookup, lookup)
+        if isinstance(node, (IntegerLiteral, BooleanLiteral, LambdaExpression)):
+            return self.compile(node, scope)
+
+        code = self.compile(node, scope)
+        if contains_call(node):
+            return self.laziness.delay(code)
+        self.speculative = True
+        try:
+            speculative = self.compile(node, scope)
+        finally:
+            self.speculative = False
+        return self.laziness.delay(code, speculative)
+
+    def compile_if_statement(self, node, scope):
+        condition = self.compile(node.condition, scope)
+        consequence = self.compile(node.consequence, scope)
+        alternative = self.compile(node.alternative, scope) if node.alternative is not None else None
+
+        def evaluate(frame):
+            if condition(frame):
+                return consequence(frame)
+            elif alternative is not None:
+                return alternative(frame)
+            return None
+
+        return evaluate
+
+
+# Runs each top-level statement through the closure compiler instead of walking the tree
+class CompiledInterpreter(Interpreter):
+    def __init__(self, ast, memoizer=None, profiler=None, laziness=None, fusible=None, jit=None, limits=None):
+        super().__init__(ast, limits)
+        self.compiler = Compiler(memoizer=memoizer, profiler=profiler, laziness=laziness, fusible=fusible,
+                                 jit=jit, limits=limits)
+        # Top-level statements run outside of any function frame
+        self.global_env = None
+
+    def interpret(self):
+        if isinstance(self.ast, list):
+            self.compiler.resolver.declare_globals(self.ast)
+        else:  # A stream of statements
+            self.compiler.resolver.strict = False
+        return super().interpret()
+
+    def eval(self, node, env):
+        return self.compiler.compile(node)(env)
@@ -0,0 +1,150 @@
+from weakref import WeakKeyDictionary
+
+from ast_node import copy_node, FunctionDefinition, LambdaExpression, FunctionApplication, PrimitiveApplication, \
+    UnaryOperation, BinaryOperation, IfStatement
+
+
+# Source position (line, column) of each call and top-level statement. Nodes are shared between
+# identical subtrees, so positions are kept beside them, not in them; see locate for the subtrees
+# written in several places.
+SPANS = WeakKeyDictionary()
+# Lambda applications made by inliner.py: the inlined Defun's name and the span of the call they
+# replaced, or () for the bindings of shared subexpressions, which are left out of traces
+INLINED = WeakKeyDictionary()
+# Longer traces keep their first and last entries, the middle is elided
+TRACE_LIMIT = 10
+
+
+def locate(node, span, table=SPANS):
+    # Records the position, or other entry of table, of one place node is written at, and returns
+    # the node to put there: node itself, or a private copy of it when another place already gave
+    # node a different entry. Parents built from the copy are distinct nodes as well, so every
+    # occurrence of a call or statement keeps its own position.
+    current = table.get(node)
+    if current is None:
+        table[node] = span
+    elif current != span:
+        node = copy_node(node)
+        table[node] = span
+    return node
+
+
+def copy_span(old, new):
+    # For passes that rebuild a node, so the new one keeps the position of the original
+    if new is old:
+        return new
+    span = SPANS.get(old)
+    if span is not None:
+        new = locate(new, span)
+    origin = INLINED.get(old)
+    if origin is not None and isinstance(new, FunctionApplication) and not isinstance(new.func, str):
+        new = locate(new, origin, INLINED)
+    return new
+
+
+def spans_of(nodes, table=SPANS):
+    # The recorded positions, or other entries of table, of the given statements and the calls
+    # inside them
+    spans = {}
+    pending = list(nodes)
+    while pending:
+        node = pending.pop()
+        span = table.get(node)
+        if span is not None:
+            spans[node] = span
+        if isinstance(node, (FunctionDefinition, LambdaExpression)):
+            pending.append(node.body)
+        elif isinstance(node, FunctionApplication):
+            if not isinstance(node.func, str):
+                pending.append(node.func)
+            pending.extend(node.args)
+        elif isinstance(node, PrimitiveApplication):
+            pending.extend(node.args)
+        elif isinstance(node, BinaryOperation):
+            pending.extend((node.left, node.right))
+        elif isinstance(node, UnaryOperation):
+            pending.append(node.operand)
+        elif isinstance(node, IfStatement):
+            pending.extend((node.condition, node.consequence))
+            if node.alternative is not None:
+                pending.append(node.alternative)
+    return spans
+
+
+def format_span(span):
+    return f"line {span[0]}, column {span[1]}"
+
+
+# A runtime error as reported at top level: the original message, the position of the failing
+# statement and the calls that were active, innermost first, as (function name, call site span)
+class LambdaError(Exception):
+    def __init__(self, message, span=None, trace=()):
+        super().__init__(message)
+        self.message = message
+        self.span = span
+        self.trace = list(trace)
+
+    def __str__(self):
+        if self.span is None:
+            return self.message
+        return f"{self.message} ({format_span(self.span)})"
+
+    def compact_trace(self):
+        # Consecutive identical entries, as in a deep recursion, are counted instead of repeated
+        entries = []
+        for entry in self.trace:
+            if entries and entries[-1][0] == entry:
+                entries[-1][1] += 1
+            else:
+                entries.append([entry, 1])
+        return entries
+
+    def format(self):
+        location = f" at {format_span(self.span)}" if self.span is not None else ""
+        lines = [f"Error{location}: {self.message}"]
+        entries = self.compact_trace()
+        if len(entries) > TRACE_LIMIT:
+            half = TRACE_LIMIT // 2
+            elided = sum(count for _, count in entries[half:-half])
+            entries = entries[:half] + [[None, elided]] + entries[-half:]
+        for entry, count in entries:
+            if entry is None:
+                lines.append(f"  ... {count} more call(s) ...")
+                continue
+            name, span = entry
+            line = f"  in {name}"
+            if span is not None:
+                line += f", called at {format_span(span)}"
+            lines.append(line + (f" ({count} times)" if count > 1 else ""))
+        return '\n'.join(lines)
+
+
+def trace_call(exception, site):
+    # Records that an error left the call whose FunctionApplication node is site; the sites collect
+    # innermost first. cek and vm walk their explicit stacks once the error is raised. The tree
+    # and compiled engines keep their calls on the Python stack and have no chain of callers to
+    # walk, so each call has an except clause instead. Since Python 3.11 a try block costs
+    # nothing until an exception is raised, while a caller link would be one more field to set
+    # on every call.
+    sites = exception.__dict__.get('call_sites')
+    if sites is None:
+        sites = exception.call_sites = []
+    sites.append(site)
+
+
+def capture(exception, statement=None):
+    # Builds the structured error once, when it reaches the top level, from the call sites the
+    # engines recorded with trace_call while it propagated
+    if isinstance(exception, LambdaError):
+        return exception
+    trace = []
+    for site in exception.__dict__.get('call_sites', ()):
+        origin = INLINED.get(site)
+        if origin is not None:
+            if origin:  # Reported as the call it replaced
+                trace.append(origin)
+        else:
+            name = site.func if isinstance(site.func, str) else "<lambda>"
+            trace.append((name, SPANS.get(site)))
+    span = SPANS.get(statement) if statement is not None else None
+    return LambdaError(str(exception), span, trace)
@@ -0,0 +1,416 @@
+from collections import Counter
+
+from ast_node import FunctionDefinition, LambdaExpression, FunctionApplication, PrimitiveApplication, \
+    Identifier, UnaryOperation, BinaryOperation, IfStatement, canonical
+from errors import INLINED, SPANS, copy_span, format_span, locate
+from memo import is_memoizable
+from optimizer import Optimizer, is_literal
+from resolver import free_names
+
+
+# Largest Defun body, in nodes, copied into its callers
+INLINE_SIZE = 40
+# Temporaries of shared subexpressions are named with a prefix no identifier can start with
+TEMPORARY_PREFIX = '%'
+
+
+def walk(node):
+    # Every node of the tree, lambda bodies included
+    pending = [node]
+    while pending:
+        node = pending.pop()
+        yield node
+        if isinstance(node, (FunctionDefinition, LambdaExpression)):
+            pending.append(node.body)
+        elif isinstance(node, FunctionApplication):
+            if not isinstance(node.func, str):
+                pending.append(node.func)
+            pending.extend(node.args)
+        elif isinstance(node, PrimitiveApplication):
+            pending.extend(node.args)
+        elif isinstance(node, BinaryOperation):
+            pending.extend((node.left, node.right))
+        elif isinstance(node, UnaryOperation):
+            pending.append(node.operand)
+        elif isinstance(node, IfStatement):
+            pending.extend((node.condition, node.consequence))
+            if node.alternative is not None:
+                pending.append(node.alternative)
+
+
+def let(names, values, body):
+    # (Lambd a.(Lambd b. body))(x, y): binds the values in one frame, see compile_saturated_lambda
+    for name in reversed(names):
+        body = LambdaExpression(name, body)
+    return FunctionApplication(body, values)
+
+
+def rename(node, mapping):
+    # Replaces the free parameters in mapping with literals or variables. The caller makes sure
+    # no lambda of node captures a variable and no literal lands in call position.
+    if isinstance(node, Identifier):
+        return mapping.get(node.name, node)
+    elif isinstance(node, BinaryOperation):
+        return BinaryOperation(rename(node.left, mapping), node.operator, rename(node.right, mapping))
+    elif isinstance(node, UnaryOperation):
+        return UnaryOperation(node.operator, rename(node.operand, mapping))
+    elif isinstance(node, LambdaExpression):
+        if node.params in mapping:
+            mapping = {name: value for name, value in mapping.items() if name != node.params}
+        return LambdaExpression(node.params, rename(node.body, mapping))
+    elif isinstance(node, FunctionApplication):
+        if isinstance(node.func, str):
+            func = mapping[node.func].name if node.func in mapping else node.func
+        else:
+            func = rename(node.func, mapping)
+        return copy_span(node, FunctionApplication(func, [rename(arg, mapping) for arg in node.args]))
+    elif isinstance(node, PrimitiveApplication):
+        return PrimitiveApplication(node.name, [rename(arg, mapping) for arg in node.args])
+    elif isinstance(node, IfStatement):
+        alternative = rename(node.alternative, mapping) if node.alternative is not None else None
+        return IfStatement(rename(node.condition, mapping), rename(node.consequence, mapping), alternative)
+    return node
+
+
+def evaluated_first(node, params, leading):
+    # Appends to leading the parameters node evaluates before it does anything that could fail or
+    # be skipped, an operation, a call, a branch or a global lookup, and returns whether node does
+    # nothing else. An argument used only there can be evaluated there instead of before the body.
+    if is_literal(node):
+        return True
+    elif isinstance(node, Identifier):
+        if node.name in params:
+            leading.append(node.name)
+            return True
+        return False
+    elif isinstance(node, BinaryOperation):
+        if evaluated_first(node.left, params, leading) and node.operator not in ('||', '&&'):
+            evaluated_first(node.right, params, leading)
+    elif isinstance(node, UnaryOperation):
+        evaluated_first(node.operand, params, leading)
+    elif isinstance(node, IfStatement):
+        evaluated_first(node.condition, params, leading)
+    elif isinstance(node, PrimitiveApplication):
+        for arg in node.args:
+            if not evaluated_first(arg, params, leading):
+                break
+    return False
+
+
+def statement_label(node, index):
+    if isinstance(node, FunctionDefinition):
+        return node.name
+    span = SPANS.get(node)
+    return f"statement at {format_span(span)}" if span is not None else f"statement {index + 1}"
+
+
+# Copies the bodies of small non-recursive Defuns that memoization would not cache into the Defuns
+# calling them; top-level statements run once and keep their calls. A Defun is only inlined when
+# it is the sole definition of its name in the program and the caller comes after it, so the call
+# could not have reached any other function, and only into scopes where none of its globals is
+# shadowed. Literal and variable arguments are substituted, and so are the others when the body
+# uses each once, first thing; otherwise they are bound by a lambda application, evaluated once
+# before the body as in the call.
+class Inliner:
+    def __init__(self, size=INLINE_SIZE, int_bits=None):
+        self.size = size
+        self.optimizer = Optimizer(int_bits)  # Folds the literals substituted into the bodies
+        self.targets = {}             # Name -> definition that may be inlined
+        self.inlined = {}             # Caller -> Counter of the Defuns inlined into it
+
+    def rewrite(self, statements):
+        definitions = Counter(node.name for node in statements if isinstance(node, FunctionDefinition))
+        references = {}
+        for node in statements:
+            if isinstance(node, FunctionDefinition):
+                references.setdefault(node.name, set()).update(free_names(node.body, frozenset(node.params)))
+
+        result = []
+        for node in statements:
+            if isinstance(node, FunctionDefinition):
+                body = self.inline(node.body, frozenset(node.params), node.name)
+                if body is not node.body:  # The substituted literals may fold further
+                    body = self.optimizer.optimize_node(body)
+                node = copy_span(node, FunctionDefinition(node.name, node.params, body))
+                # Bodies branching into several calls keep their memo tables
+                if definitions[node.name] == 1 and not self.recursive(node.name, references) \
+                        and not is_memoizable(node) and sum(1 for _ in walk(body)) <= self.size:
+                    self.targets[node.name] = node
+            result.append(node)
+        return result
+
+    def recursive(self, name, references):
+        # Whether name reaches itself through the names the Defuns refer to
+        seen = set()
+        pending = list(references.get(name, ()))
+        while pending:
+            current = pending.pop()
+            if current == name:
+                return True
+            if current not in seen:
+                seen.add(current)
+                pending.extend(references.get(current, ()))
+        return False
+
+    def inline(self, node, bound, caller):
+        # bound holds the parameters in scope, which hide Defuns of the same name
+        if isinstance(node, BinaryOperation):
+            return BinaryOperation(self.inline(node.left, bound, caller), node.operator,
+                                   self.inline(node.right, bound, caller))
+        elif isinstance(node, UnaryOperation):
+            return UnaryOperation(node.operator, self.inline(node.operand, bound, caller))
+        elif isinstance(node, LambdaExpression):
+            return LambdaExpression(node.params, self.inline(node.body, bound | {node.params}, caller))
+        elif isinstance(node, PrimitiveApplication):
+            return PrimitiveApplication(node.name, [self.inline(arg, bound, caller) for arg in node.args])
+        elif isinstance(node, IfStatement):
+            alternative = self.inline(node.alternative, bound, caller) if node.alternative is not None else None
+            return IfStatement(self.inline(node.condition, bound, caller),
+                               self.inline(node.consequence, bound, caller), alternative)
+        elif isinstance(node, FunctionApplication):
+            args = [self.inline(arg, bound, caller) for arg in node.args]
+            if not isinstance(node.func, str):
+                return copy_span(node, FunctionApplication(self.inline(node.func, bound, caller), args))
+            target = self.targets.get(node.func)
+            if target is not None and node.func not in bound and len(args) == len(target.params):
+                expansion = self.expand(target, args, bound, node)
+                if expansion is not None:
+                    self.inlined.setdefault(caller, Counter())[node.func] += 1
+                    return expansion
+            return copy_span(node, FunctionApplication(node.func, args))
+        return node
+
+    def expand(self, target, args, bound, call):
+        body = target.body
+        if free_names(body, frozenset(target.params)) & bound:
+            return None  # A local variable would capture one of the globals the body uses
+        binders = {node.params for node in walk(body) if isinstance(node, LambdaExpression)}
+        callees = {node.func for node in walk(body) if isinstance(node, FunctionApplication)
+                   and isinstance(node.func, str)}
+
+        mapping = {}
+        names = []
+        values = []
+        for param, arg in zip(target.params, args):
+            if is_literal(arg) and param not in callees:
+                mapping[param] = arg
+            elif isinstance(arg, Identifier) and arg.name in bound and arg.name not in binders \
+                    and (arg.name == param or arg.name not in target.params):
+                mapping[param] = arg  # A variable of the caller, which no binding of the body hides
+            else:
+                names.append(param)
+                values.append(arg)
+
+        leading = []
+        evaluated_first(body, set(target.params), leading)
+        uses = Counter(node.name for node in walk(body) if isinstance(node, Identifier))
+        if leading == names and all(uses[name] == 1 and name not in callees for name in names):
+            # Each argument is used once, by the first thing the body does: it goes in its place
+            mapping.update(zip(names, values))
+            names = values = []
+
+        body = self.optimizer.optimize_node(rename(body, mapping))
+        if not names:
+            return body
+        return locate(let(names, values, body), (target.name, SPANS.get(call)), INLINED)
+
+    def report(self):
+        calls = sum(sum(counts.values()) for counts in self.inlined.values())
+        lines = [f"Inliner: {calls} call(s) inlined"]
+        for caller, counts in self.inlined.items():
+            lines.append(f"  {caller}: " + ', '.join(f"{name} ({count})" for name, count in counts.items()))
+        return '\n'.join(lines)
+
+
+# Evaluates repeated subexpressions containing calls once per evaluation of the body they are in.
+# A subexpression is shared within a region, a body, a branch of an if or the right side of || and
+# &&, when the region always evaluates it at least once: it is then bound to a fresh name by a
+# lambda application, and every occurrence in the region reads the name.
+# Expressions of the language are pure, so this changes how often, never what, is computed.
+class SubexpressionEliminator:
+    def __init__(self):
+        self.temporaries = 0  # Fresh names used in the current statement
+        self.shared = {}      # Statement label -> (subexpressions shared, occurrences they replaced)
+        self.interned = {}    # Node -> the interned node it is counted as, see ast_node.copy_node
+
+    def rewrite(self, statements):
+        result = []
+        for index, node in enumerate(statements):
+            self.temporaries = 0
+            label = statement_label(node, index)
+            if isinstance(node, FunctionDefinition):
+                body = self.region(node.body, label)
+                result.append(copy_span(node, FunctionDefinition(node.name, node.params, body)))
+            else:
+                result.append(copy_span(node, self.region(node, label)))
+        return result
+
+    def region(self, node, label):
+        # Occurrences are counted by their interned node, since calls written in several places
+        # are private copies that each keep their position; first holds the one evaluated first
+        always = Counter()  # Occurrences evaluated whenever the region is
+        total = Counter()   # All occurrences outside of lambdas, branches included
+        first = {}
+        if self.count(node, True, always, total, first) < 2:
+            return self.descend(node, label)
+
+        # The largest candidates first; parts of an expression already shared are left alone
+        candidates = sorted((candidate for candidate in always if total[candidate] >= 2
+                             and self.worth_sharing(candidate)),
+                            key=lambda candidate: -sum(1 for _ in walk(candidate)))
+        chosen = []
+        inside = set()
+        for candidate in candidates:
+            if candidate not in inside:
+                chosen.append(candidate)
+                inside.update(walk(candidate))
+        if not chosen:
+            return self.descend(node, label)
+
+        # Bound in the order they are first evaluated in, always holds them in that order
+        order = {candidate: index for index, candidate in enumerate(always)}
+        chosen.sort(key=order.get)
+        names = {}
+        for candidate in chosen:
+            self.temporaries += 1
+            names[candidate] = Identifier(f"{TEMPORARY_PREFIX}{self.temporaries}")
+        shared, replaced = self.shared.get(label, (0, 0))
+        self.shared[label] = (shared + len(chosen), replaced + sum(total[candidate] for candidate in chosen))
+
+        body = self.place(self.replace(node, names),
+                          [(names[candidate].name, first[candidate]) for candidate in chosen])
+        return self.descend(body, label)
+
+    def place(self, node, bindings):
+        # Binds each name at the smallest subexpression holding all its uses, so a binding does
+        # not wrap more than it needs to, like the recursive call of a body running in a loop.
+        # That subexpression is always evaluated, since it holds a use the region always evaluates.
+        children = self.children(node)
+        uses = [{inner.name for inner in walk(child) if isinstance(inner, Identifier)} for child in children]
+        here = []
+        below = [[] for _ in children]
+        for binding in bindings:
+            holders = [index for index, names in enumerate(uses) if binding[0] in names]
+            if len(holders) == 1 and children[holders[0]] != Identifier(binding[0]):
+                below[holders[0]].append(binding)
+            else:
+                here.append(binding)
+        if any(below):
+            node = self.rebuild(node, [self.place(child, inner) if inner else child
+                                       for child, inner in zip(children, below)])
+        if not here:
+            return node
+        # Not a call of the program, left out of error traces
+        return locate(let([name for name, _ in here], [value for _, value in here], node), (), INLINED)
+
+    def children(self, node):
+        # The subexpressions evaluated in the same scope as node
+        if isinstance(node, BinaryOperation):
+            return [node.left, node.right]
+        elif isinstance(node, UnaryOperation):
+            return [node.operand]
+        elif isinstance(node, IfStatement):
+            return [node.condition, node.consequence] + ([node.alternative] if node.alternative is not None else [])
+        elif isinstance(node, (FunctionApplication, PrimitiveApplication)):
+            return list(node.args)
+        return []
+
+    def rebuild(self, node, children):
+        if isinstance(node, BinaryOperation):
+            return BinaryOperation(children[0], node.operator, children[1])
+        elif isinstance(node, UnaryOperation):
+            return UnaryOperation(node.operator, children[0])
+        elif isinstance(node, IfStatement):
+            return IfStatement(children[0], children[1], children[2] if len(children) > 2 else None)
+        elif isinstance(node, PrimitiveApplication):
+            return PrimitiveApplication(node.name, children)
+        return copy_span(node, FunctionApplication(node.func, children))
+
+    def worth_sharing(self, node):
+        # Only calls cost more than the frame binding them; lambdas would be created only once
+        nodes = list(walk(node))
+        return any(isinstance(inner, (FunctionApplication, PrimitiveApplication)) for inner in nodes) \
+            and not any(isinstance(inner, LambdaExpression) for inner in nodes)
+
+    def count(self, node, evaluated, always, total, first):
+        # Counts the occurrences of every subexpression, returning how many calls were seen
+        if is_literal(node) or isinstance(node, (Identifier, LambdaExpression)):
+            return 0
+        key = canonical(node, self.interned)
+        total[key] += 1
+        if evaluated:
+            always[key] += 1
+            first.setdefault(key, node)
+        if isinstance(node, BinaryOperation):
+            right = evaluated and node.operator not in ('||', '&&')
+            return self.count(node.left, evaluated, always, total, first) \
+                + self.count(node.right, right, always, total, first)
+        elif isinstance(node, UnaryOperation):
+            return self.count(node.operand, evaluated, always, total, first)
+        elif isinstance(node, IfStatement):
+            calls = self.count(node.condition, evaluated, always, total, first) \
+                + self.count(node.consequence, False, always, total, first)
+            if node.alternative is not None:
+                calls += self.count(node.alternative, False, always, total, first)
+            return calls
+        elif isinstance(node, (FunctionApplication, PrimitiveApplication)):
+            # The body of an applied lambda is a region of its own
+            return 1 + sum(self.count(arg, evaluated, always, total, first) for arg in node.args)
+        return 0
+
+    def replace(self, node, names):
+        name = names.get(canonical(node, self.interned))
+        if name is not None:
+            return name
+        elif isinstance(node, BinaryOperation):
+            return BinaryOperation(self.replace(node.left, names), node.operator, self.replace(node.right, names))
+        elif isinstance(node, UnaryOperation):
+            return UnaryOperation(node.operator, self.replace(node.operand, names))
+        elif isinstance(node, IfStatement):
+            alternative = self.replace(node.alternative, names) if node.alternative is not None else None
+            return IfStatement(self.replace(node.condition, names), self.replace(node.consequence, names),
+                               alternative)
+        elif isinstance(node, PrimitiveApplication):
+            return PrimitiveApplication(node.name, [self.replace(arg, names) for arg in node.args])
+        elif isinstance(node, FunctionApplication):
+            return copy_span(node, FunctionApplication(node.func, [self.replace(arg, names) for arg in node.args]))
+        return node
+
+    def descend(self, node, label):
+        # Rebuilds node with the regions nested in it rewritten
+        if isinstance(node, BinaryOperation):
+            right = self.region(node.right, label) if node.operator in ('||', '&&') \
+                else self.descend(node.right, label)
+            return BinaryOperation(self.descend(node.left, label), node.operator, right)
+        elif isinstance(node, UnaryOperation):
+            return UnaryOperation(node.operator, self.descend(node.operand, label))
+        elif isinstance(node, IfStatement):
+            alternative = self.region(node.alternative, label) if node.alternative is not None else None
+            return IfStatement(self.descend(node.condition, label), self.region(node.consequence, label),
+                               alternative)
+        elif isinstance(node, LambdaExpression):
+            return LambdaExpression(node.params, self.region(node.body, label))
+        elif isinstance(node, PrimitiveApplication):
+            return PrimitiveApplication(node.name, [self.descend(arg, label) for arg in node.args])
+        elif isinstance(node, FunctionApplication):
+            func = node.func if isinstance(node.func, str) else self.descend(node.func, label)
+            args = [self.descend(arg, label) for arg in node.args]
+            return copy_span(node, FunctionApplication(func, args))
+        return node
+
+    def report(self):
+        shared = sum(count for count, _ in self.shared.values())
+        lines = [f"Common subexpressions: {shared} shared"]
+        for label, (count, replaced) in self.shared.items():
+            lines.append(f"  {label}: {count} subexpression(s) computed once instead of up to {replaced} times")
+        return '\n'.join(lines)
+
+
+def rewrite_program(statements, inline=True, cse=True, stats=False, int_bits=None):
+    # Both passes need the whole program: a later Defun could redefine an inlined function
+    for enabled, rewriter in ((inline, Inliner(int_bits=int_bits)), (cse, SubexpressionEliminator())):
+        if enabled:
+            statements = rewriter.rewrite(statements)
+            if stats:
+                print(rewriter.report())
+    return statements
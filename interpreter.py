@@ -1,5 +1,8 @@
-from ast_node import FunctionDefinition, LambdaExpression, FunctionApplication, Identifier, \
-    IntegerLiteral, BooleanLiteral, UnaryOperation, BinaryOperation, IfStatement
+from ast_node import FunctionDefinition, LambdaExpression, FunctionApplication, PrimitiveApplication, \
+    Identifier, IntegerLiteral, BooleanLiteral, UnaryOperation, BinaryOperation, IfStatement
+from errors import capture, trace_call
+from primitives import PRIMITIVES
+from resolver import free_names
 
 
 class Environment:
@@ -24,14 +27,38 @@ class Environment:
             child.set(name, value)
         return child
 
+    def capture(self, names, root):
+        # A flat environment for a closure: the given names bound between here and root are
+        # copied into it, anything else is looked up in root
+        child = Environment(root)
+        for name in names:
+            env = self
+            while env is not root:
+                if name in env.env:
+                    child.env[name] = env.env[name]
+                    break
+                env = env.parent
+        return child
+
 
 class Interpreter:
-    def __init__(self, ast):
+    def __init__(self, ast, limits=None):
         self.ast = ast
         self.global_env = Environment()
+        self.limits = limits  # Budgets of the run, see limits.Limits; None runs unmetered
+        self.primitives = limits.primitives(PRIMITIVES) if limits is not None else PRIMITIVES
+        self.captures = {}  # Lambda node -> its free names, the variables its closures keep
+
+    def cancel(self):
+        # Stops a running interpret() from another thread, its calls fail from then on
+        if self.limits is None:
+            raise RuntimeError("Only an interpreter created with limits can be cancelled")
+        self.limits.cancel()
 
     def interpret(self):
         print("Starting interpretation...")
+        if self.limits is not None:
+            self.limits.start()
         try:
             result = None
             for node in self.ast:
@@ -40,7 +67,7 @@ class Interpreter:
                     if result is not None:
                         print(result)
                 except Exception as e:
-                    print(f"Error during interpretation of node {node}: {e}")
+                    print(capture(e, node).format())
             print("Interpretation finished...")
             return result
         except Exception as e:
@@ -76,28 +103,34 @@ class Interpreter:
             return None
 
         elif isinstance(node, LambdaExpression):
-            return node.params, node.body, env
+            return self.closure(node, env)
 
         elif isinstance(node, FunctionApplication):
+            # Check if the function is a string (indicating it's an identifier for a named function)
+            if isinstance(node.func, str):
+                func = env.get(node.func)
+            elif isinstance(node.func, LambdaExpression):
+                # A lambda applied on the spot does not outlive env, it is not worth flattening
+                func = node.func.params, node.func.body, env
+            else:
+                func = self.eval(node.func, env)
+
+            # Evaluate the arguments
+            args = [self.eval(arg, env) for arg in node.args]
+
+            # The call is entered, errors from here on are traced to it as they propagate
             try:
-                # Check if the function is a string (indicating it's an identifier for a named function)
-                if isinstance(node.func, str):
-                    func = env.get(node.func)
-                else:
-                    func = self.eval(node.func, env)
-
-                # Evaluate the arguments
-                args = [self.eval(arg, env) for arg in node.args]
-
                 # If the function is a regular function or lambda, apply the arguments
                 if isinstance(func, tuple) and len(func) == 3:
                     params, body, closure_env = func
 
-                    if isinstance(params, list):  # Regular function call
+                    if isinstance(params, tuple):  # Regular function call
                         if len(params) != len(args):
                             raise TypeError(f"Function expected {len(params)} arguments but got {len(args)}")
 
                         new_env = closure_env.extend(params, args)
+                        if self.limits is not None:
+                            return self.eval_metered(body, new_env)
                         return self.eval(body, new_env)
                     else:  # Lambda expression
                         for arg in args:
@@ -106,24 +139,35 @@ class Interpreter:
 
                 else:
                     raise TypeError(f"Expected a function or lambda expression, but got: {func}")
-
             except Exception as e:
-                raise RuntimeError(f"Error applying function: {str(e)}")
+                trace_call(e, node)
+                raise
+
+        elif isinstance(node, PrimitiveApplication):
+            # Builtins are bound by the parser, no environment lookup is needed
+            args = [self.eval(arg, env) for arg in node.args]
+            return self.primitives[node.name][1](*args)
 
         elif isinstance(node, IfStatement):
-            try:
-                condition_value = self.eval(node.condition, env)
-                if condition_value:
-                    return self.eval(node.consequence, env)
-                elif node.alternative is not None:
-                    return self.eval(node.alternative, env)
-                return None
-            except Exception as e:
-                raise RuntimeError(f"Error evaluating if-statement: {str(e)}")
+            condition_value = self.eval(node.condition, env)
+            if condition_value:
+                return self.eval(node.consequence, env)
+            elif node.alternative is not None:
+                return self.eval(node.alternative, env)
+            return None
 
         else:
             raise TypeError(f"Unknown node type: {type(node)}")
 
+    def closure(self, node, env):
+        # A closure keeps only the variables it uses, not the frames of every enclosing call
+        if env is self.global_env:
+            return node.params, node.body, env
+        names = self.captures.get(node)
+        if names is None:
+            names = self.captures[node] = tuple(free_names(node))
+        return node.params, node.body, env.capture(names, self.global_env)
+
     def apply_function(self, func, args):
         param, body, closure_env = func
 
@@ -131,15 +175,31 @@ class Interpreter:
             raise TypeError("Each lambda expression should receive exactly one argument.")
 
         new_env = closure_env.extend([param], args)
+        if self.limits is not None:
+            return self.eval_metered(body, new_env)
         result = self.eval(body, new_env)
         return result
 
+    def eval_metered(self, body, env):
+        # A function body run under limits: one step, and one more live frame while it runs
+        limits = self.limits
+        limits.step()
+        limits.enter()
+        try:
+            return self.eval(body, env)
+        finally:
+            limits.depth -= 1
+
     def apply_operator(self, op, left, right):
+        if self.limits is not None:
+            self.limits.measure(left, right)
         if op == '+':
             return left + right
         elif op == '-':
             return left - right
         elif op == '*':
+            if self.limits is not None and self.limits.int_bits is not None:
+                return self.limits.multiply(left, right)
             return left * right
         elif op == '/':
             if right == 0:
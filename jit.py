@@ -0,0 +1,267 @@
+from ast_node import FunctionApplication, PrimitiveApplication, LambdaExpression, Identifier, IntegerLiteral, \
+    BooleanLiteral, UnaryOperation, BinaryOperation, IfStatement
+from compiler import Function, call_function, lambda_chain
+from primitives import PRIMITIVES
+from resolver import Scope, UNDEFINED
+
+
+# The language operators as Python source; the JIT needs no exact error messages, see JIT.compile
+PYTHON_OPERATORS = {
+    '+': '+', '-': '-', '*': '*', '/': '//', '%': '%',
+    '==': '==', '!=': '!=', '>': '>', '<': '<', '>=': '>=', '<=': '<=',
+}
+
+
+# Errors a program itself can raise. A jitted call failing with one of them is run again in the
+# closures, which raise it with its usual message; anything else is a bug of the translator.
+PROGRAM_ERRORS = (ArithmeticError, TypeError, ValueError, NameError, RecursionError)
+
+
+# Raised for a construct the translator does not handle, the Defun then stays interpreted
+class Unsupported(Exception):
+    pass
+
+
+# Turns one Defun into the source of a Python function `jitted`. Parameters become the positional
+# arguments a0, a1, ..., and self tail calls become assignments to them inside a while loop.
+# Lambdas applied to all their arguments, as the inliner binds values, become local variables.
+class Translator:
+    def __init__(self, node, slot, resolver):
+        self.node = node
+        self.slot = slot           # Global slot of the Defun, for its recursive calls
+        self.resolver = resolver
+        self.scope = Scope(node.params)
+        self.calls = 0             # Call sites so far, each gets its own temporary name
+        self.loops = False         # Whether a self tail call was turned into a jump
+        self.bindings = {}         # Names bound by applied lambdas -> their local variable
+        self.locals = 0            # Local variables so far
+
+    def source(self):
+        body = self.statement(self.node.body, 2)
+        params = ', '.join(f"a{index}" for index in range(len(self.node.params)))
+        lines = [f"def jitted({params}):"]
+        if self.loops:
+            lines.append("    while True:")
+            lines.extend(body)
+        else:
+            lines.extend(line[4:] for line in body)
+        return '\n'.join(lines) + '\n'
+
+    def statement(self, node, depth):
+        # Lines computing node in tail position, at the given indentation depth
+        indent = '    ' * depth
+        if isinstance(node, IfStatement):
+            lines = [f"{indent}if {self.expression(node.condition)}:"]
+            lines.extend(self.statement(node.consequence, depth + 1))
+            lines.append(f"{indent}else:")
+            if node.alternative is not None:
+                lines.extend(self.statement(node.alternative, depth + 1))
+            else:
+                lines.append(f"{indent}    return None")
+            return lines
+        if self.is_binding(node):
+            names, values, body = self.binding(node)
+            lines = [f"{indent}{variable} = {value}" for variable, value in zip(names.values(), values)]
+            saved = self.bind(names)
+            lines.extend(self.statement(body, depth))
+            self.bindings = saved
+            return lines
+        if isinstance(node, FunctionApplication) and self.is_self_call(node):
+            # Only loop while the global still holds this function, a redefinition must be called
+            args = [self.expression(arg) for arg in node.args]
+            params = ', '.join(f"a{index}" for index in range(len(args)))
+            self.loops = True
+            lines = [f"{indent}if natives.get(({self.slot}, {len(args)})) is jitted:"]
+            if args:
+                lines.append(f"{indent}    {params} = {', '.join(args)}")
+            lines.append(f"{indent}    continue")
+            lines.append(f"{indent}return call_global({self.slot}, [{', '.join(args)}])")
+            return lines
+        return [f"{indent}return {self.expression(node)}"]
+
+    def is_self_call(self, node):
+        return node.func == self.node.name and len(node.args) == len(self.node.params) \
+            and self.node.name not in self.node.params and self.node.name not in self.bindings
+
+    def is_binding(self, node):
+        return isinstance(node, FunctionApplication) and isinstance(node.func, LambdaExpression) \
+            and len(lambda_chain(node.func)[0]) == len(node.args)
+
+    def binding(self, node):
+        # The values are translated before the names they are bound to come into scope
+        params, body = lambda_chain(node.func)
+        values = [self.expression(arg) for arg in node.args]
+        names = {}
+        for param in params:
+            names[param] = f"_v{self.locals}"
+            self.locals += 1
+        return names, values, body
+
+    def bind(self, names):
+        saved = self.bindings
+        self.bindings = {**saved, **names}
+        return saved
+
+    def expression(self, node):
+        if isinstance(node, (IntegerLiteral, BooleanLiteral)):
+            return repr(node.value)
+
+        elif isinstance(node, Identifier):
+            if node.name in self.bindings:
+                return self.bindings[node.name]
+            depth, slot = self.resolver.resolve(node.name, self.scope)
+            if depth is None:
+                return f"load_global({slot})"
+            return f"a{slot}"
+
+        elif isinstance(node, BinaryOperation):
+            left = self.expression(node.left)
+            right = self.expression(node.right)
+            if node.operator == '||':
+                return f"(True if {left} else {right})"
+            if node.operator == '&&':
+                return f"({right} if {left} else False)"
+            if node.operator not in PYTHON_OPERATORS:
+                raise Unsupported(f"operator {node.operator}")
+            return f"({left} {PYTHON_OPERATORS[node.operator]} {right})"
+
+        elif isinstance(node, UnaryOperation):
+            if node.operator != '!':
+                raise Unsupported(f"operator {node.operator}")
+            return f"(not {self.expression(node.operand)})"
+
+        elif isinstance(node, IfStatement):
+            alternative = self.expression(node.alternative) if node.alternative is not None else 'None'
+            return f"({self.expression(node.consequence)} if {self.expression(node.condition)} else {alternative})"
+
+        elif isinstance(node, PrimitiveApplication):
+            return f"primitive_{node.name}({', '.join(self.expression(arg) for arg in node.args)})"
+
+        elif self.is_binding(node):
+            names, values, body = self.binding(node)
+            saved = self.bind(names)
+            body = self.expression(body)
+            self.bindings = saved
+            assignments = ', '.join(f"{variable} := {value}" for variable, value in zip(names.values(), values))
+            return f"({assignments}, {body})[-1]"
+
+        elif isinstance(node, FunctionApplication):
+            if not isinstance(node.func, str):
+                raise Unsupported("lambda expressions")
+            args = ', '.join(self.expression(arg) for arg in node.args)
+            if node.func in self.bindings:
+                return f"call({self.bindings[node.func]}, [{args}])"
+            depth, slot = self.resolver.resolve(node.func, self.scope)
+            if depth is not None:  # A function passed as a parameter
+                return f"call(a{slot}, [{args}])"
+            # Another jitted Defun is called directly, without a frame
+            temporary = f"_f{self.calls}"
+            self.calls += 1
+            return f"({temporary}({args}) if ({temporary} := natives.get(({slot}, {len(node.args)}))) " \
+                   f"is not None else call_global({slot}, [{args}]))"
+
+        raise Unsupported(type(node).__name__)
+
+
+# Tiered compilation for the compiled engine. Defuns start out as closures counting their calls;
+# after `threshold` calls, a Defun is translated to Python source, compiled with compile() and
+# runs natively from then on. Jitted Defuns call each other as plain Python functions.
+class JIT:
+    def __init__(self, threshold=50, dump=None):
+        self.threshold = threshold
+        self.dump = dump            # File receiving the generated source, if any
+        self.natives = {}           # (global slot, arity) -> jitted function of the Defun defined there
+        self.installed = {}         # Global slot -> its key in natives
+        self.deoptimizing = False   # Rerunning a failed call in the closures
+        self.compiled = []          # Names of the jitted Defuns
+        self.fallbacks = {}         # Name -> why the Defun stays interpreted
+
+    def define(self, node, body, slot, resolver):
+        # Returns the compiled Defun statement: it installs a function counting its calls
+        name = node.name
+        params = node.params
+        values = resolver.global_scope.values
+        threshold = self.threshold
+        jit = self
+
+        def define(frame):
+            key = jit.installed.pop(slot, None)
+            if key is not None:
+                del jit.natives[key]  # Callers of the previous definition must not reach it
+            function = Function(name, params, None, None)
+            calls = 0
+
+            def counted(frame):
+                nonlocal calls
+                calls += 1
+                if calls == threshold and values[slot] is function:
+                    jit.compile(node, body, slot, function, resolver)
+                return body(frame)
+
+            function.body = counted
+            values[slot] = function
+            if threshold <= 0:
+                jit.compile(node, body, slot, function, resolver)
+            return None
+
+        return define
+
+    def compile(self, node, body, slot, function, resolver):
+        values = resolver.global_scope.values
+
+        def load_global(slot):
+            value = values[slot]
+            if value is UNDEFINED:
+                raise NameError("Undefined variable")
+            return value
+
+        def call_global(slot, args):
+            return call_function(load_global(slot), args)
+
+        try:
+            source = Translator(node, slot, resolver).source()
+            namespace = {'natives': self.natives, 'call': call_function, 'call_global': call_global,
+                         'load_global': load_global}
+            namespace.update((f"primitive_{name}", function) for name, (_, function) in PRIMITIVES.items())
+            exec(compile(source, f"<jit {node.name}>", 'exec'), namespace)
+        except (Unsupported, SyntaxError, RecursionError, MemoryError) as e:
+            reason = f"{e} not supported" if isinstance(e, Unsupported) else "body too deeply nested"
+            self.fallbacks[node.name] = reason
+            if self.dump is not None:
+                print(f"# {node.name}: interpreted, {reason}\n", file=self.dump)
+            return
+        native = namespace['jitted']
+        if self.dump is not None:
+            print(f"# {node.name}: jitted\n{source}", file=self.dump)
+
+        jit = self
+
+        def entry(frame):
+            if jit.deoptimizing:
+                return body(frame)
+            try:
+                return native(*frame.values)
+            except PROGRAM_ERRORS as e:
+                # Programs have no side effects, so the call is simply run again in the closures,
+                # which raise the error with its usual message
+                jit.deoptimizing = True
+                try:
+                    body(frame)
+                finally:
+                    jit.deoptimizing = False
+                # The closures returned where the generated code failed
+                raise RuntimeError(f"--jit mistranslated '{node.name}': {type(e).__name__}: {e}") from e
+
+        function.body = entry
+        key = (slot, len(node.params))
+        self.natives[key] = native
+        self.installed[slot] = key
+        self.compiled.append(node.name)
+        self.fallbacks.pop(node.name, None)
+
+    def report(self):
+        lines = [f"JIT: {len(self.compiled)} Defun(s) compiled" +
+                 (f": {', '.join(self.compiled)}" if self.compiled else "")]
+        for name, reason in self.fallbacks.items():
+            lines.append(f"  {name} interpreted: {reason}")
+        return '\n'.join(lines)
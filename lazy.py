@@ -0,0 +1,157 @@
+from ast_node import FunctionApplication, PrimitiveApplication, LambdaExpression, Identifier, BinaryOperation, \
+    UnaryOperation, IfStatement
+
+
+# Raised by a speculative evaluation that reaches an argument nobody has forced yet
+class Unevaluated(Exception):
+    pass
+
+
+def contains_call(node):
+    if isinstance(node, (FunctionApplication, PrimitiveApplication, LambdaExpression)):
+        return True  # Builtins count as calls, pow can be as costly as any Defun
+    elif isinstance(node, BinaryOperation):
+        return contains_call(node.left) or contains_call(node.right)
+    elif isinstance(node, UnaryOperation):
+        return contains_call(node.operand)
+    elif isinstance(node, IfStatement):
+        return contains_call(node.condition) or contains_call(node.consequence) \
+            or (node.alternative is not None and contains_call(node.alternative))
+    return False
+
+
+def strict_names(node, function=None):
+    # Names whose values are always forced when node is evaluated. function is the name, params
+    # and strict parameter positions of the Defun being analyzed, used for its own recursive calls;
+    # calls to other globals force nothing, since those may be redefined later.
+    if isinstance(node, Identifier):
+        return {node.name}
+    elif isinstance(node, BinaryOperation):
+        if node.operator in ('||', '&&'):
+            return strict_names(node.left, function)
+        return strict_names(node.left, function) | strict_names(node.right, function)
+    elif isinstance(node, UnaryOperation):
+        return strict_names(node.operand, function)
+    elif isinstance(node, IfStatement):
+        names = strict_names(node.condition, function)
+        if node.alternative is not None:
+            names |= strict_names(node.consequence, function) & strict_names(node.alternative, function)
+        return names
+    elif isinstance(node, PrimitiveApplication):
+        names = set()
+        for arg in node.args:
+            names |= strict_names(arg, function)
+        return names
+    elif isinstance(node, FunctionApplication):
+        if isinstance(node.func, LambdaExpression):
+            return strict_names_of_application(node, function)
+        if function is not None and node.func == function[0]:
+            name, params, strict = function
+            names = set()
+            if len(node.args) == len(params):
+                for position in strict:
+                    names |= strict_names(node.args[position], function)
+            return names
+        return {node.func}  # The callee is forced, whatever it does with its arguments
+    return set()
+
+
+def strict_names_of_application(node, function):
+    # A lambda chain applied to exactly as many arguments as it has parameters runs its innermost
+    # body, which forces the arguments bound to its strict parameters
+    params = []
+    body = node.func
+    while isinstance(body, LambdaExpression) and len(params) < len(node.args):
+        params.append(body.params)
+        body = body.body
+    if len(params) != len(node.args):
+        return set()
+    if function is not None and function[0] in params:
+        function = None
+    inner = strict_names(body, function)
+    names = inner - set(params)
+    for position, param in enumerate(params):
+        # A parameter shadowed by a later one of the same name is not the one the body sees
+        if param in inner and param not in params[position + 1:]:
+            names |= strict_names(node.args[position], function)
+    return names
+
+
+def strict_parameters(definition):
+    # Positions of the parameters a Defun always forces, as a greatest fixed point: assume every
+    # parameter is strict and drop those the body does not force under that assumption
+    params = list(definition.params)
+    strict = set(range(len(params)))
+    while True:
+        function = (definition.name, params, strict) if definition.name not in params else None
+        names = strict_names(definition.body, function)
+        found = {params.index(param) for param in params if param in names}
+        if found == strict:
+            return sorted(strict)
+        strict = found
+
+
+class Thunk:
+    __slots__ = ('code', 'frame', 'value', 'laziness')
+
+    def __init__(self, code, frame, laziness):
+        self.code = code      # Compiled argument, None once the value is known
+        self.frame = frame
+        self.value = None
+        self.laziness = laziness
+
+    def force(self):
+        if self.code is not None:
+            # If the argument raises, the thunk stays unforced and raises again on the next force
+            self.value = self.code(self.frame)
+            self.code = None
+            self.frame = None  # The value no longer needs the caller's frame
+            self.laziness.forced += 1
+        return self.value
+
+
+# Call-by-need support for the compiled engine. Arguments containing calls are passed as thunks,
+# evaluated at most once when an operator, a condition, a call or a top-level result needs their
+# value. Call-free arguments always terminate, so they are evaluated right away as long as that
+# forces nothing and raises nothing; otherwise they become thunks as well. This keeps
+# accumulators like `total + n` from growing chains of thunks. Arguments a Defun always uses are
+# forced when it is called, which keeps accumulators built from calls from growing chains as well;
+# that only changes which error is reported when several would be raised.
+class Laziness:
+    def __init__(self):
+        self.created = 0
+        self.forced = 0
+
+    def forcing(self, lookup):
+        def forced(frame):
+            value = lookup(frame)
+            return value.force() if value.__class__ is Thunk else value
+
+        return forced
+
+    def speculating(self, lookup):
+        def speculative(frame):
+            value = lookup(frame)
+            if value.__class__ is Thunk:
+                if value.code is not None:
+                    raise Unevaluated()
+                return value.value
+            return value
+
+        return speculative
+
+    def delay(self, code, speculative=None):
+        def delayed(frame):
+            if speculative is not None:
+                try:
+                    return speculative(frame)
+                except Exception:
+                    pass
+            self.created += 1
+            return Thunk(code, frame, self)
+
+        return delayed
+
+    def report(self):
+        return f"Lazy evaluation: {self.created} thunk(s) created, {self.forced} forced, " \
+               f"{self.created - self.forced} never needed"
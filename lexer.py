@@ -1,4 +1,132 @@
 import re
+import sys
+from array import array
+
+
+# Token kind codes
+DEFUN = 0       # Function definition keyword
+NAME = 1        # Function name reserved word
+ARGUMENTS = 2   # Function arguments reserved word
+LAMBD = 3       # Lambda keyword
+IF = 4          # If keyword
+ELSE = 5        # Else keyword
+INTEGER = 6     # Integer (including negative integers)
+BOOL = 7        # Boolean
+ID = 8          # Identifiers
+ARITH_OP = 9    # Arithmetic Operators
+BOOL_OP = 10    # Boolean Operators
+COMP_OP = 11    # Comparison Operators
+NOT = 12        # Not Operators
+LPAREN = 13     # Left parenthesis
+RPAREN = 14     # Right parenthesis
+LBRACE = 15     # Left brace
+RBRACE = 16     # Right brace
+COMMA = 17      # Comma
+COLON = 18      # Colon
+DOT = 19        # Dot
+EOF = 20        # End of input
+
+TOKEN_NAMES = ['DEFUN', 'NAME', 'ARGUMENTS', 'LAMBD', 'IF', 'ELSE', 'INTEGER', 'BOOL', 'ID', 'ARITH_OP',
+               'BOOL_OP', 'COMP_OP', 'NOT', 'LPAREN', 'RPAREN', 'LBRACE', 'RBRACE', 'COMMA', 'COLON', 'DOT',
+               'EOF']
+
+# Reserved words are scanned as words and told apart from identifiers by a hash lookup
+KEYWORDS = {
+    'Defun': DEFUN,
+    'name': NAME,
+    'arguments': ARGUMENTS,
+    'Lambd': LAMBD,
+    'if': IF,
+    'else': ELSE,
+    'True': BOOL,
+    'False': BOOL,
+}
+
+SYMBOLS = {
+    '+': ARITH_OP, '-': ARITH_OP, '*': ARITH_OP, '/': ARITH_OP, '%': ARITH_OP,
+    '&&': BOOL_OP, '||': BOOL_OP,
+    '==': COMP_OP, '!=': COMP_OP, '>=': COMP_OP, '<=': COMP_OP, '>': COMP_OP, '<': COMP_OP,
+    '!': NOT,
+    '(': LPAREN, ')': RPAREN, '{': LBRACE, '}': RBRACE,
+    ',': COMMA, ':': COLON, '.': DOT,
+}
+
+# Groups of the scanner, numbered by mo.lastindex
+WORD, NUMBER, SYMBOL, NEWLINE, SKIP, MISMATCH = range(1, 7)
+
+scan_regex = re.compile(
+    r'([a-zA-Z_][a-zA-Z_0-9]*)'                    # Keywords, booleans and identifiers
+    r'|(-?\d+)'                                    # Integer (including negative integers)
+    r'|(==|!=|>=|<=|&&|\|\||[-+*/%<>!(){},:.])'    # Operators and punctuation
+    r'|(\n)'                                       # Line endings
+    r'|([ \t]+|#.*)'                               # Spaces, tabs and single line comments
+    r'|(.)'                                        # Any other character
+)
+
+
+# Tokens stored as parallel arrays: kind codes, offsets and lengths into the source, line numbers,
+# and for identifiers an index into a table of interned names. Iterating decodes each token into
+# a (kind, value, line, column) tuple on demand.
+class TokenStream:
+    def __init__(self, source):
+        self.source = source
+        self.kinds = array('B')
+        self.starts = array('l')
+        self.lengths = array('l')
+        self.lines = array('l')
+        self.symbols = array('l')      # Index into names for identifiers, -1 for other tokens
+        self.line_starts = array('l', [0])
+        self.names = []
+        self.name_index = {}
+
+    def append(self, kind, start, length, line, symbol=-1):
+        self.kinds.append(kind)
+        self.starts.append(start)
+        self.lengths.append(length)
+        self.lines.append(line)
+        self.symbols.append(symbol)
+
+    def intern(self, name):
+        index = self.name_index.get(name)
+        if index is None:
+            index = self.name_index[name] = len(self.names)
+            self.names.append(sys.intern(name))
+        return index
+
+    def __len__(self):
+        return len(self.kinds)
+
+    def __getitem__(self, index):
+        kind = self.kinds[index]
+        start = self.starts[index]
+        line = self.lines[index]
+        column = start - self.line_starts[line - 1]
+        if kind == ID:
+            return kind, self.names[self.symbols[index]], line, column
+        if kind == EOF:
+            return kind, 'EOF', line, column
+        text = self.source[start:start + self.lengths[index]]
+        if kind == INTEGER:
+            return kind, int(text), line, column
+        if kind == BOOL:
+            return kind, text == 'True', line, column
+        return kind, text, line, column
+
+    def __iter__(self):
+        source, names, line_starts = self.source, self.names, self.line_starts
+        for kind, start, length, line, symbol in zip(self.kinds, self.starts, self.lengths, self.lines,
+                                                     self.symbols):
+            column = start - line_starts[line - 1]
+            if kind == ID:
+                yield kind, names[symbol], line, column
+            elif kind == INTEGER:
+                yield kind, int(source[start:start + length]), line, column
+            elif kind == EOF:
+                yield kind, 'EOF', line, column
+            elif kind == BOOL:
+                yield kind, source[start:start + length] == 'True', line, column
+            else:
+                yield kind, source[start:start + length], line, column
 
 
 class Lexer:
@@ -8,55 +136,61 @@ class Lexer:
         self.line_start = 0
         self.tokens = []
 
-    token_specification = [
-        ('DEFUN', r'\bDefun\b'),  # Function definition keyword
-        ('NAME', r'\bname\b'),  # Function name reserved word
-        ('ARGUMENTS', r'\barguments\b'),  # Function arguments reserved word
-        ('LAMBD', r'\bLambd\b'),  # Lambda keyword
-        ('IF', r'\bif\b'),  # If keyword
-        ('ELSE', r'\belse\b'),  # Else keyword
-        ('INTEGER', r'-?\d+'),  # Integer (including negative integers)
-        ('BOOL', r'\bTrue\b|\bFalse\b'), # Boolean
-        ('ID', r'\b[a-zA-Z_][a-zA-Z_0-9]*\b'),  # Identifiers
-        ('ARITH_OP', r'[-+*/%]'),  # Arithmetic Operators
-        ('BOOL_OP', r'&&|\|\|'),  # Boolean Operators
-        ('COMP_OP', r'==|!=|>=|<=|>|<'),  # Comparison Operators
-        ('NOT', r'!'),                # Not Operators
-        ('LPAREN', r'\('),            # Left parenthesis
-        ('RPAREN', r'\)'),            # Right parenthesis
-        ('LBRACE', r'\{'),            # Left brace
-        ('RBRACE', r'\}'),            # Right brace
-        ('COMMA', r','),              # Comma
-        ('COLON', r':'),              # Colon
-        ('DOT', r'\.'),               # Dot
-        ('NEWLINE', r'\n'),           # Line endings
-        ('SKIP', r'[ \t]+'),          # Skip over spaces and tabs
-        ('COMMENT', r'#.*'),         # Single line comment
-        ('MISMATCH', r'.'),           # Any other character
-    ]
-
-    # The master regular expression
-    tok_regex = '|'.join('(?P<%s>%s)' % pair for pair in token_specification)
-
     def tokenize(self):
-        for mo in re.finditer(self.tok_regex, self.code):
-            kind = mo.lastgroup
-            value = mo.group(kind)
-            column = mo.start() - self.line_start
-            if kind == 'INTEGER':
-                value = int(value)
-            elif kind == 'BOOL':
-                value = True if value == 'True' else False
-            elif kind == 'NEWLINE':
+        stream = TokenStream(self.code)
+        keywords = KEYWORDS
+        symbols = SYMBOLS
+        column = 0
+        for mo in scan_regex.finditer(self.code):
+            group = mo.lastindex
+            start = mo.start()
+            column = start - self.line_start
+            if group == WORD:
+                word = mo.group(WORD)
+                kind = keywords.get(word)
+                if kind is None:
+                    stream.append(ID, start, len(word), self.line_num, stream.intern(word))
+                else:
+                    stream.append(kind, start, len(word), self.line_num)
+            elif group == NUMBER or group == SYMBOL:
+                text = mo.group(group)
+                stream.append(INTEGER if group == NUMBER else symbols[text], start, len(text), self.line_num)
+            elif group == NEWLINE:
                 self.line_start = mo.end()
                 self.line_num += 1
-                continue
-            elif kind == 'SKIP' or kind == 'COMMENT':
-                continue
-            elif kind == 'MISMATCH':
-                raise RuntimeError(f'{value!r} unexpected on line {self.line_num}')
-            self.tokens.append((kind, value, self.line_num, column))
-        self.tokens.append(('EOF', 'EOF', self.line_num, column))
+                stream.line_starts.append(self.line_start)
+            elif group == MISMATCH:
+                raise RuntimeError(f'{mo.group(MISMATCH)!r} unexpected on line {self.line_num}')
+        # Like the other tokens, EOF is reported at the column of the last token scanned
+        stream.append(EOF, self.line_start + column, 0, self.line_num)
+        self.tokens = stream
         return self.tokens
 
-
+    def generate_tokens(self):
+        # The code is either a whole string or an iterable of lines, such as an open file, which
+        # is scanned one line at a time so the source never has to be in memory at once
+        chunks = [self.code] if isinstance(self.code, str) else self.code
+        column = 0
+        for chunk in chunks:
+            self.line_start = 0
+            for mo in scan_regex.finditer(chunk):
+                group = mo.lastindex
+                column = mo.start() - self.line_start
+                if group == WORD:
+                    word = mo.group(WORD)
+                    kind = KEYWORDS.get(word, ID)
+                    if kind == BOOL:
+                        yield kind, word == 'True', self.line_num, column
+                    else:
+                        yield kind, word, self.line_num, column
+                elif group == NUMBER:
+                    yield INTEGER, int(mo.group(NUMBER)), self.line_num, column
+                elif group == SYMBOL:
+                    text = mo.group(SYMBOL)
+                    yield SYMBOLS[text], text, self.line_num, column
+                elif group == NEWLINE:
+                    self.line_start = mo.end()
+                    self.line_num += 1
+                elif group == MISMATCH:
+                    raise RuntimeError(f'{mo.group(MISMATCH)!r} unexpected on line {self.line_num}')
+        yield EOF, 'EOF', self.line_num, column
@@ -0,0 +1,132 @@
+import sys
+import time
+
+from primitives import power
+
+
+# Steps between two checks of the deadline and of cancellation
+CHECK_INTERVAL = 1000
+# Operands of more bits make an arithmetic operation slow enough to check the clock before it
+BIG_INT_BITS = 4096
+# Operators measured when limits are set, `*` is checked by Limits.multiply
+MEASURED_OPERATORS = ('+', '-', '/', '%')
+
+
+# Raised when a program runs out of one of its budgets or is cancelled
+class LimitExceeded(RuntimeError):
+    def __init__(self, message, limit=None):
+        super().__init__(message)
+        self.limit = limit  # 'steps', 'time', 'depth', 'int_bits' or 'cancelled'
+
+
+# Budgets for running untrusted programs. A step is one function call, the only way a program
+# can run for long; every engine counts its calls down from a small amount of fuel and only
+# looks at the step budget, the clock and the cancel flag when the fuel runs out, so metering
+# costs a decrement and a comparison per call. A few calls on huge integers can take longer than
+# a whole allowance, so arithmetic on big operands also checks the clock and the cancel flag.
+# Live frames are the calls currently running, and the results of `*` are checked against the
+# integer size limit.
+class Limits:
+    def __init__(self, steps=None, timeout=None, depth=None, int_bits=None):
+        self.max_steps = steps      # None means unlimited, like the other budgets
+        self.timeout = timeout      # Seconds
+        self.max_depth = depth if depth is not None else sys.maxsize
+        self.int_bits = int_bits
+        self.used = 0               # Steps counted at the last check
+        self.granted = 0            # Fuel handed out at the last check
+        self.fuel = 0               # Steps left until the next check
+        self.depth = 0              # Live frames
+        self.deadline = None
+        self.cancelled = False
+
+    def start(self):
+        # Starts the budgets, before a program (or, for a server, a request) runs
+        self.used = 0
+        self.depth = 0
+        self.cancelled = False
+        self.deadline = time.monotonic() + self.timeout if self.timeout is not None else None
+        self.grant()
+
+    def cancel(self):
+        # Safe to call from another thread: evaluation stops within CHECK_INTERVAL steps or one
+        # operation on big integers
+        self.cancelled = True
+        self.fuel = -1
+
+    def grant(self):
+        self.granted = CHECK_INTERVAL
+        if self.max_steps is not None:
+            self.granted = max(0, min(CHECK_INTERVAL, self.max_steps - self.used))
+        self.fuel = self.granted
+
+    def refuel(self):
+        # Called when the fuel drops below zero, that is one step after it ran out
+        self.used += self.granted - self.fuel
+        self.interrupt()
+        if self.max_steps is not None and self.used > self.max_steps:
+            raise LimitExceeded(f"Evaluation exceeded the step limit of {self.max_steps}", 'steps')
+        self.grant()
+
+    def interrupt(self):
+        if self.cancelled:
+            raise LimitExceeded("Evaluation was cancelled", 'cancelled')
+        if self.deadline is not None and time.monotonic() > self.deadline:
+            raise LimitExceeded(f"Evaluation exceeded the time limit of {self.timeout} seconds", 'time')
+
+    def measure(self, left, right):
+        # Called before an arithmetic operation, which takes long if an operand is big, so the one
+        # that passes the deadline is the last to run
+        if (left.__class__ is int and left.bit_length() > BIG_INT_BITS) \
+                or (right.__class__ is int and right.bit_length() > BIG_INT_BITS):
+            self.interrupt()
+
+    def step(self):
+        self.fuel -= 1
+        if self.fuel < 0:
+            self.refuel()
+
+    def enter(self):
+        if self.depth >= self.max_depth:
+            raise self.too_deep()
+        self.depth += 1
+
+    def too_deep(self):
+        return LimitExceeded(f"Evaluation exceeded the limit of {self.max_depth} live frames", 'depth')
+
+    def multiply(self, left, right):
+        self.measure(left, right)
+        result = left * right
+        if self.int_bits is not None and result.bit_length() > self.int_bits:
+            raise LimitExceeded(f"Integer result exceeds the limit of {self.int_bits} bits", 'int_bits')
+        return result
+
+    def measured(self, operation):
+        measure = self.measure
+
+        def apply(left, right):
+            measure(left, right)
+            return operation(left, right)
+
+        return apply
+
+    def power(self, base, exponent):
+        # The result has at least (bits of |base| - 1) * exponent + 1 bits, checked before computing it
+        if self.int_bits is not None and abs(base) > 1 and exponent > 0 \
+                and (abs(base).bit_length() - 1) * exponent >= self.int_bits:
+            raise LimitExceeded(f"Integer result exceeds the limit of {self.int_bits} bits", 'int_bits')
+        self.measure(base, exponent)
+        result = power(base, exponent)
+        if self.int_bits is not None and result.bit_length() > self.int_bits:
+            raise LimitExceeded(f"Integer result exceeds the limit of {self.int_bits} bits", 'int_bits')
+        return result
+
+    def operators(self, operators):
+        # The operator table to compile with: arithmetic is measured, and `*` checks the integer size
+        checked = dict(operators, **{'*': self.multiply})
+        for symbol in MEASURED_OPERATORS:
+            checked[symbol] = self.measured(operators[symbol])
+        return checked
+
+    def primitives(self, primitives):
+        # The same for the builtins, where pow is checked
+        return dict(primitives, pow=(primitives['pow'][0], self.power))
@@ -1,50 +1,405 @@
-from interpreter import Environment, Interpreter
+from ast_node import FunctionDefinition, INTERN_TABLE
+from cache import ProgramCache
+from bytecode import BytecodeCompiler, disassemble
+from cek import CEKInterpreter
+from compiler import CompiledInterpreter
+from inliner import rewrite_program
+from interpreter import Interpreter
+from jit import JIT
+from lazy import Laziness
 from lexer import Lexer
+from limits import Limits
+from memo import Memoizer
+from optimizer import Optimizer
 from parser import Parser
+from profiler import Profiler
+from session import Session
+from typechecker import TypeChecker
+from vm import VMInterpreter
+from contextlib import redirect_stdout
+import argparse
+import io
+import os
 import sys
 
 
-def execute_file(filename):
+# Evaluation engines selectable with --engine; the tree-walker is kept to cross-check results
+ENGINES = {
+    'compiled': CompiledInterpreter,
+    'tree': Interpreter,
+    'cek': CEKInterpreter,
+    'vm': VMInterpreter,
+}
+
+
+def load_program(code, options, defined=None):
+    tokens = Lexer(code).tokenize()
+    ast = Parser(tokens, defined=defined).parse()
+    if options.optimize:
+        ast = Optimizer(options.max_int_bits).optimize(ast)
+    return ast
+
+
+def load_file(filename, options, cache=None, whole=True):
+    # A whole program is also inlined, unlike a library preloaded into the REPL, whose Defuns
+    # later inputs may redefine
+    with open(filename, 'r') as file:
+        code = file.read()
+    ast = cache.load(filename, code, options.optimize, options.max_int_bits) if cache is not None else None
+    if ast is None:
+        ast = load_program(code, options)
+        if cache is not None:
+            try:
+                cache.store(filename, code, options.optimize, ast, options.max_int_bits)
+            except OSError as e:
+                print(f"Warning: could not write the program cache for '{filename}': {e}")
+    if whole and options.optimize:
+        ast = rewrite_program(ast, options.inline, options.cse, options.inline_stats, options.max_int_bits)
+    return ast
+
+
+def create_cache(options):
+    return ProgramCache(options.cache_dir) if options.cache else None
+
+
+def stream_program(file, options):
+    tokens = Lexer(file).generate_tokens()
+    statements = Parser(tokens).statements()
+    if options.optimize:
+        optimizer = Optimizer(options.max_int_bits)
+        statements = (optimizer.optimize_statement(node) for node in statements)
+    return statements
+
+
+def create_limits(options):
+    if options.max_steps is None and options.timeout is None and options.max_depth is None \
+            and options.max_int_bits is None:
+        return None
+    return Limits(options.max_steps, options.timeout, options.max_depth, options.max_int_bits)
+
+
+def create_interpreter(ast, options, fusible=None):
+    limits = create_limits(options)
+    if options.engine == 'compiled':
+        # Memo keys need argument values, which lazy evaluation does not have at call time
+        memoizer = Memoizer(options.memo_size) if options.memo_size > 0 and not options.lazy else None
+        profiler = Profiler() if options.profile else None
+        laziness = Laziness() if options.lazy else None
+        jit = None
+        if options.jit and (options.profile or options.lazy):
+            print("Warning: --jit is ignored with --profile and --lazy")
+        elif options.jit and limits is not None:
+            # Jitted code runs without the interpreter's call sites, so it could not be metered
+            print("Warning: --jit is ignored with evaluation limits")
+        elif options.jit:
+            jit = JIT(options.jit_threshold, sys.stderr if options.jit_dump else None)
+        return CompiledInterpreter(ast, memoizer=memoizer, profiler=profiler, laziness=laziness, fusible=fusible,
+                                   jit=jit, limits=limits)
+    for flag in ('profile', 'lazy', 'jit'):
+        if getattr(options, flag):
+            print(f"Warning: --{flag} is only supported by the compiled engine, not '{options.engine}'")
+    return ENGINES[options.engine](ast, limits=limits)
+
+
+def typecheck(ast):
+    # Returns the subtrees the compiled engine may fuse, or None after printing the type errors
+    checker = TypeChecker()
+    errors = checker.check(ast)
+    if errors:
+        for error in errors:
+            print(error)
+        print(f"Type checking failed with {len(errors)} error(s), the program was not run")
+        return None
+    return checker.fusible_nodes()
+
+
+def report_statistics(interpreter, options, filename=None):
+    compiler = getattr(interpreter, 'compiler', None)
+    if options.memo_stats and getattr(compiler, 'memoizer', None) is not None:
+        print(compiler.memoizer.report())
+    if options.lazy_stats and getattr(compiler, 'laziness', None) is not None:
+        print(compiler.laziness.report())
+    if options.jit_dump and getattr(compiler, 'jit', None) is not None:
+        print(compiler.jit.report(), file=sys.stderr)
+    profiler = getattr(compiler, 'profiler', None)
+    if profiler is not None:
+        print(profiler.report())
+        output = options.profile_output or f"{filename}.folded"
+        with open(output, 'w') as file:
+            profiler.write_folded(file)
+        print(f"Folded stacks written to '{output}'")
+
+
+def execute_file(filename, options=None):
+    options = options if options is not None else parse_arguments([])
     try:
-        with open(filename, 'r') as file:
-            code = file.read()
-        tokens = Lexer(code).tokenize()
-        ast = Parser(tokens).parse()
-        interpreter = Interpreter(ast)
+        if options.stream:
+            if options.typecheck:
+                print("Warning: --typecheck needs the whole program and is ignored with --stream")
+            with open(filename, 'r') as file:
+                interpreter = create_interpreter(stream_program(file, options), options)
+                interpreter.interpret()
+            report_statistics(interpreter, options, filename)
+            return
+        cache = create_cache(options)
+        ast = load_file(filename, options, cache)
+        if options.dump_ast:
+            for node in ast:
+                print(node)
+            return
+        fusible = None
+        if options.typecheck:
+            fusible = typecheck(ast)
+            if fusible is None:
+                return
+        if options.jobs > 1:
+            from parallel import ParallelInterpreter  # Only -j runs need worker processes
+            interpreter = ParallelInterpreter(ast, create_interpreter, options, options.jobs, fusible=fusible)
+        else:
+            interpreter = create_interpreter(ast, options, fusible)
         interpreter.interpret()
+        report_statistics(interpreter, options, filename)
+        if cache is not None and options.cache_stats:
+            print(cache.report())
+        if options.ast_stats:
+            print(INTERN_TABLE.report())
     except FileNotFoundError:
         print(f"Error: The file '{filename}' was not found.")
     except Exception as e:
         print(f"Error executing file '{filename}': {e}")
 
 
-def repl():
-    print("Welcome to the Lambda Interpreter REPL. Type 'exit' to quit.")
-    global_env = Environment()
+def capture_file(filename, options):
+    # Runs in a worker process, so the output of each file can be printed as one block
+    output = io.StringIO()
+    with redirect_stdout(output):
+        execute_file(filename, options)
+    return output.getvalue()
+
+
+def execute_files(filenames, options):
+    # Each file runs in its own worker with statements run sequentially, one file per job
+    from concurrent.futures import ProcessPoolExecutor
+    jobs = options.jobs
+    options.jobs = 1
+    with ProcessPoolExecutor(max_workers=jobs) as executor:
+        futures = [executor.submit(capture_file, filename, options) for filename in filenames]
+        for filename, future in zip(filenames, futures):
+            print(f"==> {filename} <==")
+            print(future.result(), end='')
+
+
+def expand_files(paths):
+    filenames = []
+    for path in paths:
+        if os.path.isdir(path):
+            filenames.extend(os.path.join(path, entry) for entry in sorted(os.listdir(path))
+                             if entry.endswith(".lambda"))
+        else:
+            filenames.append(path)
+    return filenames
+
+
+def disassemble_file(filename, options=None):
+    options = options if options is not None else parse_arguments([])
+    try:
+        ast = load_file(filename, options, create_cache(options))
+        compiler = BytecodeCompiler()
+        compiler.resolver.declare_globals(ast)
+        for node in ast:
+            print(disassemble(compiler.compile_statement(node)))
+    except FileNotFoundError:
+        print(f"Error: The file '{filename}' was not found.")
+    except Exception as e:
+        print(f"Error disassembling file '{filename}': {e}")
+
+
+def map_file(filename, function, inputs, options=None):
+    options = options if options is not None else parse_arguments([])
+    # Imported here, since batch needs numpy, which most runs do not
+    from batch import BatchEvaluator, find_definition, read_rows
+    try:
+        ast = load_file(filename, options, create_cache(options))
+        definition = find_definition(ast, function)
+        if definition is None:
+            print(f"Error: '{filename}' does not define a function named '{function}'")
+            return
+        # Only the definitions run, the program's own expressions are not printed
+        interpreter = CompiledInterpreter(ast)
+        interpreter.compiler.resolver.declare_globals(ast)
+        for node in ast:
+            if isinstance(node, FunctionDefinition):
+                interpreter.eval(node, interpreter.global_env)
+        with open(inputs, 'r') as file:
+            rows = read_rows(file)
+
+        evaluator = BatchEvaluator(interpreter)
+        for result in evaluator.map(definition, rows):
+            print(f"Error: {result}" if isinstance(result, Exception) else result)
+        print(evaluator.report(), file=sys.stderr)
+    except FileNotFoundError as e:
+        print(f"Error: The file '{e.filename}' was not found.")
+    except Exception as e:
+        print(f"Error mapping '{function}' over '{inputs}': {e}")
+
+
+def prewarm_cache(filename, options):
+    cache = ProgramCache(options.cache_dir)
+    try:
+        load_file(filename, options, cache)
+        print(f"Cached '{filename}' ({'hit' if cache.hits else 'miss, rebuilt'})")
+    except FileNotFoundError:
+        print(f"Error: The file '{filename}' was not found.")
+    except Exception as e:
+        print(f"Error caching file '{filename}': {e}")
+
+
+def clear_cache(paths, options):
+    removed = ProgramCache(options.cache_dir).clear(paths or ['.'])
+    print(f"Removed {removed} cache file(s)")
+
+
+def repl(options=None):
+    options = options if options is not None else parse_arguments([])
+    defined = set()  # Defuns of the session so far, which shadow builtins in later inputs
+    session = Session(create_interpreter([], options), lambda code: load_program(code, options, defined))
+    # Piped input gets no banner or prompts, just the results
+    interactive = sys.stdin.isatty()
+
+    for filename in options.preload or []:
+        try:
+            statements = load_file(filename, options, create_cache(options), whole=False)
+            defined.update(node.name for node in statements if isinstance(node, FunctionDefinition))
+            session.run_statements(statements)
+        except FileNotFoundError:
+            print(f"Error: The file '{filename}' was not found.")
+        except Exception as e:
+            print(f"Error loading file '{filename}': {e}")
+
+    if interactive:
+        print("Welcome to the Lambda Interpreter REPL. Type 'exit' to quit.")
 
     while True:
         try:
-            code = input(">>> ")
+            code = input(">>> " if interactive else "")
             if code.lower() in {"exit", "quit"}:
                 break
+            session.run(code)
+        except EOFError:
+            break
+        except Exception as e:
+            print(f"Error: {e}")
+
 
-            tokens = Lexer(code).tokenize()
-            ast = Parser(tokens).parse()
-            interpreter = Interpreter(ast)
-            result = interpreter.interpret()
+def serve(options):
+    import asyncio
+    from server import EvaluationServer
+    server = EvaluationServer(create_interpreter, options, options.jobs)
+    try:
+        asyncio.run(server.serve(options.host, options.port))
+    except KeyboardInterrupt:
+        pass
+    except OSError as e:
+        print(f"Error: could not serve on {options.host}:{options.port}: {e}")
+        return
+    print(f"Server stopped: {server.report()}")
 
-            if result is not None:
-                print(result)
 
-        except Exception as e:
-            print(f"Error: {e}")
+def parse_arguments(argv=None):
+    arg_parser = argparse.ArgumentParser(description="Lambda Interpreter")
+    arg_parser.add_argument('files', nargs='*', metavar='file',
+                            help=".lambda programs or directories of them to execute, omit to start the REPL")
+    arg_parser.add_argument('-j', '--jobs', type=int, default=1,
+                            help="worker processes running statements of a file, files, or server calls in parallel (default: 1)")
+    arg_parser.add_argument('--engine', choices=sorted(ENGINES), default='compiled',
+                            help="evaluation engine (default: compiled)")
+    arg_parser.add_argument('--disasm', action='store_true',
+                            help="print the bytecode generated for the file instead of running it")
+    arg_parser.add_argument('--memo-size', type=int, default=10000,
+                            help="entries kept per memoized Defun by the compiled engine, 0 disables (default: 10000)")
+    arg_parser.add_argument('--memo-stats', action='store_true',
+                            help="print memoization hits and misses per function after running")
+    arg_parser.add_argument('--lazy', action='store_true',
+                            help="pass arguments by need, evaluating each at most once and only if used")
+    arg_parser.add_argument('--lazy-stats', action='store_true',
+                            help="print how many delayed arguments were created and forced after running")
+    arg_parser.add_argument('--jit', action='store_true',
+                            help="translate Defuns called often to Python code, running tail recursion as loops")
+    arg_parser.add_argument('--jit-threshold', type=int, default=50,
+                            help="calls before --jit translates a Defun, 0 translates on definition (default: 50)")
+    arg_parser.add_argument('--jit-dump', action='store_true',
+                            help="print the Python code generated by --jit, and why Defuns stay interpreted, to stderr")
+    arg_parser.add_argument('--typecheck', action='store_true',
+                            help="infer types and report type errors before running, fusing integer arithmetic")
+    arg_parser.add_argument('--max-steps', type=int, default=None, metavar='N',
+                            help="stop evaluation after N function calls")
+    arg_parser.add_argument('--timeout', type=float, default=None, metavar='SECONDS',
+                            help="stop evaluation after SECONDS of wall-clock time")
+    arg_parser.add_argument('--max-depth', type=int, default=None, metavar='N',
+                            help="stop evaluation when more than N calls are running at once")
+    arg_parser.add_argument('--max-int-bits', type=int, default=None, metavar='N',
+                            help="stop evaluation when a multiplication yields an integer of more than N bits")
+    arg_parser.add_argument('--no-optimize', dest='optimize', action='store_false',
+                            help="skip constant folding between parsing and evaluation")
+    arg_parser.add_argument('--no-inline', dest='inline', action='store_false',
+                            help="do not copy small non-recursive Defuns into their callers")
+    arg_parser.add_argument('--no-cse', dest='cse', action='store_false',
+                            help="do not share repeated subexpressions containing calls")
+    arg_parser.add_argument('--inline-stats', action='store_true',
+                            help="print which calls were inlined and which subexpressions were shared")
+    arg_parser.add_argument('--dump-ast', action='store_true',
+                            help="print the optimized syntax tree of the file instead of running it")
+    arg_parser.add_argument('--stream', action='store_true',
+                            help="lex, parse and run the file one top-level statement at a time")
+    arg_parser.add_argument('--no-cache', dest='cache', action='store_false',
+                            help="always lex and parse the file instead of using the program cache")
+    arg_parser.add_argument('--cache-dir', default=None,
+                            help="directory for cached programs (default: __lambdacache__ next to the file)")
+    arg_parser.add_argument('--cache-stats', action='store_true',
+                            help="print program cache hits and misses after running")
+    arg_parser.add_argument('--ast-stats', action='store_true',
+                            help="print how many syntax tree nodes were built and how many were shared")
+    arg_parser.add_argument('--prewarm', action='store_true',
+                            help="parse the file into the program cache without running it")
+    arg_parser.add_argument('--clear-cache', action='store_true',
+                            help="remove the cached programs of the files, or of the current directory")
+    arg_parser.add_argument('--map', nargs=2, metavar=('FUNCTION', 'INPUTS'),
+                            help="apply a Defun of the file to each line of argument values in INPUTS")
+    arg_parser.add_argument('--profile', action='store_true',
+                            help="print time, calls and recursion depth per function and evaluations per node type")
+    arg_parser.add_argument('--profile-output', default=None, metavar='FILE',
+                            help="where --profile writes folded stacks for flamegraph tools (default: FILE.folded)")
+    arg_parser.add_argument('--serve', action='store_true',
+                            help="run an evaluation server answering JSON-lines requests instead of a REPL")
+    arg_parser.add_argument('--host', default='127.0.0.1',
+                            help="address --serve listens on (default: 127.0.0.1)")
+    arg_parser.add_argument('--port', type=int, default=7777,
+                            help="port --serve listens on (default: 7777)")
+    arg_parser.add_argument('--preload', action='append', metavar='FILE',
+                            help="run a .lambda library into the REPL session before the first prompt")
+    options = arg_parser.parse_args(argv)
+    options.file = options.files[0] if len(options.files) == 1 else None
+    return options
 
 
 if __name__ == "__main__":
     try:
-        if len(sys.argv) > 1 and sys.argv[1].endswith(".lambda"):
-            execute_file(sys.argv[1])
+        args = parse_arguments()
+        if args.clear_cache:
+            clear_cache(args.files, args)
+        elif args.serve:
+            serve(args)
+        elif args.files and (len(args.files) > 1 or os.path.isdir(args.files[0])):
+            execute_files(expand_files(args.files), args)
+        elif args.file is not None and args.file.endswith(".lambda") and args.prewarm:
+            prewarm_cache(args.file, args)
+        elif args.file is not None and args.file.endswith(".lambda") and args.map:
+            map_file(args.file, args.map[0], args.map[1], args)
+        elif args.file is not None and args.file.endswith(".lambda") and args.disasm:
+            disassemble_file(args.file, args)
+        elif args.file is not None and args.file.endswith(".lambda"):
+            execute_file(args.file, args)
         else:
-            repl()
+            repl(args)
     except Exception as e:
         print(f"Unexpected error: {e}")
@@ -0,0 +1,116 @@
+from collections import OrderedDict
+
+from ast_node import LambdaExpression, FunctionApplication, PrimitiveApplication, Identifier, IntegerLiteral, \
+    BooleanLiteral, UnaryOperation, BinaryOperation, IfStatement
+from resolver import free_names
+
+
+def is_pure(node):
+    # Printing happens only for top-level results, so every expression of the language is pure
+    # as long as it is built from the known node types
+    return isinstance(node, (IntegerLiteral, BooleanLiteral, Identifier, BinaryOperation, UnaryOperation,
+                             LambdaExpression, FunctionApplication, PrimitiveApplication, IfStatement))
+
+
+def count_calls(node):
+    if isinstance(node, FunctionApplication):
+        calls = 1 + sum(count_calls(arg) for arg in node.args)
+        return calls if isinstance(node.func, str) else calls + count_calls(node.func)
+    elif isinstance(node, PrimitiveApplication):
+        return sum(count_calls(arg) for arg in node.args)
+    elif isinstance(node, BinaryOperation):
+        return count_calls(node.left) + count_calls(node.right)
+    elif isinstance(node, UnaryOperation):
+        return count_calls(node.operand)
+    elif isinstance(node, IfStatement):
+        calls = count_calls(node.condition) + count_calls(node.consequence)
+        return calls + count_calls(node.alternative) if node.alternative is not None else calls
+    return 0
+
+
+def is_memoizable(definition):
+    # Bodies with a single call site recurse linearly (like sum_to_n or sum_of_digits) and never
+    # repeat an argument within one call, so a memo table would only add a lookup per call and keep
+    # them from the JIT and the inliner; memoizing pays off once a body branches into several calls
+    # (like a naive Fibonacci)
+    return is_pure(definition.body) and count_calls(definition.body) >= 2
+
+
+class MemoTable:
+    def __init__(self, name, maxsize):
+        self.name = name
+        self.maxsize = maxsize
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def clear(self):
+        self.entries.clear()
+
+
+# Owns the memo tables of the memoized Defuns. Each closure gets its own table, so redefining a
+# function starts from an empty table, and tables of functions that reference a redefined name
+# are cleared as well.
+class Memoizer:
+    def __init__(self, maxsize=10000):
+        self.maxsize = maxsize
+        self.tables = {}      # Function name -> table of its current closure
+        self.retired = []     # Tables of closures that have been redefined, kept for the statistics
+        self.dependents = {}  # Global name -> names of the Defuns whose bodies reference it
+
+    def analyze(self, definition):
+        for name in free_names(definition):
+            self.dependents.setdefault(name, set()).add(definition.name)
+        return is_memoizable(definition)
+
+    def invalidate(self, name):
+        seen = set()
+        pending = [name]
+        while pending:
+            current = pending.pop()
+            if current in seen:
+                continue
+            seen.add(current)
+            table = self.tables.get(current)
+            if table is not None:
+                table.clear()
+            pending.extend(self.dependents.get(current, ()))
+
+    def define(self, name, body, memoizable):
+        # Called every time a Defun is (re)defined, returns the body to install in the new closure
+        self.invalidate(name)
+        if name in self.tables:
+            self.retired.append(self.tables.pop(name))
+        return self.wrap(name, body) if memoizable else body
+
+    def wrap(self, name, body):
+        table = MemoTable(name, self.maxsize)
+        self.tables[name] = table
+        entries = table.entries
+        maxsize = self.maxsize
+
+        def memoized(frame):
+            values = frame.values
+            # Types are part of the key because True == 1 and False == 0
+            key = (*values, *map(type, values))
+            if key in entries:
+                table.hits += 1
+                entries.move_to_end(key)
+                return entries[key]
+            table.misses += 1
+            result = body(frame)
+            entries[key] = result
+            if len(entries) > maxsize:
+                entries.popitem(last=False)
+                table.evictions += 1
+            return result
+
+        return memoized
+
+    def report(self):
+        lines = [f"{'function':<24}{'hits':>10}{'misses':>10}{'evictions':>11}{'size':>8}"]
+        for table in self.retired + list(self.tables.values()):
+            lines.append(f"{table.name:<24}{table.hits:>10}{table.misses:>10}{table.evictions:>11}"
+                         f"{len(table.entries):>8}")
+        return '\n'.join(lines)
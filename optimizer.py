@@ -0,0 +1,183 @@
+from ast_node import FunctionDefinition, LambdaExpression, FunctionApplication, PrimitiveApplication, \
+    Identifier, IntegerLiteral, BooleanLiteral, UnaryOperation, BinaryOperation, IfStatement
+from compiler import OPERATORS
+from errors import copy_span
+from primitives import PRIMITIVES
+
+
+# Largest integer the optimizer folds, so that folding stays quick however often a program
+# squares a literal; bigger results are computed at runtime
+FOLD_INT_BITS = 4096
+
+def is_literal(node):
+    return isinstance(node, (IntegerLiteral, BooleanLiteral))
+
+
+def make_literal(value):
+    if isinstance(value, bool):
+        return BooleanLiteral(value)
+    return IntegerLiteral(value)
+
+
+# Replaces the free occurrences of a lambda parameter with a literal, or returns None when the
+# parameter is used as a call target and the literal cannot take its place
+def substitute(node, name, literal):
+    if is_literal(node):
+        return node
+    elif isinstance(node, Identifier):
+        return literal if node.name == name else node
+    elif isinstance(node, BinaryOperation):
+        left = substitute(node.left, name, literal)
+        right = substitute(node.right, name, literal)
+        if left is None or right is None:
+            return None
+        return BinaryOperation(left, node.operator, right)
+    elif isinstance(node, UnaryOperation):
+        operand = substitute(node.operand, name, literal)
+        return UnaryOperation(node.operator, operand) if operand is not None else None
+    elif isinstance(node, LambdaExpression):
+        if node.params == name:  # The parameter is shadowed inside this lambda
+            return node
+        body = substitute(node.body, name, literal)
+        return LambdaExpression(node.params, body) if body is not None else None
+    elif isinstance(node, FunctionApplication):
+        if isinstance(node.func, str):
+            if node.func == name:
+                return None
+            func = node.func
+        else:
+            func = substitute(node.func, name, literal)
+        args = [substitute(arg, name, literal) for arg in node.args]
+        if func is None or any(arg is None for arg in args):
+            return None
+        return copy_span(node, FunctionApplication(func, args))
+    elif isinstance(node, PrimitiveApplication):
+        args = [substitute(arg, name, literal) for arg in node.args]
+        if any(arg is None for arg in args):
+            return None
+        return PrimitiveApplication(node.name, args)
+    elif isinstance(node, IfStatement):
+        condition = substitute(node.condition, name, literal)
+        consequence = substitute(node.consequence, name, literal)
+        alternative = substitute(node.alternative, name, literal) if node.alternative is not None else None
+        if condition is None or consequence is None or (node.alternative is not None and alternative is None):
+            return None
+        return IfStatement(condition, consequence, alternative)
+    return None
+
+
+# Folds operations on literals, prunes branches with constant conditions and beta-reduces lambdas
+# applied to literals. Anything that would raise at runtime, like a division by zero, is left in
+# place so that the error still happens when the program runs, and so is a product bigger than
+# int_bits, the --max-int-bits limit the program will run under.
+class Optimizer:
+    def __init__(self, int_bits=None):
+        self.int_bits = int_bits
+
+    def optimize(self, statements):
+        return [self.optimize_statement(node) for node in statements]
+
+    def optimize_statement(self, node):
+        return copy_span(node, self.optimize_node(node))
+
+    def optimize_node(self, node):
+        if is_literal(node) or isinstance(node, Identifier):
+            return node
+
+        elif isinstance(node, BinaryOperation):
+            return self.fold_binary_operation(node)
+
+        elif isinstance(node, UnaryOperation):
+            operand = self.optimize_node(node.operand)
+            if node.operator == '!' and is_literal(operand):
+                return BooleanLiteral(not operand.value)
+            return UnaryOperation(node.operator, operand)
+
+        elif isinstance(node, FunctionDefinition):
+            return FunctionDefinition(node.name, node.params, self.optimize_node(node.body))
+
+        elif isinstance(node, LambdaExpression):
+            return LambdaExpression(node.params, self.optimize_node(node.body))
+
+        elif isinstance(node, FunctionApplication):
+            func = node.func if isinstance(node.func, str) else self.optimize_node(node.func)
+            args = [self.optimize_node(arg) for arg in node.args]
+            return copy_span(node, self.beta_reduce(func, args))
+
+        elif isinstance(node, PrimitiveApplication):
+            return self.fold_primitive_application(node)
+
+        elif isinstance(node, IfStatement):
+            condition = self.optimize_node(node.condition)
+            consequence = self.optimize_node(node.consequence)
+            alternative = self.optimize_node(node.alternative) if node.alternative is not None else None
+            if is_literal(condition):
+                if condition.value:
+                    return consequence
+                if alternative is not None:
+                    return alternative
+            return IfStatement(condition, consequence, alternative)
+
+        else:
+            raise TypeError(f"Unknown node type: {type(node)}")
+
+    def fold_binary_operation(self, node):
+        # A chain like 1 + 2 + ... + n nests down its left side; the operations along it are
+        # folded in a loop, so that a long chain does not run out of Python stack
+        chain = []
+        while isinstance(node, BinaryOperation):
+            chain.append(node)
+            node = node.left
+        left = self.optimize_node(node)
+        for node in reversed(chain):
+            left = self.fold_operands(node, left, self.optimize_node(node.right))
+        return left
+
+    def fold_operands(self, node, left, right):
+        if is_literal(left):
+            # Short-circuit logical operators only need a constant left side
+            if node.operator == '||':
+                return BooleanLiteral(True) if left.value else right
+            if node.operator == '&&':
+                return right if left.value else BooleanLiteral(False)
+            if is_literal(right) and node.operator in OPERATORS:
+                try:
+                    value = OPERATORS[node.operator](left.value, right.value)
+                except Exception:
+                    value = None  # Keep the operation so the error is raised at runtime
+                if value is not None and self.fits(node.operator, value):
+                    return make_literal(value)
+
+        return BinaryOperation(left, node.operator, right)
+
+    def fits(self, operator, value):
+        if isinstance(value, bool):
+            return True
+        bits = value.bit_length()
+        if operator == '*' and self.int_bits is not None and bits > self.int_bits:
+            return False
+        return bits <= FOLD_INT_BITS
+
+    def fold_primitive_application(self, node):
+        args = [self.optimize_node(arg) for arg in node.args]
+        # pow is left to runtime, where its result can be checked against --max-int-bits
+        if node.name != 'pow' and all(is_literal(arg) for arg in args):
+            try:
+                return make_literal(PRIMITIVES[node.name][1](*[arg.value for arg in args]))
+            except Exception:
+                pass  # Keep the call so the error is raised at runtime
+        return PrimitiveApplication(node.name, args)
+
+    def beta_reduce(self, func, args):
+        # (Lambd x. body)(literal, rest...) becomes body[x := literal](rest...)
+        while isinstance(func, LambdaExpression) and args and is_literal(args[0]):
+            body = substitute(func.body, func.params, args[0])
+            if body is None:
+                break
+            func, args = self.optimize_node(body), args[1:]
+            if not args:
+                return func
+
+        if isinstance(func, LambdaExpression) and not args:  # A lambda applied to nothing is itself
+            return func
+        return FunctionApplication(func, args)
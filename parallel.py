@@ -0,0 +1,109 @@
+from concurrent.futures import ProcessPoolExecutor
+
+from ast_node import FunctionDefinition
+from errors import INLINED, SPANS, capture, spans_of
+from inliner import walk
+from interpreter import Interpreter
+from resolver import free_names
+
+
+def statement_dependencies(statements):
+    # For each top-level statement, the positions of the Defuns it can reach, directly or through
+    # other Defuns. Every definition of a name made before the statement is kept, in order, so
+    # replaying them rebuilds exactly the globals the statement would see when run sequentially.
+    definitions = {}  # Name -> positions of its Defuns so far
+    dependencies = []
+    for index, node in enumerate(statements):
+        needed = set()
+        pending = list(free_names(node))
+        while pending:
+            for position in definitions.get(pending.pop(), ()):
+                if position not in needed:
+                    needed.add(position)
+                    pending.extend(free_names(statements[position]))
+        dependencies.append(needed)
+        if isinstance(node, FunctionDefinition):
+            definitions.setdefault(node.name, []).append(index)
+    return dependencies
+
+
+def run_statements(create_interpreter, options, names, prelude, statements, spans=None, inlined=None,
+                   fusible=None):
+    # Runs in a worker process: replays the Defuns the statements need, then returns what
+    # Interpreter.interpret would print for each statement. spans carries the source positions
+    # and inlined the calls the inliner replaced, neither travels with the pickled nodes, and
+    # fusible the subtrees of these statements that --typecheck let the compiled engine fuse.
+    # A worker runs one call at a time, so the entries replace any left by an earlier call
+    SPANS.update(spans or {})
+    INLINED.update(inlined or {})
+    interpreter = create_interpreter(prelude + statements, options, fusible)
+    compiler = getattr(interpreter, 'compiler', None)
+    if compiler is not None:
+        # Declare every Defun of the whole program, so names defined further down fail the same
+        # way they would in a sequential run
+        for name in names:
+            compiler.resolver.global_scope.declare(name)
+    if interpreter.limits is not None:
+        interpreter.limits.start()  # Each chunk gets the full budgets, see ParallelInterpreter
+
+    for node in prelude:
+        try:
+            interpreter.eval(node, interpreter.global_env)
+        except Exception:
+            pass  # Already reported by the chunk that owns this Defun
+
+    outputs = []
+    for node in statements:
+        try:
+            result = interpreter.eval(node, interpreter.global_env)
+            outputs.append(str(result) if result is not None else None)
+        except Exception as e:
+            outputs.append(capture(e, node).format())
+    return outputs
+
+
+# Splits the top-level statements into chunks of consecutive statements and runs the chunks in a
+# process pool. Each chunk carries only the Defuns its statements depend on, and the results are
+# printed in source order, so the output is the same as a sequential run of the chosen engine.
+# Evaluation limits are the exception: the step budget and the time limit apply to each chunk on
+# its own, not to the whole program, since chunks run at once and could not share them.
+class ParallelInterpreter(Interpreter):
+    def __init__(self, ast, create_interpreter, options, jobs, chunk_size=None, fusible=None):
+        super().__init__(ast)
+        self.create_interpreter = create_interpreter  # Builds the engine; must be picklable
+        self.options = options
+        self.jobs = jobs
+        self.chunk_size = chunk_size
+        self.fusible = fusible  # Subtrees the compiled engine may fuse, see main.typecheck
+
+    def chunks(self):
+        statements = self.ast
+        # A few chunks per worker keeps them busy when statements take uneven time
+        size = self.chunk_size or max(1, -(-len(statements) // (self.jobs * 4)))
+        dependencies = statement_dependencies(statements)
+        for start in range(0, len(statements), size):
+            stop = min(start + size, len(statements))
+            needed = set()
+            for index in range(start, stop):
+                needed |= dependencies[index]
+            prelude = [statements[position] for position in sorted(needed) if position < start]
+            yield prelude, statements[start:stop]
+
+    def fusible_in(self, statements):
+        if self.fusible is None:
+            return None
+        return {node for statement in statements for node in walk(statement) if node in self.fusible}
+
+    def interpret(self):
+        print("Starting interpretation...")
+        names = [node.name for node in self.ast if isinstance(node, FunctionDefinition)]
+        with ProcessPoolExecutor(max_workers=self.jobs) as executor:
+            futures = [executor.submit(run_statements, self.create_interpreter, self.options, names, prelude,
+                                       statements, spans_of(prelude + statements),
+                                       spans_of(prelude + statements, INLINED), self.fusible_in(prelude + statements))
+                       for prelude, statements in self.chunks()]
+            for future in futures:
+                for output in future.result():
+                    if output is not None:
+                        print(output)
+        print("Interpretation finished...")
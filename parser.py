@@ -1,5 +1,9 @@
 from ast_node import FunctionDefinition, LambdaExpression, FunctionApplication, Identifier, \
     IntegerLiteral, BooleanLiteral, UnaryOperation, BinaryOperation, IfStatement
+from errors import SPANS, copy_span, locate
+from lexer import TOKEN_NAMES, DEFUN, NAME, ARGUMENTS, LAMBD, IF, ELSE, INTEGER, BOOL, ID, ARITH_OP, BOOL_OP, \
+    COMP_OP, NOT, LPAREN, RPAREN, LBRACE, RBRACE, COMMA, COLON, DOT, EOF
+from primitives import PRIMITIVES, bind_primitives
 
 
 class BNFLoader:
@@ -24,13 +28,22 @@ class BNFLoader:
         return rules
 
 
+EOF_TOKEN = (EOF, 'EOF', -1, -1)
+
+
 class Parser:
-    def __init__(self, tokens, bnf_file_path=None, debug=False):
-        self.tokens = tokens
+    def __init__(self, tokens, bnf_file_path=None, debug=False, defined=None):
+        # Tokens may be a list or a generator; only the current token and one token of
+        # lookahead are kept, so a token stream is consumed as the parser advances
+        self.tokens = iter(tokens)
         self.pos = 0
-        self.current_token = self.tokens[self.pos] if tokens else None
+        self.current_token = next(self.tokens, None)
+        self.next_token = next(self.tokens, EOF_TOKEN)
         self.debug = debug
         self.rules = BNFLoader(bnf_file_path).rules if bnf_file_path else None
+        # Names of the Defuns seen so far, which shadow builtins; a REPL shares one set across inputs
+        self.defined = defined if defined is not None else set()
+        self.mentions_primitive = False  # Whether the statement being parsed names a builtin
 
     def log(self, message):
         if self.debug:
@@ -40,23 +53,24 @@ class Parser:
         line = self.current_token[2]
         col = self.current_token[3]
         raise SyntaxError(
-            f"Syntax Error at line {line}, column {col}: {message}. Current token: {self.current_token[0]}")
+            f"Syntax Error at line {line}, column {col}: {message}. Current token: {TOKEN_NAMES[self.current_token[0]]}")
 
     def advance(self):
         self.log(f"Advancing from {self.current_token}")
         self.pos += 1
-        if self.pos < len(self.tokens):
-            self.current_token = self.tokens[self.pos]
-        else:
-            self.current_token = ('EOF', 'EOF', -1, -1)
+        self.current_token = self.next_token
+        self.next_token = next(self.tokens, EOF_TOKEN)
         self.log(f"Current token is now {self.current_token}")
 
+    def peek(self):
+        return self.next_token
+
     def expect(self, token_type):
-        self.log(f"Expecting {token_type}, current token: {self.current_token[0]}")
+        self.log(f"Expecting {TOKEN_NAMES[token_type]}, current token: {TOKEN_NAMES[self.current_token[0]]}")
         if self.current_token and self.current_token[0] == token_type:
             self.advance()
         else:
-            self.error(f"Expected token {token_type} but got {self.current_token[0]}")
+            self.error(f"Expected token {TOKEN_NAMES[token_type]} but got {TOKEN_NAMES[self.current_token[0]]}")
 
     def parse(self):
         try:
@@ -67,40 +81,66 @@ class Parser:
         except Exception as e:
             raise RuntimeError(f"Parsing failed: {str(e)}")
 
+    def statements(self):
+        # Yields one top-level statement at a time, so each can run before the next is parsed
+        try:
+            while self.current_token[0] != EOF:
+                yield self.next_statement()
+        except Exception as e:
+            raise RuntimeError(f"Parsing failed: {str(e)}")
+
     def program(self):
         self.log("Parsing program...")
         statements = []
-        while self.current_token[0] != 'EOF':
-            statements.append(self.parse_statement())
+        while self.current_token[0] != EOF:
+            statements.append(self.next_statement())
         self.log(f"Program parsed with {len(statements)} statement(s).")
         return statements
 
+    def next_statement(self):
+        # A Defun shadows the builtin of the same name from its own definition on, in a whole
+        # program as in a stream, so calls written before it still reach the builtin
+        self.mentions_primitive = False
+        statement = self.parse_statement()
+        if isinstance(statement, FunctionDefinition):
+            self.defined.add(statement.name)
+        return self.bind(statement) if self.mentions_primitive else statement
+
+    def bind(self, statement):
+        return copy_span(statement, bind_primitives(statement, self.defined))
+
     def parse_statement(self):
         self.log(f"Parsing statement with token: {self.current_token}")
-        if self.current_token[0] == 'DEFUN':
-            return self.parse_function_def()
-        elif self.current_token[0] == 'IF':
-            return self.parse_if_statement()
-        elif self.current_token[0] == 'LPAREN' and self.tokens[self.pos + 1][0] == 'LAMBD':
-            return self.parse_lambda_expr()
+        span = self.current_token[2:4]
+        if self.current_token[0] == DEFUN:
+            statement = self.parse_function_def()
+        elif self.current_token[0] == IF:
+            statement = self.parse_if_statement()
+        elif self.current_token[0] == LPAREN and self.peek()[0] == LAMBD:
+            statement = self.parse_lambda_expr()
         else:
-            return self.parse_expression()
+            statement = self.parse_expression()
+        # Runtime errors are reported at the line and column where their statement starts; a
+        # statement that is a call keeps the position parse_function_call gave it
+        if isinstance(statement, FunctionApplication) and statement in SPANS:
+            return statement
+        return locate(statement, span)
 
     def parse_function_def(self):
         self.log("Parsing function definition")
         try:
-            self.expect('DEFUN')
-            self.expect('LBRACE')
-            self.expect('NAME')
-            self.expect('COLON')
+            self.expect(DEFUN)
+            self.expect(LBRACE)
+            self.expect(NAME)
+            self.expect(COLON)
             func_name = self.current_token[1]
-            self.expect('ID')
-            self.expect('COMMA')
-            self.expect('ARGUMENTS')
-            self.expect('COLON')
+            self.expect(ID)
+            self.expect(COMMA)
+            self.expect(ARGUMENTS)
+            self.expect(COLON)
             params = self.parse_params()
-            self.expect('RBRACE')
-            if self.current_token[0] == 'IF':
+            self.expect(RBRACE)
+            if self.current_token[0] == IF:
                 body = self.parse_if_statement()
             else:
                 body = self.parse_expression()
@@ -112,75 +152,79 @@ class Parser:
     def parse_if_statement(self):
         try:
             self.log("Parsing if statement")
-            self.expect('IF')
+            self.expect(IF)
             condition = self.parse_expression()
-            self.expect('LBRACE')
+            self.expect(LBRACE)
             consequence = self.parse_expression()
-            self.expect('RBRACE')
+            self.expect(RBRACE)
             alternative = None
-            if self.current_token[0] == 'ELSE':
-                self.expect('ELSE')
-                self.expect('LBRACE')
+            if self.current_token[0] == ELSE:
+                self.expect(ELSE)
+                self.expect(LBRACE)
                 alternative = self.parse_expression()
-                self.expect('RBRACE')
+                self.expect(RBRACE)
             return IfStatement(condition, consequence, alternative)
         except SyntaxError as e:
             self.error(f"Error parsing if statement: {e}")
 
     def parse_lambda_expr(self):
         self.log("Parsing lambda expression")
-        self.expect('LPAREN')
-        self.expect('LAMBD')
-        if self.current_token[0] == 'ID':
+        span = self.current_token[2:4]
+        self.expect(LPAREN)
+        self.expect(LAMBD)
+        if self.current_token[0] == ID:
             params = self.current_token[1]
-            self.expect('ID')
-            self.expect('DOT')
+            self.expect(ID)
+            self.expect(DOT)
         body = self.parse_expression()
-        self.expect('RPAREN')
+        self.expect(RPAREN)
         lambda_expr = LambdaExpression(params=params, body=body)
         self.log(f"Constructed lambda expression: {lambda_expr}")
-        if self.current_token[0] == 'LPAREN':
+        if self.current_token[0] == LPAREN:
             self.log("Lambda expression is followed by a call, parsing lambda call")
-            return self.parse_lambda_call(lambda_expr)
+            return self.parse_lambda_call(lambda_expr, span)
         return lambda_expr
 
-    def parse_lambda_call(self, func):
+    def parse_lambda_call(self, func, span=None):
         self.log(f"Parsing lambda call for: {func}")
-        self.expect('LPAREN')
+        self.expect(LPAREN)
         args = self.parse_args()
-        self.expect('RPAREN')
+        self.expect(RPAREN)
         self.log(f"lambda call '{func}' with args: {args}")
-        return FunctionApplication(func=func, args=args)
+        call = FunctionApplication(func=func, args=args)
+        return locate(call, span) if span is not None else call
 
     def parse_function_call(self, func):
         self.log(f"Parsing function call for: {func}")
+        span = self.current_token[2:4]
         func = self.current_token[1]
-        self.expect('ID')
-        self.expect('LPAREN')
+        self.mentions_primitive = self.mentions_primitive or func in PRIMITIVES
+        self.expect(ID)
+        self.expect(LPAREN)
         args = self.parse_args()
-        self.expect('RPAREN')
+        self.expect(RPAREN)
         self.log(f"Function call '{func}' with args: {args}")
-        return FunctionApplication(func=func, args=args)
+        return locate(FunctionApplication(func=func, args=args), span)
 
     def parse_params(self):
         self.log("Parsing parameters")
         params = []
-        self.expect('LPAREN')
-        while self.current_token[0] == 'ID' and self.tokens[self.pos + 1][0] == 'COMMA':
+        self.expect(LPAREN)
+        while self.current_token[0] == ID and self.peek()[0] == COMMA:
             params.append(self.current_token[1])
-            self.expect('ID')
-            self.expect('COMMA')
-        self.expect('RPAREN')
+            self.expect(ID)
+            self.expect(COMMA)
+        self.expect(RPAREN)
         return params
 
     def parse_args(self):
         self.log("Parsing arguments")
         args = []
-        while self.current_token[0] != 'RPAREN':
+        while self.current_token[0] != RPAREN:
             args.append(self.parse_expression())
-            if self.current_token[0] == 'COMMA':
-                self.expect('COMMA')
-            elif self.current_token[0] == 'RPAREN':
+            if self.current_token[0] == COMMA:
+                self.expect(COMMA)
+            elif self.current_token[0] == RPAREN:
                 break
             else:
                 self.error(f"Unexpected token in argument list: {self.current_token}")
@@ -190,42 +234,43 @@ class Parser:
         self.log(f"Parsing expression with token: {self.current_token}")
 
         def parse_term():
-            if self.current_token[0] == 'NOT':
+            if self.current_token[0] == NOT:
                 op = self.current_token[1]
-                self.expect('NOT')
+                self.expect(NOT)
                 expr = self.parse_expression()
                 unary_op = UnaryOperation(op, expr)
                 return unary_op
 
-            if self.current_token[0] == 'ID' and self.pos + 1 < len(self.tokens) and self.tokens[self.pos + 1][0] == 'LPAREN':
+            if self.current_token[0] == ID and self.peek()[0] == LPAREN:
                 return self.parse_function_call(self.current_token[1])
 
-            if self.current_token[0] == 'LPAREN' and self.pos + 1 < len(self.tokens) and self.tokens[self.pos + 1][0] == 'LAMBD':
+            if self.current_token[0] == LPAREN and self.peek()[0] == LAMBD:
                 return self.parse_lambda_expr()
 
-            if self.current_token[0] == 'INTEGER':
+            if self.current_token[0] == INTEGER:
                 number = IntegerLiteral(self.current_token[1])
-                self.expect('INTEGER')
+                self.expect(INTEGER)
                 return number
 
-            if self.current_token[0] == 'BOOL':
+            if self.current_token[0] == BOOL:
                 boolean = BooleanLiteral(self.current_token[1])
-                self.expect('BOOL')
+                self.expect(BOOL)
                 return boolean
 
-            if self.current_token[0] == 'ID':
+            if self.current_token[0] == ID:
                 identifier = Identifier(self.current_token[1])
-                self.expect('ID')
+                self.mentions_primitive = self.mentions_primitive or identifier.name in PRIMITIVES
+                self.expect(ID)
                 return identifier
 
-            if self.current_token[0] == 'LPAREN':
-                self.expect('LPAREN')
+            if self.current_token[0] == LPAREN:
+                self.expect(LPAREN)
                 expr = self.parse_expression()
-                self.expect('RPAREN')
+                self.expect(RPAREN)
                 return expr
 
             self.error(
-                f"Unexpected token: '{self.current_token[0]}' at line {self.current_token[2]}, column {self.current_token[3]}")
+                f"Unexpected token: '{TOKEN_NAMES[self.current_token[0]]}' at line {self.current_token[2]}, column {self.current_token[3]}")
 
         def parse_operation(parse_func, valid_operators):
             left = parse_func()
@@ -236,4 +281,4 @@ class Parser:
                 left = BinaryOperation(left, op, right)
             return left
 
-        return parse_operation(parse_term, {'ARITH_OP', 'BOOL_OP', 'COMP_OP'})
\ No newline at end of file
+        return parse_operation(parse_term, {ARITH_OP, BOOL_OP, COMP_OP})
\ No newline at end of file
@@ -0,0 +1,91 @@
+import math
+
+from ast_node import FunctionDefinition, LambdaExpression, FunctionApplication, PrimitiveApplication, \
+    Identifier, UnaryOperation, BinaryOperation, IfStatement
+from errors import SPANS, copy_span
+
+
+def power(base, exponent):
+    if exponent < 0:
+        raise ValueError("pow expects a non-negative exponent")
+    return base ** exponent
+
+
+def integer_sqrt(n):
+    if n < 0:
+        raise ValueError("isqrt expects a non-negative number")
+    return math.isqrt(n)
+
+
+def digit_sum(n):
+    return sum(map(int, str(abs(n))))
+
+
+def digit_count(n):
+    return len(str(abs(n)))
+
+
+# Builtin functions: name -> (arity, implementation). Calls to them are bound when a program is
+# parsed, so they run as one Python call instead of a Defun recursing through the interpreter.
+PRIMITIVES = {
+    'abs': (1, abs),
+    'min': (2, min),
+    'max': (2, max),
+    'pow': (2, power),
+    'gcd': (2, math.gcd),
+    'isqrt': (1, integer_sqrt),
+    'digit_sum': (1, digit_sum),
+    'digit_count': (1, digit_count),
+}
+
+# Parameters of the lambdas standing in for builtins used as values, e.g. passed to a function
+ETA_PARAMS = ('a', 'b', 'c')
+
+
+def bind_primitives(node, defined, bound=frozenset()):
+    # Replaces the calls of builtin names that no Defun in `defined` and no enclosing parameter
+    # shadows with PrimitiveApplication nodes, and such names used as values with a lambda
+    # calling the builtin. Arity errors are reported here, since the arity is known.
+    if isinstance(node, Identifier):
+        if node.name in PRIMITIVES and node.name not in bound and node.name not in defined:
+            arity = PRIMITIVES[node.name][0]
+            params = ETA_PARAMS[:arity]
+            function = PrimitiveApplication(node.name, [Identifier(param) for param in params])
+            for param in reversed(params):
+                function = LambdaExpression(param, function)
+            return function
+        return node
+
+    elif isinstance(node, BinaryOperation):
+        return BinaryOperation(bind_primitives(node.left, defined, bound), node.operator,
+                               bind_primitives(node.right, defined, bound))
+
+    elif isinstance(node, UnaryOperation):
+        return UnaryOperation(node.operator, bind_primitives(node.operand, defined, bound))
+
+    elif isinstance(node, FunctionDefinition):
+        body = bind_primitives(node.body, defined, bound | set(node.params))
+        return FunctionDefinition(node.name, node.params, body)
+
+    elif isinstance(node, LambdaExpression):
+        return LambdaExpression(node.params, bind_primitives(node.body, defined, bound | {node.params}))
+
+    elif isinstance(node, FunctionApplication):
+        args = [bind_primitives(arg, defined, bound) for arg in node.args]
+        if not isinstance(node.func, str):
+            return copy_span(node, FunctionApplication(bind_primitives(node.func, defined, bound), args))
+        if node.func in PRIMITIVES and node.func not in bound and node.func not in defined:
+            arity = PRIMITIVES[node.func][0]
+            if len(args) != arity:
+                span = SPANS.get(node)
+                where = f" at line {span[0]}, column {span[1]}" if span is not None else ""
+                raise SyntaxError(f"Builtin '{node.func}'{where} takes {arity} argument(s) but got {len(args)}")
+            return copy_span(node, PrimitiveApplication(node.func, args))
+        return copy_span(node, FunctionApplication(node.func, args))
+
+    elif isinstance(node, IfStatement):
+        alternative = bind_primitives(node.alternative, defined, bound) if node.alternative is not None else None
+        return IfStatement(bind_primitives(node.condition, defined, bound),
+                           bind_primitives(node.consequence, defined, bound), alternative)
+
+    return node
@@ -0,0 +1,103 @@
+from time import perf_counter
+
+
+class FunctionStats:
+    def __init__(self, name):
+        self.name = name
+        self.calls = 0
+        self.self_time = 0.0
+        self.cumulative_time = 0.0  # Time of the outermost activations only, so recursion is not counted twice
+        self.depth = 0              # Activations currently running
+        self.max_depth = 0
+        self.frames = 0             # Frames allocated by calls made from this function's body
+
+
+# Collects statistics from the closures the compiler instruments when it is given a profiler.
+# Nothing is instrumented without one, so the compiled code is unchanged when profiling is off.
+# Call stacks are kept as nodes of a tree, where each node stands for one path of function names
+# from the top level, so tracking the stack costs the same at any recursion depth.
+class Profiler:
+    def __init__(self):
+        self.functions = {}     # Function name -> FunctionStats
+        self.node_counts = {}   # Node type name -> one-element list holding its evaluation count
+        self.top = FunctionStats('<top level>')
+        self.paths = [(None, None)]         # Stack path id -> (parent path id, function name)
+        self.path_ids = {}                  # (parent path id, function name) -> stack path id
+        self.path_times = [0.0]             # Stack path id -> self time spent on that path
+        # Running activations: [stats, path id, time spent in callees]
+        self.stack = [[self.top, 0, 0.0]]
+
+    def count(self, kind, evaluate):
+        cell = self.node_counts.setdefault(kind, [0])
+
+        def counted(frame):
+            cell[0] += 1
+            return evaluate(frame)
+
+        return counted
+
+    def instrument(self, name, body):
+        stats = self.functions.get(name)
+        if stats is None:
+            stats = self.functions[name] = FunctionStats(name)
+        stack = self.stack
+        path_ids = self.path_ids
+        path_times = self.path_times
+
+        def profiled(frame):
+            caller = stack[-1]
+            caller[0].frames += 1
+            key = (caller[1], name)
+            path = path_ids.get(key)
+            if path is None:
+                path = path_ids[key] = len(self.paths)
+                self.paths.append(key)
+                path_times.append(0.0)
+            stats.calls += 1
+            stats.depth += 1
+            if stats.depth > stats.max_depth:
+                stats.max_depth = stats.depth
+            entry = [stats, path, 0.0]
+            stack.append(entry)
+            start = perf_counter()
+            try:
+                return body(frame)
+            finally:
+                elapsed = perf_counter() - start
+                stack.pop()
+                own = elapsed - entry[2]
+                stats.self_time += own
+                path_times[path] += own
+                stats.depth -= 1
+                if stats.depth == 0:
+                    stats.cumulative_time += elapsed
+                stack[-1][2] += elapsed
+
+        return profiled
+
+    def path_names(self, path):
+        names = []
+        while path:
+            path, name = self.paths[path]
+            names.append(name)
+        return names[::-1]
+
+    def report(self):
+        lines = [f"{'function':<24}{'calls':>10}{'self (s)':>12}{'cumul. (s)':>12}{'max depth':>11}"
+                 f"{'frames':>10}"]
+        for stats in sorted(self.functions.values(), key=lambda stats: stats.self_time, reverse=True):
+            lines.append(f"{stats.name:<24}{stats.calls:>10}{stats.self_time:>12.6f}{stats.cumulative_time:>12.6f}"
+                         f"{stats.max_depth:>11}{stats.frames:>10}")
+        lines.append(f"{self.top.name:<24}{'':>10}{'':>12}{'':>12}{'':>11}{self.top.frames:>10}")
+        lines.append('')
+        lines.append(f"{'node type':<24}{'evaluations':>12}")
+        for kind, cell in sorted(self.node_counts.items(), key=lambda item: item[1][0], reverse=True):
+            lines.append(f"{kind:<24}{cell[0]:>12}")
+        return '\n'.join(lines)
+
+    def write_folded(self, file):
+        # One "caller;callee;... microseconds" line per stack, the input format of flamegraph tools
+        for path in range(1, len(self.paths)):
+            microseconds = round(self.path_times[path] * 1e6)
+            if microseconds > 0:
+                file.write(f"{';'.join(self.path_names(path))} {microseconds}\n")
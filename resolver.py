@@ -0,0 +1,122 @@
+from ast_node import FunctionDefinition, LambdaExpression, FunctionApplication, PrimitiveApplication, \
+    Identifier, IntegerLiteral, BooleanLiteral, UnaryOperation, BinaryOperation, IfStatement
+
+
+# Marks a global slot that has been declared but not yet defined
+UNDEFINED = object()
+
+
+def free_names(node, bound=frozenset()):
+    if isinstance(node, (IntegerLiteral, BooleanLiteral)):
+        return set()
+    elif isinstance(node, Identifier):
+        return set() if node.name in bound else {node.name}
+    elif isinstance(node, BinaryOperation):
+        return free_names(node.left, bound) | free_names(node.right, bound)
+    elif isinstance(node, UnaryOperation):
+        return free_names(node.operand, bound)
+    elif isinstance(node, FunctionDefinition):
+        return free_names(node.body, bound | set(node.params) | {node.name})
+    elif isinstance(node, LambdaExpression):
+        return free_names(node.body, bound | {node.params})
+    elif isinstance(node, FunctionApplication):
+        if isinstance(node.func, str):
+            names = set() if node.func in bound else {node.func}
+        else:
+            names = free_names(node.func, bound)
+        for arg in node.args:
+            names |= free_names(arg, bound)
+        return names
+    elif isinstance(node, PrimitiveApplication):
+        names = set()
+        for arg in node.args:
+            names |= free_names(arg, bound)
+        return names
+    elif isinstance(node, IfStatement):
+        names = free_names(node.condition, bound) | free_names(node.consequence, bound)
+        if node.alternative is not None:
+            names |= free_names(node.alternative, bound)
+        return names
+    else:
+        raise TypeError(f"Unknown node type: {type(node)}")
+
+
+class Scope:
+    def __init__(self, params, parent=None):
+        self.params = list(params)  # Parameter names, in slot order
+        self.parent = parent        # Enclosing function scope, None for a top-level function
+
+    def lookup(self, name):
+        scope = self
+        depth = 0
+        while scope is not None:
+            if name in scope.params:
+                return depth, scope.params.index(name)
+            scope = scope.parent
+            depth += 1
+        return None
+
+
+def captured_names(node, scope):
+    # Free variables of a lambda bound by the enclosing functions, in the order of their lexical
+    # addresses. They are all its closure needs to keep: globals are read from the global frame.
+    addresses = {}
+    for name in free_names(node):
+        address = scope.lookup(name) if scope is not None else None
+        if address is not None:
+            addresses[name] = address
+    return sorted(addresses, key=addresses.get)
+
+
+def holds_only(scope, names):
+    # Whether the frames of scope hold exactly the given names, so that a closure needing them
+    # can keep those frames as they are instead of copying the values out
+    held = []
+    while scope is not None:
+        held.extend(scope.params)
+        scope = scope.parent
+    return len(held) == len(names) and set(held) == set(names)
+
+
+class GlobalScope:
+    def __init__(self):
+        self.slots = {}   # Name -> slot index into values
+        self.values = []  # The global frame, shared by every compiled closure
+
+    def declare(self, name):
+        if name not in self.slots:
+            self.slots[name] = len(self.values)
+            self.values.append(UNDEFINED)
+        return self.slots[name]
+
+    def lookup(self, name):
+        return self.slots.get(name)
+
+
+# Assigns each identifier a lexical address before anything runs:
+# (depth, slot) for a parameter of an enclosing function, (None, slot) for a global
+class Resolver:
+    def __init__(self, global_scope=None, strict=True):
+        self.global_scope = global_scope if global_scope is not None else GlobalScope()
+        # A whole program declares its Defuns up front, so any other name is an error when the
+        # statement using it is compiled. A streamed program or a REPL session may define it in a
+        # later statement, so it is then declared as a global on first use instead, and only
+        # fails if it is still undefined when evaluated.
+        self.strict = strict
+
+    def declare_globals(self, statements):
+        # Every Defun in the program gets a global slot up front, so forward references resolve
+        for node in statements:
+            if isinstance(node, FunctionDefinition):
+                self.global_scope.declare(node.name)
+
+    def resolve(self, name, scope):
+        address = scope.lookup(name) if scope is not None else None
+        if address is not None:
+            return address
+        slot = self.global_scope.lookup(name)
+        if slot is not None:
+            return None, slot
+        if not self.strict:
+            return None, self.global_scope.declare(name)
+        raise NameError(f"Unresolved identifier: {name}")
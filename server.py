@@ -0,0 +1,331 @@
+import asyncio
+import copy
+import hashlib
+import json
+import multiprocessing
+import time
+from collections import deque
+
+from ast_node import FunctionDefinition, FunctionApplication
+from errors import capture
+from inliner import rewrite_program
+from lexer import Lexer
+from limits import LimitExceeded
+from optimizer import Optimizer, make_literal
+from parser import Parser
+
+
+# Seconds a call may run when neither --timeout nor the request sets a limit
+DEFAULT_TIMEOUT = 5.0
+# Time a worker gets beyond the request timeout to answer before the call is given up on and the
+# worker replaced
+GRACE_SECONDS = 1.0
+# Bits an integer result may have when --max-int-bits sets no limit. Limits only stop a call
+# between operations, and without this a call squaring its argument would soon spend longer than
+# any deadline in a single multiplication.
+DEFAULT_INT_BITS = 1 << 20
+# Calls queued per worker before the server stops reading requests, pushing back on clients
+QUEUE_PER_WORKER = 16
+# Longest request line, a register request carries the whole program
+MAX_LINE = 16 * 1024 * 1024
+# Latencies kept for the percentiles
+LATENCY_WINDOW = 10000
+
+# Programs compiled in this worker process: name -> (source digest, interpreter)
+WORKER_PROGRAMS = {}
+
+
+def parse_program(source, options):
+    ast = Parser(Lexer(source).tokenize()).parse()
+    if not options.optimize:
+        return ast
+    return rewrite_program(Optimizer(options.max_int_bits).optimize(ast), options.inline, options.cse,
+                           int_bits=options.max_int_bits)
+
+
+def failure(message, timeout=False):
+    response = {'ok': False, 'error': message}
+    if timeout:
+        response['timeout'] = True
+    return response
+
+
+def worker_program(create_interpreter, options, name, digest, source):
+    # Runs in a worker: a program is parsed and its Defuns installed the first time the worker
+    # gets a call for it, then stays warm until it is registered again with a different source.
+    # Calls only carry the source once the worker has answered that it is missing, else None.
+    entry = WORKER_PROGRAMS.get(name)
+    if entry is not None and entry[0] == digest:
+        return entry[1]
+    if source is None:
+        return None
+    definitions = [node for node in parse_program(source, options) if isinstance(node, FunctionDefinition)]
+    interpreter = create_interpreter(definitions, options)
+    compiler = getattr(interpreter, 'compiler', None)
+    if compiler is not None:
+        compiler.resolver.declare_globals(definitions)
+    for node in definitions:
+        try:
+            interpreter.eval(node, interpreter.global_env)
+        except Exception:
+            pass  # Calls reaching this Defun fail with the usual error
+    WORKER_PROGRAMS[name] = (digest, interpreter)
+    return interpreter
+
+
+def run_call(create_interpreter, options, name, digest, function, args, timeout, source=None):
+    # Runs in a worker and returns the response, so exceptions never need to be pickled
+    try:
+        interpreter = worker_program(create_interpreter, options, name, digest, source)
+    except Exception as e:
+        return failure(f"Could not load program '{name}': {e}")
+    if interpreter is None:
+        return {'ok': False, 'missing': True}  # Answered by sending the source, never to a client
+    limits = interpreter.limits
+    limits.timeout = timeout
+    limits.start()
+    call = FunctionApplication(function, [make_literal(arg) for arg in args])
+    try:
+        result = interpreter.eval(call, interpreter.global_env)
+    except LimitExceeded as e:
+        return failure(capture(e).format(), e.limit == 'time')
+    except Exception as e:
+        return failure(capture(e).format())
+    if result is not None and not isinstance(result, int):
+        result = repr(result)  # A function
+    try:
+        json.dumps(result)
+    except ValueError as e:  # An integer too long to print
+        return failure(f"Error: {e}")
+    return {'ok': True, 'result': result}
+
+
+class Metrics:
+    def __init__(self):
+        self.started = time.monotonic()
+        self.calls = 0
+        self.errors = 0
+        self.timeouts = 0
+        self.recycled = 0  # Workers replaced after a call overran its deadline
+        self.latencies = deque(maxlen=LATENCY_WINDOW)  # Seconds, of the most recent calls
+
+    def record(self, seconds, response):
+        self.calls += 1
+        self.latencies.append(seconds)
+        if not response['ok']:
+            self.errors += 1
+            if response.get('timeout'):
+                self.timeouts += 1
+
+    def percentile(self, fraction):
+        if not self.latencies:
+            return None
+        latencies = sorted(self.latencies)
+        return latencies[min(len(latencies) - 1, int(fraction * len(latencies)))]
+
+    def report(self):
+        elapsed = time.monotonic() - self.started
+        p50 = self.percentile(0.50)
+        p99 = self.percentile(0.99)
+        return {
+            'calls': self.calls,
+            'errors': self.errors,
+            'timeouts': self.timeouts,
+            'workers_recycled': self.recycled,
+            'uptime_seconds': round(elapsed, 3),
+            'calls_per_second': round(self.calls / elapsed, 1) if elapsed > 0 else None,
+            'p50_ms': round(p50 * 1000, 3) if p50 is not None else None,
+            'p99_ms': round(p99 * 1000, 3) if p99 is not None else None,
+        }
+
+
+# A worker process in a pool of its own, so that it can be terminated alone: a call still running
+# after its deadline is stuck in a single long operation, and its worker is replaced.
+class Worker:
+    def __init__(self):
+        self.pool = multiprocessing.Pool(1)
+
+    def run(self, function, *args):
+        # Returns an asyncio future of the result, which the pool's result thread settles
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+
+        def settle(setter, value):
+            if not future.done():  # Not given up on already
+                setter(value)
+
+        self.pool.apply_async(
+            function, args,
+            callback=lambda value: loop.call_soon_threadsafe(settle, future.set_result, value),
+            error_callback=lambda error: loop.call_soon_threadsafe(settle, future.set_exception, error))
+        return future
+
+    def terminate(self):
+        self.pool.terminate()
+
+
+# A long-running evaluation server speaking JSON lines over TCP. Each line is a request object:
+#   {"op": "register", "program": NAME, "source": CODE}
+#   {"op": "call", "program": NAME, "function": DEFUN, "args": [1, true], "timeout": SECONDS}
+#   {"op": "metrics"}
+# and gets one response line, {"ok": true, ...} or {"ok": false, "error": MESSAGE}, echoing the
+# request's "id" if it has one. Requests on a connection are handled concurrently, so responses
+# may come back out of order. Calls run in worker processes, each keeping the programs it has seen
+# compiled, under the evaluation limits of the options and a per-call deadline.
+class EvaluationServer:
+    def __init__(self, create_interpreter, options, workers=1):
+        self.create_interpreter = create_interpreter  # Builds the engine in the workers; must be picklable
+        self.workers = workers
+        self.timeout = options.timeout if options.timeout is not None else DEFAULT_TIMEOUT
+        # Every call runs under limits, at least the deadline and a bound on integer sizes
+        self.options = copy.copy(options)
+        self.options.timeout = self.timeout
+        if self.options.max_int_bits is None:
+            self.options.max_int_bits = DEFAULT_INT_BITS
+        self.programs = {}  # Name -> (source digest, source, names of its Defuns)
+        self.metrics = Metrics()
+        self.idle = None    # Queue of the workers not running a call
+        self.pool = []      # Every current worker, idle or not
+        self.slots = None
+
+    async def start(self):
+        self.pool = [Worker() for _ in range(self.workers)]
+        self.idle = asyncio.Queue()
+        for worker in self.pool:
+            self.idle.put_nowait(worker)
+        self.slots = asyncio.Semaphore(self.workers * QUEUE_PER_WORKER)
+
+    def stop(self):
+        for worker in self.pool:
+            worker.terminate()
+
+    async def serve(self, host, port):
+        await self.start()
+        server = await asyncio.start_server(self.handle, host, port, limit=MAX_LINE)
+        print(f"Serving on {host}:{port} with {self.workers} worker(s)", flush=True)
+        try:
+            async with server:
+                await server.serve_forever()
+        finally:
+            self.stop()
+
+    async def handle(self, reader, writer):
+        lock = asyncio.Lock()  # Responses of concurrent requests are written one line at a time
+        pending = set()
+        try:
+            while True:
+                try:
+                    line = await reader.readline()
+                except ValueError:
+                    await self.write(writer, lock, failure(f"Request longer than {MAX_LINE} bytes"))
+                    break
+                if not line:
+                    break
+                if not line.strip():
+                    continue
+                await self.slots.acquire()
+                task = asyncio.create_task(self.respond(line, writer, lock))
+                pending.add(task)
+                task.add_done_callback(pending.discard)
+            if pending:
+                await asyncio.gather(*pending)
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+    async def respond(self, line, writer, lock):
+        try:
+            response = await self.dispatch(line)
+        finally:
+            self.slots.release()
+        await self.write(writer, lock, response)
+
+    async def write(self, writer, lock, response):
+        async with lock:
+            writer.write(json.dumps(response).encode() + b'\n')
+            await writer.drain()
+
+    async def dispatch(self, line):
+        try:
+            request = json.loads(line)
+        except ValueError:
+            return failure("Request is not valid JSON")
+        if not isinstance(request, dict):
+            return failure("Request must be a JSON object")
+        op = request.get('op')
+        if op == 'register':
+            response = self.register(request)
+        elif op == 'call':
+            response = await self.call(request)
+        elif op == 'metrics':
+            response = {'ok': True, 'metrics': self.report()}
+        else:
+            response = failure(f"Unknown op: {op}")
+        if 'id' in request:
+            response['id'] = request['id']
+        return response
+
+    def register(self, request):
+        name = request.get('program')
+        source = request.get('source')
+        if not isinstance(name, str) or not isinstance(source, str):
+            return failure("register needs a 'program' name and its 'source'")
+        # Parsed here once to report errors right away, the workers compile it on first use
+        try:
+            ast = parse_program(source, self.options)
+        except Exception as e:
+            return failure(f"Error parsing program '{name}': {e}")
+        functions = sorted({node.name for node in ast if isinstance(node, FunctionDefinition)})
+        digest = hashlib.sha256(source.encode()).hexdigest()
+        self.programs[name] = (digest, source, set(functions))
+        return {'ok': True, 'program': name, 'functions': functions}
+
+    async def call(self, request):
+        name = request.get('program')
+        function = request.get('function')
+        args = request.get('args', [])
+        program = self.programs.get(name)
+        if program is None:
+            return failure(f"Unknown program: {name}")
+        digest, source, functions = program
+        if function not in functions:
+            return failure(f"Program '{name}' does not define a function named '{function}'")
+        if not isinstance(args, list) or not all(isinstance(arg, int) for arg in args):
+            return failure("args must be a list of integers and booleans")
+        timeout = self.timeout
+        if isinstance(request.get('timeout'), (int, float)) and request['timeout'] > 0:
+            timeout = min(timeout, request['timeout'])
+
+        started = time.perf_counter()
+        worker = await self.idle.get()
+        try:
+            # Limits stop the evaluation in the worker; the deadline here only catches a worker
+            # stuck in a single long operation, which keeps it busy until it is terminated
+            response = await asyncio.wait_for(worker.run(run_call, self.create_interpreter, self.options, name,
+                                                         digest, function, args, timeout),
+                                              timeout + GRACE_SECONDS)
+            if response.get('missing'):  # The worker has not compiled this source yet
+                response = await asyncio.wait_for(worker.run(run_call, self.create_interpreter, self.options,
+                                                             name, digest, function, args, timeout, source),
+                                                  timeout + GRACE_SECONDS)
+        except asyncio.TimeoutError:
+            response = failure(f"Evaluation did not stop within {timeout} seconds", True)
+            worker = self.replace(worker)
+        finally:
+            self.idle.put_nowait(worker)
+        self.metrics.record(time.perf_counter() - started, response)
+        return response
+
+    def replace(self, worker):
+        worker.terminate()
+        fresh = Worker()
+        self.pool[self.pool.index(worker)] = fresh
+        self.metrics.recycled += 1
+        return fresh
+
+    def report(self):
+        report = self.metrics.report()
+        report['programs'] = len(self.programs)
+        report['workers'] = self.workers
+        return report
@@ -0,0 +1,65 @@
+from collections import OrderedDict
+
+from ast_node import FunctionDefinition
+from errors import capture
+from primitives import PRIMITIVES
+
+
+# An interactive session around a single interpreter, so the global environment, Defuns, memo
+# tables and compiled code survive from one input to the next. Parsed inputs and compiled
+# statements are cached; since globals are looked up by slot when they run, redefining a
+# function leaves cached code valid and only clears the memo tables that depend on it.
+class Session:
+    def __init__(self, interpreter, parse, cache_size=1000):
+        self.interpreter = interpreter
+        self.parse = parse            # Turns source code into a list of statements
+        self.cache_size = cache_size
+        self.parsed = OrderedDict()   # Source code -> statements
+        self.compiled = {}            # Statement -> compiled closure, for the compiled engine
+
+        compiler = getattr(interpreter, 'compiler', None)
+        if compiler is not None:
+            # Later inputs may define the functions an earlier definition refers to
+            compiler.resolver.strict = False
+        # Only the closure compiler exposes compile() for ahead-of-time use
+        self.compiler = compiler if hasattr(compiler, 'compile') else None
+
+    def statements_for(self, code):
+        statements = self.parsed.get(code)
+        if statements is not None:
+            self.parsed.move_to_end(code)
+            return statements
+        statements = self.parse(code)
+        if any(isinstance(node, FunctionDefinition) and node.name in PRIMITIVES for node in statements):
+            # Inputs parsed before bound the builtin this Defun shadows from now on
+            self.parsed.clear()
+            self.compiled.clear()
+        self.parsed[code] = statements
+        if len(self.parsed) > self.cache_size:
+            _, evicted = self.parsed.popitem(last=False)
+            for node in evicted:
+                self.compiled.pop(node, None)
+        return statements
+
+    def evaluate(self, node):
+        if self.compiler is None:
+            return self.interpreter.eval(node, self.interpreter.global_env)
+        compiled = self.compiled.get(node)
+        if compiled is None:
+            compiled = self.compiled[node] = self.compiler.compile(node)
+        return compiled(self.interpreter.global_env)
+
+    def run(self, code):
+        self.run_statements(self.statements_for(code))
+
+    def run_statements(self, statements):
+        # Each input gets the full budgets of the interpreter's limits
+        if self.interpreter.limits is not None:
+            self.interpreter.limits.start()
+        for node in statements:
+            try:
+                result = self.evaluate(node)
+                if result is not None:
+                    print(result)
+            except Exception as e:
+                print(capture(e, node).format())
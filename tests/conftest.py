@@ -0,0 +1,55 @@
+import os
+import subprocess
+import sys
+
+import pytest
+
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# Tests that drive the interpreter in process import its modules from the repository root
+sys.path.insert(0, ROOT)
+PROGRAM_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'programs')
+# Printed around the results of every file
+BANNERS = ('Starting interpretation...', 'Interpretation finished...')
+
+ENGINES = ('tree', 'compiled', 'cek', 'vm')
+# Options every engine supports, and those only the compiled engine has
+MODES = ((), ('--no-optimize',), ('--stream',), ('--no-inline', '--no-cse'))
+COMPILED_MODES = (('--jit', '--jit-threshold', '0'), ('--jit', '--jit-threshold', '0', '--no-optimize'),
+                  ('--lazy',), ('--lazy', '--stream'), ('--memo-size', '0'))
+CONFIGURATIONS = [('--engine', engine, *mode) for engine in ENGINES for mode in MODES] \
+    + [('--engine', 'compiled', *mode) for mode in COMPILED_MODES]
+
+
+def configuration_id(options):
+    return ' '.join(options)
+
+
+# Runs main.py on a file in a fresh process, as from the command line, so that no syntax tree
+# or position is shared between runs. Returns the printed lines without the banners.
+def run_file(path, *options, timeout=120):
+    result = subprocess.run([sys.executable, os.path.join(ROOT, 'main.py'), '--no-cache', *options, path],
+                            cwd=ROOT, capture_output=True, text=True, timeout=timeout)
+    return [line for line in result.stdout.splitlines() if line not in BANNERS]
+
+
+# Pipes source into a REPL session of main.py, which prints results without prompts when its
+# input is not a terminal, one input per line
+def run_repl(source, *options, timeout=120):
+    result = subprocess.run([sys.executable, os.path.join(ROOT, 'main.py'), '--no-cache', *options], input=source,
+                            cwd=ROOT, capture_output=True, text=True, timeout=timeout)
+    return result.stdout.splitlines()
+
+
+@pytest.fixture
+def run(tmp_path):
+    written = 0
+
+    def run(source, *options, **kwargs):
+        nonlocal written
+        written += 1
+        path = tmp_path / f"program{written}.lambda"
+        path.write_text(source)
+        return run_file(str(path), *options, **kwargs)
+
+    return run
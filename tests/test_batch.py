@@ -0,0 +1,59 @@
+import os
+import subprocess
+import sys
+
+import pytest
+
+from conftest import ROOT
+
+pytest.importorskip('numpy')
+
+
+PROGRAM = ("Defun {name: f, arguments: (a, b,)} if (a > b) {a / b} else {a * b + 1}\n"
+           "Defun {name: fact, arguments: (n,)} if (n < 2) {1} else {n * fact(n - 1)}\n"
+           "f(1, 2)\n")
+
+
+# Maps a Defun of PROGRAM over rows of inputs, returns the printed results and the report line
+def run_map(tmp_path, function, rows):
+    program = tmp_path / 'program.lambda'
+    program.write_text(PROGRAM)
+    inputs = tmp_path / 'inputs.txt'
+    inputs.write_text(rows)
+    result = subprocess.run([sys.executable, os.path.join(ROOT, 'main.py'), '--no-cache', '--map', function,
+                             str(inputs), str(program)], cwd=ROOT, capture_output=True, text=True)
+    return result.stdout.splitlines(), result.stderr.strip()
+
+
+def test_vectorized_rows_with_errors(tmp_path):
+    # The division by zero lane is recomputed alone and only its row fails
+    assert run_map(tmp_path, 'f', "# a, b\n7, 2\n3 4\n5, 0\n1,True\n") == (
+        ["3", "13", "Error: Division by zero is not allowed", "2"],
+        "f: vectorized over 4 input(s), 1 recomputed by the interpreter",
+    )
+
+
+def test_rows_beyond_64_bits_are_interpreted(tmp_path):
+    assert run_map(tmp_path, 'f', "7, 2\n9223372036854775807, 3\n") == (
+        ["3", "3074457345618258602"],
+        "f: interpreted 2 input(s) one by one (inputs of 'a' do not fit in 64 bits)",
+    )
+
+
+def test_recursive_function_is_interpreted(tmp_path):
+    assert run_map(tmp_path, 'fact', "5\n20\n0\n") == (
+        ["120", "2432902008176640000", "1"],
+        "fact: interpreted 3 input(s) one by one ('fact' is recursive)",
+    )
+
+
+def test_row_with_the_wrong_number_of_values(tmp_path):
+    assert run_map(tmp_path, 'f', "7, 2\n1\n") == (
+        ["3", "Error: Function expected 2 arguments but got 1"],
+        "f: interpreted 2 input(s) one by one (some inputs do not have 2 values)",
+    )
+
+
+def test_unknown_function(tmp_path):
+    output, _ = run_map(tmp_path, 'g', "1\n")
+    assert output == [f"Error: '{tmp_path / 'program.lambda'}' does not define a function named 'g'"]
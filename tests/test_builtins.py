@@ -0,0 +1,27 @@
+import pytest
+
+from conftest import ENGINES
+
+
+@pytest.mark.parametrize('stream', ((), ('--stream',)))
+def test_defun_shadows_builtin_from_its_definition_on(run, stream):
+    source = ("Defun {name: before, arguments: (x,)} abs(x)\n"
+              "abs(0 - 3)\n"
+              "Defun {name: abs, arguments: (x,)} x + 100\n"
+              "abs(0 - 3)\n"
+              "before(0 - 3)\n")
+    assert run(source, *stream) == ['3', '97', '3']
+
+
+@pytest.mark.parametrize('engine', ENGINES)
+def test_builtin_passed_as_a_value(run, engine):
+    source = ("Defun {name: f, arguments: (g,)} g(0 - 4)\n"
+              "f(abs)\n")
+    assert run(source, '--engine', engine) == ['4']
+
+
+def test_builtin_arity_is_checked_when_parsed(run):
+    # The whole file is rejected, so nothing is printed from it but the error
+    output = run("5\nabs(1, 2)\n")
+    assert len(output) == 1
+    assert output[0].endswith("Parsing failed: Builtin 'abs' at line 2, column 0 takes 1 argument(s) but got 2")
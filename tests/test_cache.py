@@ -0,0 +1,48 @@
+import os
+import subprocess
+import sys
+
+from conftest import ROOT
+
+
+# Runs main.py with its program cache in tmp_path and returns every printed line
+def run_cached(tmp_path, *options):
+    command = [sys.executable, os.path.join(ROOT, 'main.py'), '--cache-dir', str(tmp_path / 'cache'), *options]
+    return subprocess.run(command, cwd=ROOT, capture_output=True, text=True).stdout.splitlines()
+
+
+def test_second_run_hits_the_cache(tmp_path):
+    path = tmp_path / 'program.lambda'
+    path.write_text("Defun {name: f, arguments: (x,)} x * 2\nf(21)\n")
+    assert run_cached(tmp_path, '--cache-stats', str(path))[1:] \
+        == ["42", "Interpretation finished...", "Program cache: 0 hit(s), 1 miss(es)"]
+    assert run_cached(tmp_path, '--cache-stats', str(path))[1:] \
+        == ["42", "Interpretation finished...", "Program cache: 1 hit(s), 0 miss(es)"]
+
+
+def test_changed_source_misses_the_cache(tmp_path):
+    path = tmp_path / 'program.lambda'
+    path.write_text("Defun {name: f, arguments: (x,)} x * 2\nf(21)\n")
+    run_cached(tmp_path, str(path))
+    path.write_text("Defun {name: f, arguments: (x,)} x * 3\nf(21)\n")
+    assert run_cached(tmp_path, '--cache-stats', str(path))[1:] \
+        == ["63", "Interpretation finished...", "Program cache: 0 hit(s), 1 miss(es)"]
+
+
+def test_optimized_and_unoptimized_programs_are_cached_apart(tmp_path):
+    path = tmp_path / 'program.lambda'
+    path.write_text("2 * 21\n")
+    run_cached(tmp_path, str(path))
+    assert run_cached(tmp_path, '--cache-stats', '--no-optimize', str(path))[-1] \
+        == "Program cache: 0 hit(s), 1 miss(es)"
+    assert sorted(os.listdir(tmp_path / 'cache')) == ['program.lambda.lmc', 'program.lambda.opt.lmc']
+    assert run_cached(tmp_path, '--clear-cache', str(path)) == ["Removed 2 cache file(s)"]
+
+
+def test_cached_program_keeps_error_positions(tmp_path):
+    path = tmp_path / 'program.lambda'
+    path.write_text("Defun {name: f, arguments: (x,)} 10 / x\n\n  f(0)\n")
+    expected = ["Error at line 3, column 2: Division by zero is not allowed", "  in f, called at line 3, column 2"]
+    assert run_cached(tmp_path, '--no-optimize', str(path))[1:3] == expected
+    assert run_cached(tmp_path, '--no-optimize', '--cache-stats', str(path))[1:] \
+        == expected + ["Interpretation finished...", "Program cache: 1 hit(s), 0 miss(es)"]
@@ -0,0 +1,18 @@
+COUNT = ("Defun {name: count, arguments: (n,)}\n"
+         "    if (n == 0) {0}\n"
+         "    else {1 + count(n - 1)}\n"
+         "count(20000)\n")
+
+COUNTDOWN = ("Defun {name: countdown, arguments: (n,)}\n"
+             "    if (n == 0) {7}\n"
+             "    else {countdown(n - 1)}\n"
+             "countdown(100000)\n")
+
+
+def test_deep_recursion(run):
+    # Pending operations live on the machine's own stack, not Python's
+    assert run(COUNT, '--engine', 'cek') == ['20000']
+
+
+def test_tail_calls_run_in_constant_space(run):
+    assert run(COUNTDOWN, '--engine', 'cek', '--max-depth', '10') == ['7']
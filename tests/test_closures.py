@@ -0,0 +1,37 @@
+import contextlib
+import io
+import tracemalloc
+
+import pytest
+
+from conftest import ENGINES
+
+
+# The closure is made 300 calls deep, in the frame of a Defun whose argument big is a 1 MB integer
+DEEP_CLOSURE = ("Defun {name: deep, arguments: (n, big, y,)}\n"
+                "    if (n == 0) {(Lambd x.(%s))}\n"
+                "    else {deep(n - 1, big, y)}\n"
+                "Defun {name: start, arguments: (k,)} deep(300, pow(2, k), 5)\n"
+                "start(8000000)\n")
+
+
+# Memory still allocated once the program has run, while its result, the closure, is alive
+def retained_memory(source, engine):
+    import main
+
+    options = main.parse_arguments(['--engine', engine, '--memo-size', '0'])
+    interpreter = main.create_interpreter(main.load_program(source, options), options)
+    tracemalloc.start()
+    with contextlib.redirect_stdout(io.StringIO()):
+        closure = interpreter.interpret()
+    retained = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    assert closure is not None
+    return retained
+
+
+@pytest.mark.parametrize('engine', ENGINES)
+def test_closure_keeps_only_its_free_variables(engine):
+    assert retained_memory(DEEP_CLOSURE % 'x + y', engine) < 100000
+    # The same closure using big keeps it, so the measure would see a frame kept whole
+    assert retained_memory(DEEP_CLOSURE % 'x + y + big', engine) > 1000000
@@ -0,0 +1,42 @@
+import os
+
+import pytest
+
+from conftest import CONFIGURATIONS, ENGINES, PROGRAM_DIR, ROOT, configuration_id, run_file
+
+
+PROGRAM_OUTPUT = [
+    '120', 'False', '55', '10', 'True', 'False', '5', '6', '23', '37',
+    'Error at line 54, column 0: Division by zero is not allowed',
+    '  in division, called at line 54, column 0',
+    'Error at line 59, column 0: Function expected 2 arguments but got 1',
+    '  in add, called at line 59, column 0',
+]
+
+FEATURES_OUTPUT = ['18', '610', '0', '20100', '38', '6', '3541774862152233910272', '71', 'True', '-4', '1005',
+                   '38']
+
+
+@pytest.mark.parametrize('options', CONFIGURATIONS, ids=configuration_id)
+def test_program(options):
+    assert run_file(os.path.join(ROOT, 'program.lambda'), *options) == PROGRAM_OUTPUT
+
+
+@pytest.mark.parametrize('options', CONFIGURATIONS, ids=configuration_id)
+def test_features(options):
+    assert run_file(os.path.join(PROGRAM_DIR, 'features.lambda'), *options) == FEATURES_OUTPUT
+
+
+# Nested as deeply as it is long, since + is left-associative
+LONG_SUM = ' + '.join(['1'] * 700) + '\n'
+
+
+@pytest.mark.parametrize('engine', ENGINES)
+def test_long_operator_chain(run, engine):
+    assert run(LONG_SUM, '--engine', engine) == ['700']
+
+
+@pytest.mark.parametrize('engine', ENGINES)
+def test_long_operator_chain_unoptimized(run, engine):
+    # Nothing is folded, so the engine compiles or walks the whole chain
+    assert run(LONG_SUM, '--engine', engine, '--no-optimize') == ['700']
@@ -0,0 +1,110 @@
+import pytest
+
+from conftest import ENGINES
+
+
+NESTED_CALLS = ("Defun {name: inner, arguments: (x,)} 10 / x\n"
+                "Defun {name: outer, arguments: (x,)} 1 + inner(x)\n"
+                "Defun {name: deep, arguments: (n,)}\n"
+                "    if (n == 0) {0}\n"
+                "    else {deep(n - 1) + outer(n - 3)}\n"
+                "deep(5)\n")
+
+
+@pytest.mark.parametrize('engine', ENGINES)
+def test_trace_of_calls(run, engine):
+    # None of the calls is a tail call, so every engine reports all of them
+    assert run(NESTED_CALLS, '--engine', engine, '--no-optimize') == [
+        "Error at line 6, column 0: Division by zero is not allowed",
+        "  in inner, called at line 2, column 41",
+        "  in outer, called at line 5, column 24",
+        "  in deep, called at line 5, column 10 (2 times)",
+        "  in deep, called at line 6, column 0",
+    ]
+
+
+@pytest.mark.parametrize('engine', ENGINES)
+def test_trace_of_substituted_calls(run, engine):
+    # inner is inlined into outer and outer into deep, both with their arguments substituted
+    assert run(NESTED_CALLS, '--engine', engine) == [
+        "Error at line 6, column 0: Division by zero is not allowed",
+        "  in deep, called at line 5, column 10 (2 times)",
+        "  in deep, called at line 6, column 0",
+    ]
+
+
+@pytest.mark.parametrize('engine', ENGINES)
+def test_trace_of_bound_calls(run, engine):
+    # The argument of twice is used twice, so it is bound, and the binding is reported as the call
+    source = ("Defun {name: twice, arguments: (x,)} (10 / x) + (10 / x)\n"
+              "Defun {name: f, arguments: (n,)} 1 + twice(n - 3)\n"
+              "f(3)\n")
+    assert run(source, '--engine', engine) == [
+        "Error at line 3, column 0: Division by zero is not allowed",
+        "  in twice, called at line 2, column 37",
+        "  in f, called at line 3, column 0",
+    ]
+
+
+@pytest.mark.parametrize('engine', ENGINES)
+def test_each_occurrence_of_a_call_keeps_its_position(run, engine):
+    # The repeated statement and the call in both branches are written identically
+    source = ("Defun {name: g, arguments: (n,)} 10 / n\n"
+              "Defun {name: h, arguments: (n,)}\n"
+              "    if (n < 5) {1 + g(n - 5)}\n"
+              "    else {2 + g(n - 5)}\n"
+              "g(0)\n"
+              "h(5)\n"
+              "g(0)\n")
+    assert run(source, '--engine', engine, '--no-optimize') == [
+        "Error at line 5, column 0: Division by zero is not allowed",
+        "  in g, called at line 5, column 0",
+        "Error at line 6, column 0: Division by zero is not allowed",
+        "  in g, called at line 4, column 14",
+        "  in h, called at line 6, column 0",
+        "Error at line 7, column 0: Division by zero is not allowed",
+        "  in g, called at line 7, column 0",
+    ]
+
+
+TAIL_CALLS = ("Defun {name: inner, arguments: (x,)} 10 / x\n"
+              "Defun {name: outer, arguments: (x,)} 1 + inner(x)\n"
+              "Defun {name: deep, arguments: (n,)}\n"
+              "    if (n == 0) {outer(n)}\n"
+              "    else {1 + deep(n - 1)}\n"
+              "deep(3)\n")
+
+
+@pytest.mark.parametrize('engine', ('tree', 'compiled'))
+def test_trace_of_tail_calls(run, engine):
+    assert run(TAIL_CALLS, '--engine', engine, '--no-optimize') == [
+        "Error at line 6, column 0: Division by zero is not allowed",
+        "  in inner, called at line 2, column 41",
+        "  in outer, called at line 4, column 17",
+        "  in deep, called at line 5, column 14 (3 times)",
+        "  in deep, called at line 6, column 0",
+    ]
+
+
+@pytest.mark.parametrize('engine', ('cek', 'vm'))
+def test_trace_of_replaced_tail_calls(run, engine):
+    # The tail call of outer runs in place of the innermost deep
+    assert run(TAIL_CALLS, '--engine', engine, '--no-optimize') == [
+        "Error at line 6, column 0: Division by zero is not allowed",
+        "  in inner, called at line 2, column 41",
+        "  in outer, called at line 4, column 17",
+        "  in deep, called at line 5, column 14 (2 times)",
+        "  in deep, called at line 6, column 0",
+    ]
+
+
+@pytest.mark.parametrize('engine', ENGINES)
+def test_arity_error(run, engine):
+    source = ("Defun {name: add, arguments: (a, b,)} a + b\n"
+              "Defun {name: f, arguments: (x,)} 1 + add(x)\n"
+              "f(2)\n")
+    assert run(source, '--engine', engine, '--no-optimize') == [
+        "Error at line 3, column 0: Function expected 2 arguments but got 1",
+        "  in add, called at line 2, column 37",
+        "  in f, called at line 3, column 0",
+    ]
@@ -0,0 +1,35 @@
+import pytest
+
+from conftest import ENGINES
+
+
+PROGRAM = ("Defun {name: square, arguments: (x,)} x * x\n"
+           "Defun {name: count, arguments: (n,)} if (n == 0) {0} else {1 + count(n - 1)}\n"
+           "Defun {name: fib, arguments: (n,)} if (n < 2) {n} else {fib(n - 1) + fib(n - 2)}\n"
+           "Defun {name: use, arguments: (n,)} square(n + 1) + count(n) + fib(n)\n"
+           "Defun {name: shared, arguments: (n,)} count(n) * count(n) + square(count(n))\n"
+           "Defun {name: branches, arguments: (n,)} if (n > 2) {count(n) + count(n)} else {count(n)}\n"
+           "use(6)\n"
+           "shared(4)\n"
+           "branches(3)\n"
+           "branches(1)\n")
+
+
+def test_only_small_non_recursive_defuns_are_inlined(run):
+    # count is recursive and fib memoizable, so both keep their calls. shared computes count(n) once
+    # for its three uses, and branches once for the two uses in its first branch
+    assert run(PROGRAM, '--inline-stats') == [
+        "Inliner: 2 call(s) inlined",
+        "  use: square (1)",
+        "  shared: square (1)",
+        "Common subexpressions: 2 shared",
+        "  shared: 1 subexpression(s) computed once instead of up to 3 times",
+        "  branches: 1 subexpression(s) computed once instead of up to 2 times",
+        "63", "32", "6", "1",
+    ]
+
+
+@pytest.mark.parametrize('engine', ENGINES)
+@pytest.mark.parametrize('passes', ((), ('--no-inline',), ('--no-cse',), ('--no-inline', '--no-cse')))
+def test_rewrites_preserve_results(run, engine, passes):
+    assert run(PROGRAM, '--engine', engine, *passes) == ["63", "32", "6", "1"]
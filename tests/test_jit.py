@@ -0,0 +1,20 @@
+def test_jit_loops_one_argument_tail_calls(run):
+    source = ("Defun {name: countdown, arguments: (n,)}\n"
+              "    if (n == 0) {7}\n"
+              "    else {countdown(n - 1)}\n"
+              "countdown(100000)\n")
+    assert run(source, '--jit', '--jit-threshold', '0') == ['7']
+
+
+def test_errors_in_jitted_code_are_reported_as_interpreted(run):
+    # The failing call is run again in the closures, which raise the usual error and trace
+    source = ("Defun {name: inverse, arguments: (n,)} 10 / n\n"
+              "Defun {name: f, arguments: (n,)} 1 + inverse(n - 3)\n"
+              "f(3)\n"
+              "f(5)\n")
+    assert run(source, '--jit', '--jit-threshold', '0', '--no-optimize') == [
+        "Error at line 3, column 0: Division by zero is not allowed",
+        "  in inverse, called at line 2, column 37",
+        "  in f, called at line 3, column 0",
+        "6",
+    ]
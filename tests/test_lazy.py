@@ -0,0 +1,42 @@
+import pytest
+
+from lazy import Laziness, Thunk
+
+
+def test_thunk_runs_its_code_once():
+    laziness = Laziness()
+    runs = []
+    thunk = Thunk(lambda frame: runs.append(frame) or 42, 'frame', laziness)
+    assert [thunk.force(), thunk.force(), thunk.force()] == [42, 42, 42]
+    assert runs == ['frame']
+    assert laziness.forced == 1
+    assert thunk.frame is None
+
+
+def test_failed_thunk_runs_again_when_forced_again():
+    runs = []
+
+    def fail(frame):
+        runs.append(frame)
+        raise ZeroDivisionError("Division by zero is not allowed")
+
+    thunk = Thunk(fail, 'frame', Laziness())
+    for _ in range(2):
+        with pytest.raises(ZeroDivisionError):
+            thunk.force()
+    assert len(runs) == 2
+
+
+@pytest.mark.parametrize('optimize', ((), ('--no-optimize', '--no-inline')))
+def test_arguments_are_evaluated_when_needed_and_at_most_once(run, optimize):
+    # loop(0) never returns and 1 / 0 fails, but neither is needed; square(3) is used three times
+    source = ("Defun {name: loop, arguments: (n,)} loop(n + 1)\n"
+              "Defun {name: first, arguments: (a, b,)} if (a > 0) {a} else {b}\n"
+              "Defun {name: square, arguments: (n,)} n * n\n"
+              "Defun {name: thrice, arguments: (x,)} x + x + x\n"
+              "first(5, loop(0))\n"
+              "thrice(square(3))\n"
+              "first(5, 1 / 0)\n")
+    assert run(source, '--lazy', '--lazy-stats', *optimize) == [
+        "5", "27", "5", "Lazy evaluation: 3 thunk(s) created, 1 forced, 2 never needed",
+    ]
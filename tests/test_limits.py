@@ -0,0 +1,113 @@
+import os
+import subprocess
+import sys
+import threading
+import time
+
+import pytest
+
+from conftest import ENGINES, ROOT
+
+
+RECURSION = ("Defun {name: count, arguments: (n,)}\n"
+             "    if (n == 0) {0}\n"
+             "    else {1 + count(n - 1)}\n"
+             "Defun {name: sum_to_n, arguments: (n, total,)}\n"
+             "    if (n == 0) {total}\n"
+             "    else {sum_to_n(n - 1, total + n)}\n"
+             "count(40)\n"
+             "count(100)\n"
+             "sum_to_n(100, 0)\n")
+
+SQUARING = ("Defun {name: square_forever, arguments: (n,)} square_forever(n * n)\n"
+            "square_forever(3)\n")
+
+
+@pytest.mark.parametrize('engine', ENGINES)
+def test_max_depth_counts_live_calls(run, engine):
+    output = run(RECURSION, '--engine', engine, '--max-depth', '60')
+    assert output[:4] == [
+        "40",
+        "Error at line 8, column 0: Evaluation exceeded the limit of 60 live frames",
+        "  in count, called at line 3, column 14 (60 times)",
+        "  in count, called at line 8, column 0",
+    ]
+    # Tail calls replace their caller on the cek and vm engines, and only there
+    if engine in ('cek', 'vm'):
+        assert output[4:] == ["5050"]
+    else:
+        assert output[4] == "Error at line 9, column 0: Evaluation exceeded the limit of 60 live frames"
+
+
+@pytest.mark.parametrize('engine', ENGINES)
+def test_max_steps(run, engine):
+    # The budget is the whole program's: count(40) leaves 49 steps to count(100) and none to sum_to_n
+    assert run(RECURSION, '--engine', engine, '--max-steps', '90') == [
+        "40",
+        "Error at line 8, column 0: Evaluation exceeded the step limit of 90",
+        "  in count, called at line 3, column 14 (49 times)",
+        "  in count, called at line 8, column 0",
+        "Error at line 9, column 0: Evaluation exceeded the step limit of 90",
+        "  in sum_to_n, called at line 9, column 0",
+    ]
+
+
+@pytest.mark.parametrize('engine', ENGINES)
+def test_timeout_stops_arithmetic_on_big_integers(run, engine):
+    # Each call squares its argument: a few dozen calls take longer than any step allowance
+    started = time.monotonic()
+    output = run(SQUARING, '--engine', engine, '--timeout', '0.5', timeout=60)
+    assert time.monotonic() - started < 20
+    assert output[0] == "Error at line 2, column 0: Evaluation exceeded the time limit of 0.5 seconds"
+
+
+@pytest.mark.parametrize('engine', ENGINES)
+def test_max_int_bits(run, engine):
+    output = run(SQUARING, '--engine', engine, '--max-int-bits', '1000')
+    assert output[0] == "Error at line 2, column 0: Integer result exceeds the limit of 1000 bits"
+
+
+@pytest.mark.parametrize('engine', ENGINES)
+def test_max_int_bits_applies_to_folded_products(run, engine):
+    source = ("1000 * 1000\n"
+              "(Lambd x.(x * x))(200)\n"
+              "pow(2, 20)\n"
+              "100 * 100\n")
+    assert run(source, '--engine', engine, '--max-int-bits', '16') == [
+        "Error at line 1, column 0: Integer result exceeds the limit of 16 bits",
+        "40000",
+        "Error at line 3, column 0: Integer result exceeds the limit of 16 bits",
+        "10000",
+    ]
+
+
+def test_max_int_bits_misses_the_cache_of_an_unlimited_run(tmp_path):
+    # The product was folded into the cached program of the first run
+    path = tmp_path / 'product.lambda'
+    path.write_text("1000 * 1000\n")
+
+    def run_cached(*options):
+        command = [sys.executable, os.path.join(ROOT, 'main.py'), '--cache-dir', str(tmp_path / 'cache'),
+                   *options, str(path)]
+        return subprocess.run(command, cwd=ROOT, capture_output=True, text=True).stdout.splitlines()[1]
+
+    assert run_cached() == "1000000"
+    assert run_cached('--max-int-bits', '16') \
+        == "Error at line 1, column 0: Integer result exceeds the limit of 16 bits"
+
+
+@pytest.mark.parametrize('engine', ('cek', 'vm'))
+def test_cancel_from_another_thread(capsys, engine):
+    # spin loops forever in constant space, so only the cancellation stops it
+    import main
+
+    options = main.parse_arguments(['--engine', engine, '--timeout', '60'])
+    ast = main.load_program("Defun {name: spin, arguments: (n,)} spin(n + 1)\nspin(0)\n5\n", options)
+    interpreter = main.create_interpreter(ast, options)
+    threading.Timer(0.2, interpreter.cancel).start()
+    interpreter.interpret()
+    assert capsys.readouterr().out.splitlines()[1:-1] == [
+        "Error at line 2, column 0: Evaluation was cancelled",
+        "  in spin, called at line 1, column 36",
+        "5",
+    ]
@@ -0,0 +1,44 @@
+import os
+
+import pytest
+
+from conftest import ENGINES, PROGRAM_DIR, run_file
+from test_engines import FEATURES_OUTPUT
+from test_limits import RECURSION
+
+
+@pytest.mark.parametrize('engine', ENGINES)
+def test_parallel_typecheck(engine):
+    # The compiled engine fuses the subtrees --typecheck found in each worker as it would in one process
+    assert run_file(os.path.join(PROGRAM_DIR, 'features.lambda'), '--engine', engine, '--typecheck', '-j', '2') \
+        == FEATURES_OUTPUT
+
+
+def test_workers_receive_the_fusible_subtrees_of_their_statements():
+    import main
+    from parallel import ParallelInterpreter, run_statements
+
+    options = main.parse_arguments(['--typecheck', '--no-cache'])
+    ast = main.load_program(open(os.path.join(PROGRAM_DIR, 'features.lambda')).read(), options)
+    fusible = main.typecheck(ast)
+    interpreter = ParallelInterpreter(ast, main.create_interpreter, options, 2, fusible=fusible)
+    received = []
+
+    def create_interpreter(statements, options, fusible=None):
+        received.append(fusible)
+        return main.create_interpreter(statements, options, fusible)
+
+    outputs = []
+    for prelude, statements in interpreter.chunks():
+        outputs += run_statements(create_interpreter, options, [], prelude, statements,
+                                  fusible=interpreter.fusible_in(prelude + statements))
+    assert [output for output in outputs if output is not None] == FEATURES_OUTPUT
+    assert any(received) and all(chunk <= fusible for chunk in received)
+
+
+@pytest.mark.parametrize('engine', ENGINES)
+def test_limits_apply_to_each_chunk(run, engine):
+    # In one process sum_to_n(100, 0) finds the budget spent; under -j every statement is its own chunk
+    assert "Error at line 9, column 0: Evaluation exceeded the step limit of 150" \
+        in run(RECURSION, '--engine', engine, '--max-steps', '150')
+    assert run(RECURSION, '--engine', engine, '--max-steps', '150', '-j', '2') == ['40', '100', '5050']
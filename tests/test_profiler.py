@@ -0,0 +1,47 @@
+import io
+import itertools
+
+import profiler
+from profiler import Profiler
+
+
+WALK = ("Defun {name: leaf, arguments: (n,)} n * 2\n"
+        "Defun {name: walk, arguments: (n,)}\n"
+        "    if (n == 0) {0}\n"
+        "    else {leaf(n) + walk(n - 1)}\n"
+        "walk(10)\n")
+
+
+def test_profile_counts(run, tmp_path):
+    output = run(WALK, '--profile', '--no-optimize', '--memo-size', '0',
+                 '--profile-output', str(tmp_path / 'walk.folded'))
+    assert output[0] == "110"
+    # Name, calls, then max depth and frames, leaving out the times
+    rows = {line.split()[0]: line.split() for line in output[2:5]}
+    assert rows['walk'][1] == '11' and rows['walk'][4:] == ['11', '20']
+    assert rows['leaf'][1] == '10' and rows['leaf'][4:] == ['1', '0']
+    assert rows['<top'][-1] == '1'
+    counts = dict(line.split() for line in output[7:-1])
+    assert counts['IfStatement'] == '11' and counts['FunctionApplication'] == '21'
+    assert output[-1] == f"Folded stacks written to '{tmp_path / 'walk.folded'}'"
+
+
+def test_folded_stacks(monkeypatch):
+    # Every reading of the clock is one microsecond after the last
+    ticks = itertools.count()
+    monkeypatch.setattr(profiler, 'perf_counter', lambda: next(ticks) * 1e-6)
+    collector = Profiler()
+    leaf = collector.instrument('leaf', lambda n: 1)
+    walk = collector.instrument('walk', lambda n: 0 if n == 0 else leaf(n) + walk(n - 1))
+    walk(2)
+    folded = io.StringIO()
+    collector.write_folded(folded)
+    assert folded.getvalue().splitlines() == [
+        "walk 3",
+        "walk;leaf 1",
+        "walk;walk 3",
+        "walk;walk;leaf 1",
+        "walk;walk;walk 1",
+    ]
+    assert (collector.functions['walk'].calls, collector.functions['walk'].max_depth) == (3, 3)
+    assert round(collector.functions['walk'].cumulative_time * 1e6) == 9
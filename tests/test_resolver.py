@@ -0,0 +1,65 @@
+import pytest
+
+from conftest import ENGINES, run_repl
+
+
+@pytest.mark.parametrize('engine', ENGINES)
+def test_inner_bindings_shadow_outer_ones(run, engine):
+    # Each x is addressed by its own depth and slot, whatever the name of the enclosing Defun
+    source = ("Defun {name: k, arguments: (x,)} (Lambd y.(Lambd x.(x - y)))(x, 3)\n"
+              "k(10)\n"
+              "(Lambd x.(Lambd x.(x * 2)))(1, 5)\n"
+              "Defun {name: x, arguments: (x,)} x + 1\n"
+              "x(4)\n")
+    assert run(source, '--engine', engine, '--no-optimize') == ['-7', '10', '5']
+
+
+UNDEFINED_CALLEE = ("Defun {name: f, arguments: (x,)} x + g(x)\n"
+                    "f(1)\n"
+                    "Defun {name: g, arguments: (x,)} x * 10\n"
+                    "f(1)\n")
+
+
+@pytest.mark.parametrize('engine', ('compiled', 'vm'))
+def test_unresolved_name_fails_when_compiled(run, engine):
+    # No Defun of the program is named y, so f is rejected where it is defined
+    source = ("Defun {name: f, arguments: (x,)} x + y\n"
+              "5\n"
+              "f(1)\n")
+    assert run(source, '--engine', engine) == [
+        "Error at line 1, column 0: Unresolved identifier: y",
+        "5",
+        "Error at line 3, column 0: Undefined variable: f",
+    ]
+
+
+@pytest.mark.parametrize('engine', ('compiled', 'vm'))
+def test_name_defined_later_in_the_program_resolves(run, engine):
+    assert run(UNDEFINED_CALLEE, '--engine', engine) == [
+        "Error at line 2, column 0: Undefined variable: g",
+        "  in f, called at line 2, column 0",
+        "11",
+    ]
+
+
+@pytest.mark.parametrize('engine', ENGINES)
+def test_undefined_name_fails_when_evaluated_in_a_stream(run, engine):
+    # A statement may use a name that a later one defines, as in a REPL session
+    source = ("Defun {name: f, arguments: (x,)} x + y\n"
+              "5\n"
+              "f(1)\n")
+    assert run(source, '--engine', engine, '--stream') == [
+        "5",
+        "Error at line 3, column 0: Undefined variable: y",
+        "  in f, called at line 3, column 0",
+    ]
+    assert run(UNDEFINED_CALLEE, '--engine', engine, '--stream')[-1] == "11"
+
+
+@pytest.mark.parametrize('engine', ENGINES)
+def test_undefined_name_fails_when_evaluated_in_the_repl(engine):
+    assert run_repl(UNDEFINED_CALLEE, '--engine', engine) == [
+        "Error at line 1, column 0: Undefined variable: g",
+        "  in f, called at line 1, column 0",
+        "11",
+    ]
@@ -0,0 +1,53 @@
+import asyncio
+import hashlib
+import json
+
+from main import create_interpreter, parse_arguments
+from server import DEFAULT_INT_BITS, EvaluationServer, run_call
+
+
+SOURCE = ("Defun {name: square_forever, arguments: (n,)} square_forever(n * n)\n"
+          "Defun {name: power, arguments: (n,)} pow(3, n)\n"
+          "Defun {name: inc, arguments: (n,)} n + 1\n")
+
+
+# Registers SOURCE with a one-worker server and returns the responses to the given requests
+def serve(requests, *options):
+    async def session():
+        server = EvaluationServer(create_interpreter, parse_arguments(list(options)), 1)
+        await server.start()
+        try:
+            responses = [await server.dispatch(json.dumps({'op': 'register', 'program': 'p', 'source': SOURCE}))]
+            for request in requests:
+                responses.append(await server.dispatch(json.dumps(request)))
+            return responses
+        finally:
+            server.stop()
+
+    return asyncio.run(session())
+
+
+def test_calls_get_a_default_integer_size_limit():
+    _, response = serve([{'op': 'call', 'program': 'p', 'function': 'square_forever', 'args': [30]}])
+    assert response['error'].startswith(f"Error: Integer result exceeds the limit of {DEFAULT_INT_BITS} bits")
+
+
+def test_worker_stuck_past_its_deadline_is_replaced():
+    # A single pow takes seconds once the integer size limit allows it
+    _, stuck, after, metrics = serve([
+        {'op': 'call', 'program': 'p', 'function': 'power', 'args': [300000000], 'timeout': 0.2},
+        {'op': 'call', 'program': 'p', 'function': 'inc', 'args': [41]},
+        {'op': 'metrics'},
+    ], '--max-int-bits', str(10 ** 12))
+    assert stuck == {'ok': False, 'error': "Evaluation did not stop within 0.2 seconds", 'timeout': True}
+    assert after == {'ok': True, 'result': 42}
+    assert metrics['metrics']['workers_recycled'] == 1
+
+
+def test_calls_carry_the_source_only_when_the_worker_misses_it():
+    options = parse_arguments([])
+    options.timeout = 5.0
+    digest = hashlib.sha256(SOURCE.encode()).hexdigest()
+    assert run_call(create_interpreter, options, 'q', digest, 'inc', [1], 5.0) == {'ok': False, 'missing': True}
+    assert run_call(create_interpreter, options, 'q', digest, 'inc', [1], 5.0, SOURCE) == {'ok': True, 'result': 2}
+    assert run_call(create_interpreter, options, 'q', digest, 'inc', [2], 5.0) == {'ok': True, 'result': 3}
@@ -0,0 +1,48 @@
+import pytest
+
+from conftest import ENGINES, run_repl
+
+
+REDEFINITION = ("Defun {name: f, arguments: (x,)} x * 2\n"
+                "Defun {name: g, arguments: (x,)} f(x) + 1\n"
+                "g(5)\n"
+                "Defun {name: f, arguments: (x,)} x * 3\n"
+                "g(5)\n"
+                "g(5)\n"
+                "Defun {name: abs, arguments: (x,)} x\n"
+                "abs(0 - 2)\n")
+
+
+@pytest.mark.parametrize('engine', ENGINES)
+def test_redefinition_reaches_earlier_definitions(engine):
+    # g was defined against the first f, and the memoized g(5) is not reused after f changes
+    assert run_repl(REDEFINITION, '--engine', engine) == ['11', '16', '16', '-2']
+
+
+def test_preloaded_definitions(tmp_path):
+    path = tmp_path / 'library.lambda'
+    path.write_text("Defun {name: f, arguments: (x,)} x * 2\n")
+    assert run_repl("f(4)\n", '--preload', str(path)) == ['8']
+
+
+def test_repeated_inputs_are_compiled_once(capsys):
+    import main
+    from session import Session
+
+    options = main.parse_arguments([])
+    session = Session(main.create_interpreter([], options), lambda code: main.load_program(code, options))
+    compiled = []
+    compile = session.compiler.compile
+
+    def compile_statement(node, scope=None):
+        # The compiler calls itself for the parts of a statement too, only statements are counted
+        compiled.append(node)
+        return compile(node, scope)
+
+    session.compiler.compile = compile_statement
+    inputs = ("Defun {name: f, arguments: (x,)} x + 1", "f(1)", "f(1)", "f(2)", "f(1)")
+    for code in inputs:
+        session.run(code)
+    assert capsys.readouterr().out.splitlines() == ['2', '2', '3', '2']
+    statements = {node for code in inputs for node in session.statements_for(code)}
+    assert len([node for node in compiled if node in statements]) == 3
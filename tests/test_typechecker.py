@@ -0,0 +1,42 @@
+import os
+
+import pytest
+
+from conftest import ENGINES, PROGRAM_DIR, ROOT, run_file
+from test_engines import FEATURES_OUTPUT
+
+
+@pytest.mark.parametrize('engine', ENGINES)
+def test_features_typecheck(engine):
+    assert run_file(os.path.join(PROGRAM_DIR, 'features.lambda'), '--engine', engine, '--typecheck') \
+        == FEATURES_OUTPUT
+
+
+def test_program_typecheck():
+    # The call of add with one argument is found before anything runs
+    assert run_file(os.path.join(ROOT, 'program.lambda'), '--typecheck') == [
+        "Type error at line 59, column 0: calling 'add': function expected 2 arguments but got 1",
+        "Type checking failed with 1 error(s), the program was not run",
+    ]
+
+
+def test_typecheck_reports_arity_at_the_call(run):
+    source = ("Defun {name: add, arguments: (a, b,)} a + b\n"
+              "Defun {name: use, arguments: (x,)} add(x, 1, 2)\n"
+              "add(1)\n")
+    assert run(source, '--typecheck') == [
+        "Type error in function 'use' at line 2, column 0: calling 'add': function expected 2 arguments "
+        "but got 3",
+        "Type error at line 3, column 0: calling 'add': function expected 2 arguments but got 1",
+        "Type checking failed with 2 error(s), the program was not run",
+    ]
+
+
+def test_typecheck_reports_calls_before_the_definition(run):
+    source = ("Defun {name: early, arguments: (x,)} late(x, 1)\n"
+              "Defun {name: late, arguments: (x,)} x\n")
+    assert run(source, '--typecheck') == [
+        "Type error in function 'late' at line 2, column 0: called with 2 arguments before this definition, "
+        "which takes 1",
+        "Type checking failed with 1 error(s), the program was not run",
+    ]
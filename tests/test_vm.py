@@ -0,0 +1,44 @@
+import pytest
+
+from test_cek import COUNT, COUNTDOWN
+
+
+def test_deep_recursion(run):
+    assert run(COUNT, '--engine', 'vm') == ['20000']
+
+
+def test_tail_calls_run_in_constant_space(run):
+    assert run(COUNTDOWN, '--engine', 'vm', '--max-depth', '10') == ['7']
+
+
+@pytest.mark.parametrize('optimize', ((), ('--no-optimize',)))
+def test_compiles_chains_deeper_than_the_python_stack(run, optimize):
+    assert run(' + '.join(['1'] * 3000) + '\n', '--engine', 'vm', *optimize) == ['3000']
+
+
+def test_disassembly(run):
+    source = ("Defun {name: f, arguments: (n,)} if (n == 0) {1} else {n * 2}\n"
+              "f(3)\n")
+    assert run(source, '--disasm') == [
+        "code <statement> params=None:",
+        "      0 MAKE_CLOSURE   0 (f)",
+        "      2 STORE_GLOBAL   0",
+        "      4 LOAD_CONST     0 (None)",
+        "      6 RETURN",
+        "    code f params=('n',):",
+        "          0 LOAD_LOCAL     0",
+        "          2 LOAD_CONST     0 (0)",
+        "          4 BINOP          5 (==)",
+        "          6 JUMP_IF_FALSE  12",
+        "          8 LOAD_CONST     1 (1)",
+        "         10 JUMP           18",
+        "         12 LOAD_LOCAL     0",
+        "         14 LOAD_CONST     2 (2)",
+        "         16 BINOP          2 (*)",
+        "         18 RETURN",
+        "code <statement> params=None:",
+        "      0 LOAD_GLOBAL    0",
+        "      2 LOAD_CONST     0 (3)",
+        "      4 CALL           1",
+        "      6 RETURN",
+    ]
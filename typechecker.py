@@ -0,0 +1,336 @@
+from ast_node import FunctionDefinition, LambdaExpression, FunctionApplication, PrimitiveApplication, \
+    Identifier, IntegerLiteral, BooleanLiteral, UnaryOperation, BinaryOperation, IfStatement
+from errors import SPANS, format_span
+
+
+ARITHMETIC_OPERATORS = {'+', '-', '*', '/', '%'}
+ORDERING_OPERATORS = {'<', '>', '<=', '>='}
+
+
+class TypeCheckError(Exception):
+    pass
+
+
+class TypeVariable:
+    def __init__(self):
+        self.instance = None  # The type this variable was unified with, if any
+
+
+# Integers and booleans mix freely at runtime (True + 1 == 2), so both are one scalar type. The
+# tags only record which kinds of scalar were seen, for the messages.
+class ScalarType:
+    def __init__(self, tags=()):
+        self.tags = set(tags)
+
+
+class FunctionType:
+    def __init__(self, params, result, curried):
+        self.params = params      # Parameter types
+        self.result = result
+        # True for a lambda, which takes one argument at a time, False for a Defun, which needs
+        # exactly its arguments, None while only calls of an unknown function have been seen
+        self.curried = curried
+
+
+def prune(t):
+    while isinstance(t, TypeVariable) and t.instance is not None:
+        t = t.instance
+    return t
+
+
+def occurs_in(variable, t):
+    t = prune(t)
+    if t is variable:
+        return True
+    if isinstance(t, FunctionType):
+        return any(occurs_in(variable, param) for param in t.params) or occurs_in(variable, t.result)
+    return False
+
+
+def unify(a, b):
+    a = prune(a)
+    b = prune(b)
+    if a is b:
+        return
+    if isinstance(a, TypeVariable):
+        if occurs_in(a, b):
+            raise TypeCheckError(f"recursive type {format_type(a)} = {format_type(b)}")
+        a.instance = b
+    elif isinstance(b, TypeVariable):
+        unify(b, a)
+    elif isinstance(a, ScalarType) and isinstance(b, ScalarType):
+        a.tags |= b.tags
+        b.tags = a.tags
+    elif isinstance(a, FunctionType) and isinstance(b, FunctionType):
+        unify_functions(a, b)
+    else:
+        raise TypeCheckError(f"expected {format_type(a)} but got {format_type(b)}")
+
+
+def unify_functions(a, b):
+    if len(a.params) == len(b.params):
+        if a.curried is None:
+            a.curried = b.curried
+        elif b.curried is None:
+            b.curried = a.curried
+        for param_a, param_b in zip(a.params, b.params):
+            unify(param_a, param_b)
+        unify(a.result, b.result)
+        return
+    shorter, longer = (a, b) if len(a.params) < len(b.params) else (b, a)
+    # A lambda taking its arguments one at a time can stand in for a call with several of them
+    if shorter.curried is True and longer.curried is not False:
+        for param_a, param_b in zip(shorter.params, longer.params):
+            unify(param_a, param_b)
+        rest = FunctionType(longer.params[len(shorter.params):], longer.result, longer.curried)
+        unify(shorter.result, rest)
+        return
+    # Calls of a known Defun are checked in TypeChecker.apply, which knows the callee from the call
+    raise TypeCheckError(f"a function of {len(a.params)} argument(s) does not match one of {len(b.params)}")
+
+
+def format_type(t, names=None):
+    names = names if names is not None else {}
+    t = prune(t)
+    if isinstance(t, TypeVariable):
+        if t not in names:
+            names[t] = chr(ord('a') + len(names) % 26) + (str(len(names) // 26) if len(names) >= 26 else '')
+        return names[t]
+    if isinstance(t, ScalarType):
+        return '|'.join(sorted(t.tags)) if t.tags else 'scalar'
+    params = [format_type(param, names) for param in t.params]
+    result = format_type(t.result, names)
+    if t.curried:
+        return f"{params[0]} -> {result}" if len(params) == 1 else f"({', '.join(params)}) -> {result}"
+    return f"({', '.join(params)}) -> {result}"
+
+
+# Hindley-Milner style inference over a program, one top-level statement at a time. Defuns are
+# generalized, so a polymorphic function can be used at several types, and names used before
+# their Defun get a placeholder that is unified with it once it is defined. Errors are reported
+# per statement and the rest of the program is still checked.
+class TypeChecker:
+    def __init__(self):
+        self.globals = {}       # Defun name -> (type, generalized type variables)
+        self.pending = {}       # Name used before its Defun -> placeholder type
+        self.occurrences = []   # (node, type) for every expression visited, for fusible_nodes
+        self.errors = []
+
+    def check(self, statements):
+        for index, node in enumerate(statements):
+            self.check_statement(node, index)
+        for name in self.pending:
+            self.errors.append(f"'{name}' is used but never defined")
+        return self.errors
+
+    def check_statement(self, node, index=None):
+        try:
+            if isinstance(node, FunctionDefinition):
+                self.check_function_definition(node)
+            else:
+                self.infer(node, {})
+        except TypeCheckError as e:
+            # Located where the statement was written, the checked tree is already optimized
+            span = SPANS.get(node)
+            if span is not None:
+                where = f" at {format_span(span)}"
+            else:
+                where = f" in statement {index + 1}" if index is not None else ""
+            if isinstance(node, FunctionDefinition):
+                self.errors.append(f"Type error in function '{node.name}'{where}: {e}")
+                self.globals[node.name] = (TypeVariable(), set())
+            else:
+                self.errors.append(f"Type error{where}: {e}")
+
+    def check_function_definition(self, node):
+        params = [TypeVariable() for _ in node.params]
+        result = TypeVariable()
+        function = FunctionType(params, result, False)
+        # Recursive calls see the function being defined, not yet generalized
+        scope = {node.name: function}
+        scope.update(zip(node.params, params))
+        unify(result, self.infer(node.body, scope))
+
+        placeholder = self.pending.pop(node.name, None)
+        if placeholder is not None:
+            used = prune(placeholder)
+            if isinstance(used, FunctionType) and used.curried is None and len(used.params) != len(params):
+                raise TypeCheckError(f"called with {len(used.params)} arguments before this definition, "
+                                     f"which takes {len(params)}")
+            try:
+                unify(placeholder, function)
+            except TypeCheckError as e:
+                raise TypeCheckError(f"uses before this definition do not match it: {e}")
+        self.globals[node.name] = (function, self.free_variables(function) - self.free_in_globals())
+
+    def signature(self, name):
+        return format_type(self.globals[name][0]) if name in self.globals else None
+
+    def lookup(self, name, scope):
+        if name in scope:
+            return scope[name]
+        if name in self.globals:
+            return self.instantiate(*self.globals[name])
+        # Possibly defined by a later Defun
+        if name not in self.pending:
+            self.pending[name] = TypeVariable()
+        return self.pending[name]
+
+    def infer(self, node, scope):
+        t = self.infer_node(node, scope)
+        self.occurrences.append((node, t))
+        return t
+
+    def infer_node(self, node, scope):
+        if isinstance(node, IntegerLiteral):
+            return ScalarType({'int'})
+
+        elif isinstance(node, BooleanLiteral):
+            return ScalarType({'bool'})
+
+        elif isinstance(node, Identifier):
+            return self.lookup(node.name, scope)
+
+        elif isinstance(node, BinaryOperation):
+            left = self.infer(node.left, scope)
+            right = self.infer(node.right, scope)
+            if node.operator in ('||', '&&'):
+                # The result is the right side or a boolean, the left side is only tested
+                result = ScalarType({'bool'})
+                self.expect_scalar(right, f"right side of {node.operator}")
+                unify(result, right)
+                return result
+            if node.operator in ARITHMETIC_OPERATORS:
+                self.expect_scalar(left, f"left side of {node.operator}")
+                self.expect_scalar(right, f"right side of {node.operator}")
+                return ScalarType({'int'})
+            if node.operator in ORDERING_OPERATORS:
+                self.expect_scalar(left, f"left side of {node.operator}")
+                self.expect_scalar(right, f"right side of {node.operator}")
+            return ScalarType({'bool'})
+
+        elif isinstance(node, UnaryOperation):
+            self.infer(node.operand, scope)
+            return ScalarType({'bool'})
+
+        elif isinstance(node, IfStatement):
+            self.infer(node.condition, scope)
+            consequence = self.infer(node.consequence, scope)
+            if node.alternative is not None:
+                try:
+                    unify(consequence, self.infer(node.alternative, scope))
+                except TypeCheckError as e:
+                    raise TypeCheckError(f"branches of if have different types: {e}")
+            return consequence
+
+        elif isinstance(node, LambdaExpression):
+            param = TypeVariable()
+            inner = dict(scope)
+            inner[node.params] = param
+            return FunctionType([param], self.infer(node.body, inner), True)
+
+        elif isinstance(node, PrimitiveApplication):
+            # Every builtin takes and returns integers
+            for position, arg in enumerate(node.args):
+                self.expect_scalar(self.infer(arg, scope), f"argument {position + 1} of builtin '{node.name}'")
+            return ScalarType({'int'})
+
+        elif isinstance(node, FunctionApplication):
+            if isinstance(node.func, str):
+                func = self.lookup(node.func, scope)
+                name = f"'{node.func}'"
+            else:
+                func = self.infer(node.func, scope)
+                name = "lambda expression"
+            args = [self.infer(arg, scope) for arg in node.args]
+            try:
+                return self.apply(func, args)
+            except TypeCheckError as e:
+                raise TypeCheckError(f"calling {name}: {e}")
+
+        else:
+            raise TypeCheckError(f"unknown node type {type(node).__name__}")
+
+    def apply(self, func, args):
+        func = prune(func)
+        if isinstance(func, ScalarType):
+            raise TypeCheckError(f"{format_type(func)} is not a function")
+        if not args:
+            if isinstance(func, FunctionType) and func.curried is False and func.params:
+                raise TypeCheckError(f"function expected {len(func.params)} arguments but got 0")
+            return func  # A lambda applied to nothing is the lambda itself
+        if isinstance(func, FunctionType) and func.curried is False and len(func.params) != len(args):
+            raise TypeCheckError(f"function expected {len(func.params)} arguments but got {len(args)}")
+        if isinstance(func, FunctionType) and func.curried is True:
+            # One argument at a time
+            unify(func.params[0], args[0])
+            return self.apply(func.result, args[1:]) if len(args) > 1 else func.result
+        result = TypeVariable()
+        unify(func, FunctionType(args, result, None))
+        return result
+
+    def expect_scalar(self, t, where):
+        try:
+            unify(ScalarType(), t)
+        except TypeCheckError:
+            raise TypeCheckError(f"{where} must be an integer or boolean, not {format_type(t)}")
+
+    def free_variables(self, t):
+        t = prune(t)
+        if isinstance(t, TypeVariable):
+            return {t}
+        if isinstance(t, FunctionType):
+            variables = self.free_variables(t.result)
+            for param in t.params:
+                variables |= self.free_variables(param)
+            return variables
+        return set()
+
+    def free_in_globals(self):
+        variables = set()
+        for t, generalized in self.globals.values():
+            variables |= self.free_variables(t) - generalized
+        for t in self.pending.values():
+            variables |= self.free_variables(t)
+        return variables
+
+    def instantiate(self, t, generalized):
+        mapping = {variable: TypeVariable() for variable in generalized}
+
+        def copy(t):
+            t = prune(t)
+            if isinstance(t, TypeVariable):
+                return mapping.get(t, t)
+            if isinstance(t, ScalarType):
+                return ScalarType(t.tags)
+            return FunctionType([copy(param) for param in t.params], copy(t.result), t.curried)
+
+        return copy(t)
+
+    def fusible_nodes(self):
+        # Operator subtrees whose every occurrence in the program is scalar, down to the leaves,
+        # can be evaluated as a single Python expression
+        scalar = {}
+        for node, t in self.occurrences:
+            scalar[node] = scalar.get(node, True) and isinstance(prune(t), ScalarType)
+
+        fusible = {}
+
+        def check(node):
+            if node in fusible:
+                return fusible[node]
+            if isinstance(node, (IntegerLiteral, BooleanLiteral, Identifier)):
+                result = scalar.get(node, False)
+            elif isinstance(node, BinaryOperation):
+                result = scalar.get(node, False) and check(node.left) and check(node.right)
+            elif isinstance(node, UnaryOperation):
+                result = scalar.get(node, False) and check(node.operand)
+            elif isinstance(node, PrimitiveApplication):
+                result = scalar.get(node, False) and all([check(arg) for arg in node.args])
+            else:
+                result = False
+            fusible[node] = result
+            return result
+
+        return {node for node in scalar
+                if isinstance(node, (BinaryOperation, UnaryOperation, PrimitiveApplication)) and check(node)}
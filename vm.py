@@ -0,0 +1,213 @@
+from bytecode import BytecodeCompiler, BINARY_OPERATOR_SYMBOLS, PRIMITIVE_NAMES, LOAD_CONST, LOAD_LOCAL, \
+    LOAD_DEREF, LOAD_GLOBAL, STORE_GLOBAL, BINOP, NOT, JUMP, JUMP_IF_FALSE, CALL, TAIL_CALL, MAKE_CLOSURE, RETURN, \
+    PRIMITIVE, LET, END_LET
+from compiler import Frame, Function, OPERATORS
+from errors import trace_call
+from interpreter import Interpreter
+from primitives import PRIMITIVES
+from resolver import UNDEFINED
+
+
+BINARY_OPERATORS = [OPERATORS[symbol] for symbol in BINARY_OPERATOR_SYMBOLS]
+BUILTINS = [PRIMITIVES[name] for name in PRIMITIVE_NAMES]
+
+
+# A dispatch-loop virtual machine for CodeObjects. Calls push activations on an explicit stack,
+# so recursion depth is bounded by memory, and TAIL_CALL reuses the current activation.
+class VM:
+    def __init__(self, global_scope, limits=None):
+        self.global_scope = global_scope
+        self.limits = limits  # Meters calls, see limits.Limits, when set
+        self.binary_operators = BINARY_OPERATORS
+        self.builtins = BUILTINS  # (arity, implementation) of each builtin, by index
+        if limits is not None:
+            operators = limits.operators(OPERATORS)
+            self.binary_operators = [operators[symbol] for symbol in BINARY_OPERATOR_SYMBOLS]
+            primitives = limits.primitives(PRIMITIVES)
+            self.builtins = [primitives[name] for name in PRIMITIVE_NAMES]
+
+    def run(self, code, frame=None):
+        globals_ = self.global_scope.values
+        binary_operators = self.binary_operators
+        builtins = self.builtins
+        limits = self.limits
+        calls = []        # Suspended activations: (code, pc, frame, stack, pending, entry)
+        instructions = code.instructions
+        stack = []
+        pending = None    # Arguments still to be applied to this activation's result (currying)
+        entry = None      # The call that entered this activation, or the last one to replace it
+        pc = 0
+
+        op = None
+        try:
+            while True:
+                op = instructions[pc]
+                arg = instructions[pc + 1]
+                pc += 2
+
+                if op == LOAD_LOCAL:
+                    stack.append(frame.values[arg])
+
+                elif op == LOAD_CONST:
+                    stack.append(code.consts[arg])
+
+                elif op == BINOP:
+                    right = stack.pop()
+                    stack[-1] = binary_operators[arg](stack[-1], right)
+
+                elif op == LOAD_GLOBAL:
+                    value = globals_[arg]
+                    if value is UNDEFINED:
+                        raise NameError(f"Undefined variable: {self.global_name(arg)}")
+                    stack.append(value)
+
+                elif op == JUMP_IF_FALSE:
+                    if not stack.pop():
+                        pc = arg
+
+                elif op == JUMP:
+                    pc = arg
+
+                elif op == CALL or op == TAIL_CALL or op == RETURN:
+                    if op == RETURN:
+                        value = stack.pop()
+                        if pending is None:
+                            if not calls:
+                                return value
+                            code, pc, frame, stack, pending, entry = calls.pop()
+                            instructions = code.instructions
+                            stack.append(value)
+                            continue
+                        # Apply the result to the remaining curried arguments in place of this activation
+                        func, args, pending = value, pending, None
+                        op = TAIL_CALL
+                    else:
+                        args = stack[len(stack) - arg:] if arg else []
+                        del stack[len(stack) - arg:]
+                        func = stack.pop()
+
+                    if not isinstance(func, Function):
+                        raise TypeError(f"Expected a function or lambda expression, but got: {func}")
+
+                    if isinstance(func.params, tuple):  # Regular function call
+                        if len(func.params) != len(args):
+                            raise TypeError(f"Function expected {len(func.params)} arguments but got {len(args)}")
+                        callee_pending = None
+                    elif not args:  # A lambda applied to nothing is the lambda itself
+                        stack.append(func)
+                        continue
+                    else:  # Lambda expression, curried one argument at a time
+                        callee_pending = args[1:] or None
+                        args = args[:1]
+
+                    if limits is not None:
+                        limits.fuel -= 1
+                        if limits.fuel < 0:
+                            limits.refuel()
+                        if op == CALL and len(calls) >= limits.max_depth:
+                            raise limits.too_deep()
+                    if op == CALL:
+                        calls.append((code, pc, frame, stack, pending, entry))
+                        pending = callee_pending
+                    elif callee_pending is not None:
+                        pending = callee_pending + pending if pending is not None else callee_pending
+                    entry = code.sites.get(pc - 2, entry)
+                    code = func.body
+                    instructions = code.instructions
+                    frame = Frame(args, func.frame)
+                    stack = []
+                    pc = 0
+
+                elif op == NOT:
+                    stack[-1] = not stack[-1]
+
+                elif op == PRIMITIVE:
+                    arity, function = builtins[arg]
+                    args = stack[len(stack) - arity:]
+                    del stack[len(stack) - arity:]
+                    stack.append(function(*args))
+
+                elif op == LET:
+                    frame = Frame(stack[len(stack) - arg:], frame)
+                    del stack[len(stack) - arg:]
+
+                elif op == END_LET:
+                    frame = frame.parent
+
+                elif op == LOAD_DEREF:
+                    depth, slot = code.addresses[arg]
+                    outer = frame
+                    for _ in range(depth):
+                        outer = outer.parent
+                    stack.append(outer.values[slot])
+
+                elif op == MAKE_CLOSURE:
+                    function = code.functions[arg]
+                    captures = function.captures
+                    if captures is None:
+                        closure = frame
+                    elif captures:
+                        values = []
+                        for depth, slot in captures:
+                            enclosing = frame
+                            for _ in range(depth):
+                                enclosing = enclosing.parent
+                            values.append(enclosing.values[slot])
+                        closure = Frame(values, None)
+                    else:
+                        closure = None
+                    stack.append(Function(function.name, function.params, function, closure))
+
+                elif op == STORE_GLOBAL:
+                    globals_[arg] = stack.pop()
+
+                else:
+                    raise TypeError(f"Unknown opcode: {op}")
+        except Exception as e:
+            # The failing call if one was being entered, then each activation, innermost first,
+            # with the inlined bindings it is in and the call that entered it. A tail call
+            # replaces the caller's activation, so the caller is not in the trace.
+            failing = code.sites.get(pc - 2) if op == CALL or op == TAIL_CALL else None
+            if op == TAIL_CALL and failing is not None:
+                entry, failing = failing, None  # It was replacing this activation
+            self.trace(e, failing)
+            self.trace_activation(e, code, pc - 2, entry)
+            for caller, return_pc, _, _, _, caller_entry in reversed(calls):
+                self.trace_activation(e, caller, return_pc - 2, caller_entry)
+            raise
+
+    def trace(self, error, site):
+        if site is not None:
+            trace_call(error, site)
+
+    def trace_activation(self, error, code, offset, entry):
+        for start, end, site in code.lets:
+            if start < offset < end:
+                trace_call(error, site)
+        self.trace(error, entry)
+
+    def global_name(self, slot):
+        for name, index in self.global_scope.slots.items():
+            if index == slot:
+                return name
+        return f"<global {slot}>"
+
+
+# Compiles each top-level statement to bytecode and runs it on the VM
+class VMInterpreter(Interpreter):
+    def __init__(self, ast, limits=None):
+        super().__init__(ast, limits)
+        self.compiler = BytecodeCompiler()
+        self.vm = VM(self.compiler.resolver.global_scope, limits)
+        # Top-level statements run outside of any function frame
+        self.global_env = None
+
+    def interpret(self):
+        if isinstance(self.ast, list):
+            self.compiler.resolver.declare_globals(self.ast)
+        else:  # A stream of statements
+            self.compiler.resolver.strict = False
+        return super().interpret()
+
+    def eval(self, node, env):
+        return self.vm.run(self.compiler.compile_statement(node), env)